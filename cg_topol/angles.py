@@ -26,62 +26,78 @@ from spline_term import SplineTerm
 from bspline import Bspline
 from edge import modprod
 from concat_term import FFconcat
+from sparse_design import band_block, band_sum, local_index, \
+                          scatter_atoms, index_array, displacements
 from numpy import *
 
+# Angle cosines (order 0), or cosines and their derivatives
+# (order 1), of all angles ij -- the geometry of every angle term.
+def angle_geom(x, ij, order=1):
+    if order == 0:
+        return (anglec(angle_vecs(x, ij)),)
+    return danglec(angle_vecs(x, ij))
+
 # Adds the "angle" forcefield term into the list of atomic interactions.
 class SplineAngle(SplineTerm):
     def __init__(self, name, angs):
         SplineTerm.__init__(self, name, Bspline(4), 90, -1.0, 2.0, 0)
         self.angs = angs
+        self.ij = index_array(angs, 3)
+        self.atoms, self.loc = local_index(self.ij)
+
+    # Angle cosines of ij, shared by all angle terms
+    # (see FFconcat.geometry).
+    geom = staticmethod(angle_geom)
 
     def energy(self, c, x): # Requires commit.
         self.f.c = c
-        A = anglec(array([[x[...,i,:]-x[...,j,:],\
-               x[...,k,:]-x[...,j,:]] for i,j,k in self.angs]))
+        A = anglec(angle_vecs(x, self.ij))
         return sum(self.f.y(A), -1)
     
     def force(self, c, x):
         self.f.c = c
-        a, da = danglec(array([[x[...,i,:]-x[...,j,:],\
-                x[...,k,:]-x[...,j,:]] for i,j,k in self.angs]))
+        a, da = danglec(angle_vecs(x, self.ij))
         u, du = self.f.y(a, 1)
 
         en = sum(u, -1)
-        F = zeros(x.shape)
-        for z,(i,j,k) in enumerate(self.angs):
-            F[...,i,:] -= du[z]*da[...,z,0,:]
-            F[...,j,:] += du[z]*sum(da[...,z,:,:],-2)
-            F[...,k,:] -= du[z]*da[...,z,1,:]
+        dg = stack([da[...,0,:], -sum(da,-2), da[...,1,:]], -2)
+        F = scatter_atoms(x.shape, self.ij, -du[...,newaxis,newaxis]*dg)
         return en, F
 
     # The design array multiplies the spline coefficients to produce the
     # total bonded energy/force.
-    def design(self, x, order=0):
+    def design(self, x, order=0, geom=None):
         if order == 0:
-            a = anglec(array([[x[...,i,:]-x[...,j,:],\
-                x[...,k,:]-x[...,j,:]] for i,j,k in self.angs]))
+            if geom is None:
+                geom = self.geom(x, self.ij, 0)
+            a = geom[0]
             spl = self.spline(a, order)
             A = sum(spl,-2) # Sum over all atoms in ea. structure.
             return A
         elif order == 1:
-            Ad = []
-            Ad = zeros(x.shape+(self.f.n,))
-            a,da = danglec(array([[x[...,i,:]-x[...,j,:],\
-                x[...,k,:]-x[...,j,:]] for i,j,k in self.angs]))
-            spl, dspl = self.spline(a, order)
-            for z,(i,j,k) in enumerate(self.angs):
-                Ad[...,i,:,:] += da[...,z,0,:,newaxis] \
-                                * dspl[...,z,newaxis,:]
-                Ad[...,j,:,:] -= sum(da[...,z,:,:],-2)[...,newaxis] \
-                                * dspl[...,z,newaxis,:]
-                Ad[...,k,:,:] += da[...,z,1,:,newaxis] \
-                                * dspl[...,z,newaxis,:]
-            A = sum(spl,-2)
-            return A, Ad
+            A, Ad = self.design_sparse(x, geom)
+            return A, Ad.todense()
         else:
             raise RuntimeError, "Error! >1 energy derivative not "\
                                 "supported."
 
+    # Force design, stored only for the atoms in self.angs.
+    def design_sparse(self, x, geom=None, dtype=float64):
+        sh = x.shape + (self.f.n,)
+        if geom is None:
+            geom = self.geom(x, self.ij)
+        a, da = geom
+        col, spl = self.spline_band(a, 1)
+        dg = array([da[...,0,:], -sum(da,-2), da[...,1,:]])
+        Ad = band_block(sh, self.atoms, self.loc, moveaxis(dg, 0, -2),
+                        col, spl[1], dtype)
+        return band_sum(sh, col, spl[0]), Ad
+
+# Bond vectors, [x[i]-x[j], x[k]-x[j]], of all angles
+# ij : Array Int (M, 3).
+def angle_vecs(x, ij):
+    return displacements(x, ij, [(1,0), (1,2)])
+
 def anglec(x):
 	if len(x.shape) > 3:
 		trns = range(len(x.shape))
@@ -1,8 +1,17 @@
 from spline_term import SplineTerm
 from bspline import Bspline
 from concat_term import FFconcat
+from sparse_design import band_block, band_sum, local_index, \
+                          scatter_atoms, index_array, displacements
 from numpy import *
 
+# Bond lengths (order 0), or lengths and their derivatives (order 1),
+# of all edges ij -- the geometry of every bond-like term.
+def bond_geom(x, ij, order=1):
+    if order == 0:
+        return (bond(bond_vecs(x, ij)),)
+    return dbond(bond_vecs(x, ij))
+
 # Single bond term type shared by all edges in the list
 # e.g. C-C, or C-H
 class SplineBond(SplineTerm):
@@ -10,44 +19,56 @@ class SplineBond(SplineTerm):
         # internal vars
         SplineTerm.__init__(self, name, Bspline(4), 40, 0.0, 4.0, 2)
         self.edges = edges
+        self.ij = index_array(edges, 2)
+        self.atoms, self.loc = local_index(self.ij)
+
+    # Lengths of the edges ij (and their derivatives), computed once
+    # per chunk for all bond terms by FFconcat.geometry.
+    geom = staticmethod(bond_geom)
 
     def energy(self, c, x):
         self.f.c = c
-        A = bond(array([x[...,j,:]-x[...,i,:] for i,j in self.edges]))
+        A = bond(bond_vecs(x, self.ij))
         return sum(self.f.y(A), -1)
 
     def force(self, c, x):
         self.f.c = c
-        b, db = dbond(array([x[...,j,:]-x[...,i,:] for i,j in self.edges]))
+        b, db = dbond(bond_vecs(x, self.ij))
         u, du = self.f.y(b, 1)
 
         en = sum(u, -1)
-        F = zeros(x.shape)
-        for k, (i,j) in enumerate(self.edges):
-            F[...,i,:] += du[k]*db[...,k,:]
-            F[...,j,:] -= du[k]*db[...,k,:]
-
+        dg = stack([-db, db], -2)
+        F = scatter_atoms(x.shape, self.ij, -du[...,newaxis,newaxis]*dg)
         return en, F
 
-    def design(self, x, order=0):
+    def design(self, x, order=0, geom=None):
         if order == 0:
-            b = bond(array([x[...,j,:]-x[...,i,:] for i,j in self.edges]))
+            if geom is None:
+                geom = self.geom(x, self.ij, 0)
+            b = geom[0]
             spl = self.spline(b, order)
             return sum(spl, -2)
         elif order == 1:
-            Ad = zeros(x.shape + (self.params,))
-            b, db = dbond(array([x[...,j,:]-x[...,i,:] for i,j in self.edges]))
-            spl, dspl = self.spline(b, order)
-            for k, (i,j) in enumerate(self.edges):
-                Ad[...,i,:,:] -= db[...,k,:,newaxis] \
-                                * dspl[...,k,newaxis,:]
-                Ad[...,j,:,:] += db[...,k,:,newaxis] \
-                                * dspl[...,k,newaxis,:]
-            A = sum(spl, -2)
-            return A, Ad
+            A, Ad = self.design_sparse(x, geom)
+            return A, Ad.todense()
         raise RuntimeError, "Error! >1 energy derivative not "\
                               "supported."
 
+    # Force design, stored only for the atoms in self.edges.
+    def design_sparse(self, x, geom=None, dtype=float64):
+        sh = x.shape + (self.params,)
+        if geom is None:
+            geom = self.geom(x, self.ij)
+        b, db = geom
+        col, spl = self.spline_band(b, 1)
+        Ad = band_block(sh, self.atoms, self.loc, stack([-db, db], -2),
+                        col, spl[1], dtype)
+        return band_sum(sh, col, spl[0]), Ad
+
+# Bond vectors, x[j]-x[i], of all edges ij : Array Int (M, 2).
+def bond_vecs(x, ij):
+    return displacements(x, ij, [(0,1)])[:,0]
+
 def bond(x):
 	if len(x.shape) > 2:
 		trns = range(len(x.shape))
@@ -499,6 +499,46 @@ class spline_func:
 			ih *= self.ih
 		return Mp
 	
+	# Banded form of spline(x, nd).  Only the (spline order) nonzero
+	# coefficients of each point are computed.  Returns their columns,
+	# an int Nxorder array, and values, an nd+1xNxorder array.
+	# Out-of range points have all values zero.
+	def spline_band(self, x, nd=0):
+		if(len(x.shape) != 1):
+			raise ValueError, "Spline passed != 1 dim. array!"
+		
+		s = (x-self.x0)*self.ih+self.shift
+		u = ceil(s) # floaing point
+		M = self.spl.calc_splcoef(u-s, nd)
+		col = u.astype(int)[:,newaxis] \
+			+ (arange(self.spl.order)-self.spl.order)[newaxis,:]
+		if self.periodic: # Wrap out-of range points back in range.
+			col %= self.n
+		else: # Discard out-of range points.
+			lo = x < self.rng[0]
+			hi = x > self.rng[1]
+			if self.verb and any(lo):
+				print "Warning! %d points are smaller "\
+					"than min of spline range for "\
+					"type id %s"%(sum(lo), self.id)
+			if self.verb and any(hi):
+				print "Warning! %d points are larger than max "\
+					"of spline range for type id %s"%(\
+						sum(hi), self.id)
+			M[lo | hi] = 0.0
+			M[(col < 0) | (col >= self.n)] = 0.0
+			col = clip(col, 0, self.n-1)
+		
+		# Make derivative index 1st dimension.
+		M = transpose(M, (2,0,1))
+		
+		# Multiply by appropriate powers of du/dx
+		ih = self.ih
+		for i in range(1,nd+1):
+			M[i] *= ih
+			ih *= self.ih
+		return col, M
+	
 	# Returns the vector to be multiplied by the spline
 	# coefficients, corresponding to integration over y^{(n)}(x) * x**m.
 	def spl_integral(self, x, m=0):
@@ -6,6 +6,7 @@ from torsions import SplineTorsion
 from angles import SplineAngle
 from pairs import SplinePair
 from concat_term import FFconcat
+from sparse_design import BlockDesign
 
 from poly_term import read_poly_term
 from pbonds import PolyBond, PolyUB
@@ -1,4 +1,5 @@
-from numpy import array, concatenate, zeros
+from numpy import array, concatenate, zeros, unique, take, float64
+from sparse_design import BlockDesign
 
 # The central object in the fitting is the FFTerm module,
 # which is any class implementing the following API.
@@ -26,10 +27,21 @@ from numpy import array, concatenate, zeros
 #     energy : Array Float (params,) -> Array Float (N,3) -> Float,
 #     force  : Array Float (params,) -> Array Float (N,3) -> Array Float (N,3),
 #     design : Array Float (N, 3) -> order : Int ->
-#               {|} Array Float (1,params), order == 0
-#               {|} Array Float (N,3,params), order == 1
+#               {|} Array Float (params,), order == 0
+#               {|} (Array Float (params,), Array Float (N,3,params)),
+#                                          order == 1
 #               {|} Error
 #          -- energy / force design matrix
+#     design_sparse : Array Float (N, 3) -> [dtype] -> (Array Float (params,),
+#                                            BlockDesign (N,3,params))
+#          -- optional, order 1 design storing only the atoms touched,
+#             with the force design built as dtype (default float64)
+#     geom   : Array Float (N, 3) -> ij : Array Int (M, R) -> order : Int ->
+#               (Array Float (M,)[, Array Float (M, R', 3)])
+#          -- optional, a module-level function (e.g. bonds.bond_geom)
+#             shared by all terms with the same geometry, with
+#             design(x, order, geom) and design_sparse(x, geom)
+#             accepting geom(x, self.ij, order)
 #   }
 # concatenate FFTerms
 class FFconcat:
@@ -68,6 +80,59 @@ class FFconcat:
             self.ineqs += map(lambda u: pad(u, i, self.params), t.ineqs)
             i += t.params
 
+        # Group the interactions of all terms by their geometry
+        # function, t.geom (e.g. bonds.bond_geom).
+        # shared : {geom : Array Int (M, R) -- unique interactions}
+        # gidx   : {id(term) : (geom, Array Int -- its rows in shared)}
+        groups = {}
+        for t in self.leaves():
+            if hasattr(t, "geom"):
+                groups.setdefault(t.geom, []).append(t)
+        self.shared = {}
+        self.gidx = {}
+        for g, ts in groups.iteritems():
+            u, inv = unique(concatenate([t.ij for t in ts]), axis=0,
+                            return_inverse=True)
+            self.shared[g] = u
+            i = 0
+            for t in ts:
+                self.gidx[id(t)] = (g, inv[i:i+len(t.ij)])
+                i += len(t.ij)
+
+    # All (non-FFconcat) terms, in order.
+    def leaves(self):
+        r = []
+        for t in self.terms:
+            if isinstance(t, FFconcat):
+                r += t.leaves()
+            else:
+                r.append(t)
+        return r
+
+    # Bond lengths, angle cosines and torsion cosines (and their
+    # derivatives) of one chunk, x, computed once for the unique
+    # interactions of each kind and handed to every term using them,
+    # e.g. PolyBond and SplineBond over the same edges, or all the
+    # per-type bond terms of a molecule in a single call.
+    # returns {id(term) : geom(x, term.ij, order)}
+    def geometry(self, x, order=0):
+        G = {}
+        for g, u in self.shared.iteritems():
+            G[g] = g(x, u, order)
+        geom = {}
+        for n, (g, idx) in self.gidx.iteritems():
+            ax = G[g][0].ndim - 1 # interaction axis
+            geom[n] = tuple(take(a, idx, ax) for a in G[g])
+        return geom
+
+    # Extra arguments to t.design and t.design_sparse.
+    def geom_args(self, t, geom):
+        if isinstance(t, FFconcat):
+            return (geom,)
+        if id(t) in geom:
+            return (geom[id(t)],)
+        return ()
+
     # Misc. reductions
     def energy(self, c, x):
         E = 0.0
@@ -84,14 +149,17 @@ class FFconcat:
             i += t.params
         return F
 
-    def design(self, x, order=0):
+    # geom is passed down from an enclosing FFconcat.
+    def design(self, x, order=0, geom=None):
+        if geom is None:
+            geom = self.geometry(x, min(order, 1))
         if order == 0:
-            return concatenate([t.design(x, order) \
+            return concatenate([t.design(x, order, *self.geom_args(t, geom)) \
                                  for t in self.terms], axis=-1)
         else:
             r = [[] for i in range(order+1)]
             for t in self.terms:
-                u = t.design(x, order)
+                u = t.design(x, order, *self.geom_args(t, geom))
                 if not isinstance(u[0], list):
                     for i in range(order+1):
                         r[i].append(u[i])
@@ -100,6 +168,26 @@ class FFconcat:
                     r[i] = concatenate(r[i], axis=-1)
             return r
 
+    # Terms without a design_sparse have their dense design wrapped.
+    # The force design is built with the given dtype (e.g. float32).
+    def design_sparse(self, x, geom=None, dtype=float64):
+        if geom is None:
+            geom = self.geometry(x, 1)
+        A = [zeros(x.shape[:-2] + (0,))]
+        Ad = BlockDesign(x.shape + (self.params,))
+        i = 0
+        for t in self.terms:
+            if hasattr(t, "design_sparse"):
+                u, ud = t.design_sparse(x, *self.geom_args(t, geom),
+                                        dtype=dtype)
+            else:
+                u, ud = t.design(x, 1, *self.geom_args(t, geom))
+                ud = BlockDesign.from_dense(ud.astype(dtype))
+            A.append(u)
+            Ad.blocks += ud.shift(i, self.params).blocks
+            i += t.params
+        return concatenate(A, axis=-1), Ad
+
 def pad(x, st, sz):
     u = zeros(sz)
     u[st:st+len(x)] = x
@@ -29,6 +29,7 @@ from bonds import bond, dbond
 from edge import srt2
 from pairs import calc_delta, ex_gen
 from concat_term import FFconcat
+from sparse_design import band_block, band_sum, local_index
 from numpy import *
 from ewsum import lat_pts
 
@@ -58,12 +59,12 @@ class LJPair(PolyTerm):
     def energy(self, c, x):
         delta = calc_delta(x, self.edges, self.excl, self.L)
         b = bond(delta)**-6
-        return sum(self.f.y(c, b), -1)
+        return sum(self.y(c, b), -1)
 	
     def force(self, c, x):
         delta = calc_delta(x, self.edges, self.excl, self.L)
         r, db = dbond(delta) # r, dr/dx
-        u, du = self.f.y(c, r**-6, 1) # f(r^-6), df/du (u = r^-6)
+        u, du = self.y(c, r**-6, 1) # f(r^-6), df/du (u = r^-6)
         # du/dr = -6 r^-7
         du *= -6*r**-7
 
@@ -82,19 +83,21 @@ class LJPair(PolyTerm):
         if order == 0:
             return sum(self.spline(bond(delta)**-6, order), -2)
         elif order == 1:
-            Ad = zeros(x.shape + (self.params,))
-            r, db = dbond(delta) # r, dr/dx
-            spl, dspl = self.spline(r**-6, order) # D(r^-6), dD(r^-6)/du
-            dspl *= -6*r[...,newaxis]**-7 # du/dr
-            for k,(i,j) in enumerate(ex_gen(self.edges, self.excl)): # dD/dx
-                Ad[...,i,:,:] -= db[...,k,:,newaxis] \
-                                * dspl[...,k,newaxis,:]
-                Ad[...,j,:,:] += db[...,k,:,newaxis] \
-                                * dspl[...,k,newaxis,:]
-            assert k+1 == len(delta)
-            A = sum(spl, -2)
-            return A, Ad
+            A, Ad = self.design_sparse(x)
+            return A, Ad.todense()
         else:
             raise RuntimeError, "Error! >1 energy derivative not "\
                                   "supported."
 
+    # Force design, stored only for the atoms in the pair list.
+    def design_sparse(self, x, dtype=float64):
+        delta = calc_delta(x, self.edges, self.excl, self.L)
+        atoms, loc = local_index(ex_gen(self.edges, self.excl))
+        sh = x.shape + (self.params,)
+        r, db = dbond(delta) # r, dr/dx
+        col, spl = self.spline_band(r**-6, 1) # D(r^-6), dD(r^-6)/du
+        spl[1] *= -6*r[...,newaxis]**-7 # du/dr
+        assert len(loc) == len(delta)
+        Ad = band_block(sh, atoms, loc, stack([-db, db], -2), col, spl[1],
+                        dtype)
+        return band_sum(sh, col, spl[0]), Ad
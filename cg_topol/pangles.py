@@ -26,62 +26,68 @@ from poly_term import PolyTerm
 from bspline import Bspline
 from edge import modprod
 from concat_term import FFconcat
+from sparse_design import band_block, band_sum, local_index, \
+                          scatter_atoms, index_array
+from angles import angle_vecs, anglec, danglec, angle_geom
 from numpy import *
 
 # Adds the "angle" forcefield term into the list of atomic interactions.
 class PolyAngle(PolyTerm):
+    rng = (0.0, pi)
+
     def __init__(self, name, angs):
         PolyTerm.__init__(self, name, 2)
         self.angs = angs
+        self.ij = index_array(angs, 3)
+        self.atoms, self.loc = local_index(self.ij)
 	self.ineqs = [array([0.,  0.0, 1.0]),
 		      array([0., -1.0, 0.0])]
 
+    # Shares the cosines with SplineAngle -- design takes the arccos.
+    geom = staticmethod(angle_geom)
+
     def energy(self, c, x):
-        A = angle(array([[x[...,i,:]-x[...,j,:],\
-                          x[...,k,:]-x[...,j,:]] for i,j,k in self.angs]))
-        return sum(self.f.y(c, A), -1)
+        A = angle(angle_vecs(x, self.ij))
+        return sum(self.y(c, A), -1)
     
     def force(self, c, x):
-        a, da = dangle(array([[x[...,i,:]-x[...,j,:],\
-                               x[...,k,:]-x[...,j,:]] for i,j,k in self.angs]))
-        u, du = self.f.y(c, a, 1)
+        a, da = dangle(angle_vecs(x, self.ij))
+        u, du = self.y(c, a, 1)
 
         en = sum(u, -1)
-        F = zeros(x.shape)
-        for z,(i,j,k) in enumerate(self.angs):
-            F[...,i,:] -= du[z]*da[...,z,0,:]
-            F[...,j,:] += du[z]*sum(da[...,z,:,:],-2)
-            F[...,k,:] -= du[z]*da[...,z,1,:]
+        dg = stack([da[...,0,:], -sum(da,-2), da[...,1,:]], -2)
+        F = scatter_atoms(x.shape, self.ij, -du[...,newaxis,newaxis]*dg)
         return en, F
 
     # The design array multiplies the spline coefficients to produce the
     # total bonded energy/force.
-    def design(self, x, order=0):
+    def design(self, x, order=0, geom=None):
         if order == 0:
-            a = angle(array([[x[...,i,:]-x[...,j,:],\
-                              x[...,k,:]-x[...,j,:]] for i,j,k in self.angs]))
+            if geom is None:
+                geom = self.geom(x, self.ij, 0)
+            a = arccos(geom[0])
             spl = self.spline(a, order)
             A = sum(spl,-2) # Sum over all atoms in ea. structure.
             return A
         elif order == 1:
-            Ad = []
-            Ad = zeros(x.shape+(self.params,))
-            a,da = dangle(array([ [x[...,i,:]-x[...,j,:],\
-                                   x[...,k,:]-x[...,j,:]] \
-                                 for i,j,k in self.angs]))
-            spl, dspl = self.spline(a, order)
-            for z,(i,j,k) in enumerate(self.angs):
-                Ad[...,i,:,:] += da[...,z,0,:,newaxis] \
-                                * dspl[...,z,newaxis,:]
-                Ad[...,j,:,:] -= sum(da[...,z,:,:],-2)[...,newaxis] \
-                                * dspl[...,z,newaxis,:]
-                Ad[...,k,:,:] += da[...,z,1,:,newaxis] \
-                                * dspl[...,z,newaxis,:]
-            A = sum(spl,-2)
-            return A, Ad
+            A, Ad = self.design_sparse(x, geom)
+            return A, Ad.todense()
         else:
             raise RuntimeError, "Error! >1 energy derivative not "\
                                 "supported."
+
+    # Force design, stored only for the atoms in self.angs.
+    def design_sparse(self, x, geom=None, dtype=float64):
+        sh = x.shape + (self.params,)
+        if geom is None:
+            geom = self.geom(x, self.ij)
+        a, da = acos_angle(*geom)
+        col, spl = self.spline_band(a, 1)
+        dg = array([da[...,0,:], -sum(da,-2), da[...,1,:]])
+        Ad = band_block(sh, self.atoms, self.loc, moveaxis(dg, 0, -2),
+                        col, spl[1], dtype)
+        return band_sum(sh, col, spl[0]), Ad
+
 def angle(x):
     if len(x.shape) > 3:
             trns = range(len(x.shape))
@@ -92,16 +98,8 @@ def angle(x):
     return arccos(cth)
 
 def dangle(x):
-    if len(x.shape) > 3:
-        trns = range(len(x.shape))
-        trns = trns[2:-1]+trns[:2]+trns[-1:]
-        x = transpose(x, trns)
-    rijk_inv = 1.0/sqrt(sum(x*x,-1)) # x.shape by 2
-    x *= rijk_inv[..., newaxis] # Normalize x.
-    cth = sum(x[...,0,:]*x[...,1,:],-1) # x.shape vector of cosines.
-    A = cth[...,newaxis,newaxis]*x # Future derivatives.
-    A[...,0,:] = x[...,1,:]-A[...,0,:]
-    A[...,1,:] = x[...,0,:]-A[...,1,:]
-    A *= rijk_inv[..., newaxis] # d(cth) / di and dk
-    return arccos(cth), -A/sqrt(1.0-cth*cth)[...,newaxis,newaxis]
+    return acos_angle(*danglec(x))
 
+# The angle and its derivatives, from its cosine, c, and dc.
+def acos_angle(c, dc):
+    return arccos(c), -dc/sqrt(1.0-c*c)[...,newaxis,newaxis]
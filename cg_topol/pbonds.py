@@ -2,7 +2,9 @@ from poly_term import PolyTerm
 from bspline import Bspline
 from concat_term import FFconcat
 from numpy import *
-from bonds import bond, dbond
+from bonds import bond, dbond, bond_vecs, bond_geom
+from sparse_design import band_block, band_sum, local_index, \
+                          scatter_atoms, index_array
 
 # Single bond term type shared by all edges in the list
 # e.g. C-C, or C-H
@@ -13,47 +15,56 @@ class PolyBond(PolyTerm):
 	self.ineqs = [array([0.,  0.0, 1.0]),
 		      array([0., -1.0, 0.0])]
         self.edges = edges
+        self.ij = index_array(edges, 2)
+        self.atoms, self.loc = local_index(self.ij)
+
+    # The same geometry as SplineBond, so the two can share it.
+    geom = staticmethod(bond_geom)
 
     def energy(self, c, x):
-        A = bond(array([x[...,j,:]-x[...,i,:] for i,j in self.edges]))
-        return sum(self.f.y(c, A), -1)
+        A = bond(bond_vecs(x, self.ij))
+        return sum(self.y(c, A), -1)
 
     def force(self, c, x):
-        b, db = dbond(array([x[...,j,:]-x[...,i,:] for i,j in self.edges]))
-        u, du = self.f.y(c, b, 1)
+        b, db = dbond(bond_vecs(x, self.ij))
+        u, du = self.y(c, b, 1)
 
         en = sum(u, -1)
-        F = zeros(x.shape)
-        for k, (i,j) in enumerate(self.edges):
-            F[...,i,:] += du[k]*db[...,k,:]
-            F[...,j,:] -= du[k]*db[...,k,:]
-
+        dg = stack([-db, db], -2)
+        F = scatter_atoms(x.shape, self.ij, -du[...,newaxis,newaxis]*dg)
         return en, F
 
-    def design(self, x, order=0):
+    def design(self, x, order=0, geom=None):
         if order == 0:
-            b = bond(array([x[...,j,:]-x[...,i,:] for i,j in self.edges]))
+            if geom is None:
+                geom = self.geom(x, self.ij, 0)
+            b = geom[0]
             spl = self.spline(b, order)
             return sum(spl, -2)
         elif order == 1:
-            Ad = zeros(x.shape + (self.params,))
-            b, db = dbond(array([x[...,j,:]-x[...,i,:] for i,j in self.edges]))
-            spl, dspl = self.spline(b, order)
-            for k, (i,j) in enumerate(self.edges):
-                Ad[...,i,:,:] -= db[...,k,:,newaxis] \
-                                * dspl[...,k,newaxis,:]
-                Ad[...,j,:,:] += db[...,k,:,newaxis] \
-                                * dspl[...,k,newaxis,:]
-            A = sum(spl, -2)
-            return A, Ad
+            A, Ad = self.design_sparse(x, geom)
+            return A, Ad.todense()
         raise RuntimeError, "Error! >1 energy derivative not "\
                               "supported."
 
+    # Force design, stored only for the atoms in self.edges.
+    def design_sparse(self, x, geom=None, dtype=float64):
+        sh = x.shape + (self.params,)
+        if geom is None:
+            geom = self.geom(x, self.ij)
+        b, db = geom
+        col, spl = self.spline_band(b, 1)
+        Ad = band_block(sh, self.atoms, self.loc, stack([-db, db], -2),
+                        col, spl[1], dtype)
+        return band_sum(sh, col, spl[0]), Ad
+
 # UB is the same as a bond, but requires a different naming scheme.
 class PolyUB(PolyBond):
     def __init__(self, name, angles):
         PolyTerm.__init__(self, name, 2)
         self.edges = set([(i, k) for i,j,k in angles])
+        self.ij = index_array(self.edges, 2)
+        self.atoms, self.loc = local_index(self.ij)
 	self.ineqs = [array([0.,  0.0, 1.0]),
 		      array([0., -1.0, 0.0])]
 
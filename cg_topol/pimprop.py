@@ -26,13 +26,17 @@ from bspline import Bspline
 from concat_term import FFconcat
 from numpy import *
 import numpy.linalg as la
-from ptorsions import torsionc, dtorsionc
+from ptorsions import torsionc, dtorsionc, tor_vecs, torsion_geom
 from torsions import cross_product
+from sparse_design import band_block, band_sum, local_index, \
+                          scatter_atoms, index_array
 
 # Adds the "pimprop" forcefield term into the list of atomic interactions.
 class PolyImprop(PolyTerm):
     def __init__(self, name, tors):
         self.tors = tors
+        self.ij = index_array(tors, 4)
+        self.atoms, self.loc = local_index(self.ij)
 
         self.hyp_params = 0
         self.params = 1
@@ -43,64 +47,56 @@ class PolyImprop(PolyTerm):
         self.pri_rank = []
         self.ind = []
 	
+    # Shares the torsion cosines with PolyTorsion (see acos_tor).
+    geom = staticmethod(torsion_geom)
+
     def energy(self, c, x):
-        A = atorsion(array([[x[...,i,:]-x[...,j,:],\
-                             x[...,k,:]-x[...,j,:],\
-                             x[...,l,:]-x[...,k,:]] \
-                                 for i,j,k,l in self.tors]))
-        return self.c[0]*sum(A*A, -1)
+        A = atorsion(tor_vecs(x, self.ij))
+        return c[0]*sum(A*A, -1)
     
     def force(self, c, x):
-        t, dt = datorsion(array([[x[...,i,:]-x[...,j,:],\
-                                  x[...,k,:]-x[...,j,:],\
-                                  x[...,l,:]-x[...,k,:]] \
-                                  for i,j,k,l in self.tors]))
-        u, du = self.c[0]*t*t, self.c[0]*2.0*t
+        t, dt = datorsion(tor_vecs(x, self.ij))
+        u, du = c[0]*t*t, c[0]*2.0*t
         en = sum(u, -1)
-        F = zeros(x.shape)
-        for z,(i,j,k,l) in enumerate(alist):
-            F[...,i,:] -= du[z]*dt[...,z,0,:]
-            F[...,j,:] += du[z]*(dt[...,z,1,:] + dt[...,z,0,:])
-            F[...,k,:] -= du[z]*(dt[...,z,1,:] - dt[...,z,2,:])
-            F[...,l,:] -= du[z]*dt[...,z,2,:]
+        dg = stack([dt[...,0,:], -(dt[...,1,:]+dt[...,0,:]),
+                    dt[...,1,:]-dt[...,2,:], dt[...,2,:]], -2)
+        F = scatter_atoms(x.shape, self.ij, -du[...,newaxis,newaxis]*dg)
         return en, F
     
     # The design array multiplies the spline coefficients to produce the
     # total bonded energy/force.
-    def design(self, x, order=0):
+    def design(self, x, order=0, geom=None):
         A = []
         if order == 0:
-            tor = atorsion(array([[x[...,i,:]-x[...,j,:],\
-                                   x[...,k,:]-x[...,j,:],\
-                                   x[...,l,:]-x[...,k,:]] \
-                                     for i,j,k,l in self.tors]))
+            if geom is None:
+                geom = self.geom(x, self.ij, 0)
+            tor = arccos(geom[0])
             return sum(self.spline(tor, order),-2)
         elif order == 1:
-            Ad = zeros(x.shape+(self.params,))
-            t, dt = datorsion(array([[x[...,i,:]-x[...,j,:],\
-                                      x[...,k,:]-x[...,j,:],\
-                                      x[...,l,:]-x[...,k,:]] \
-                                         for i,j,k,l in self.tors]))
-            spl, dspl = self.spline(t, order)
-            for z,(i,j,k,l) in enumerate(self.tors):
-                Ad[...,i,:,:] += dt[...,z,0,:,newaxis] \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,j,:,:] -= (dt[...,z,1,:,newaxis]+dt[...,z,0,:,newaxis]) \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,k,:,:] += (dt[...,z,1,:,newaxis]-dt[...,z,2,:,newaxis]) \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,l,:,:] += dt[...,z,2,:,newaxis] \
-                                        * dspl[...,z,newaxis,:]
-            A = sum(spl, -2)
-            return A, Ad
+            A, Ad = self.design_sparse(x, geom)
+            return A, Ad.todense()
         else:
             raise RuntimeError, "Error! >1 energy derivative not "\
                                   "supported."
 
+    # Force design, stored only for the atoms in self.tors.
+    def design_sparse(self, x, geom=None, dtype=float64):
+        sh = x.shape + (self.params,)
+        if geom is None:
+            geom = self.geom(x, self.ij)
+        t, dt = acos_tor(*geom)
+        col, spl = self.spline_band(t, 1)
+        dg = array([dt[...,0,:], -(dt[...,1,:]+dt[...,0,:]),
+                    dt[...,1,:]-dt[...,2,:], dt[...,2,:]])
+        Ad = band_block(sh, self.atoms, self.loc, moveaxis(dg, 0, -2),
+                        col, spl[1], dtype)
+        return band_sum(sh, col, spl[0]), Ad
+
     # Used to construct vectors which multiply parameters.
-    # If x is a N-dim vector, the return value is an (nd+1)xNxP matrix
+    # If x is a N-dim vector, the return value is an (nd+1)xNxP matrix,
+    # or NxP for nd = 0, like SplineTerm.spline.
     def spline(self, x, nd=0):
-	if nd == None:
+	if nd == None or nd == 0:
 	    return x[..., newaxis]**2
         Mp = x[newaxis,...]**(2 - arange(nd+1).reshape([nd+1]+[1]*len(x.shape)))
         # d^n/dx^n [x^a] = x^{a-n} prod_{i=0}^{n-1} a - i
@@ -123,8 +119,11 @@ def atorsion(x):
 
 # derivative of cosine of torsion
 def datorsion(x):
-    x, dx = dtorsionc(x)
-    return arccos(x), -dx/sqrt(1.0-x*x)[...,newaxis,newaxis]
+    return acos_tor(*dtorsionc(x))
+
+# The torsion and its derivatives, from its cosine, c, and dc.
+def acos_tor(c, dc):
+    return arccos(c), -dc/sqrt(1.0-c*c)[...,newaxis,newaxis]
 
 # List out all improper terms (atoms with 3 bonds)
 def improper_terms(pdb, mkterm, tors=None):
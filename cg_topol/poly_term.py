@@ -1,6 +1,8 @@
 from numpy import *
 
 class PolyTerm:
+    rng = None # (lo, hi) of x, for terms where it is known
+
     def __init__(self, name, n):
         self.hyp_params = 0
         self.params = n+1
@@ -15,12 +17,13 @@ class PolyTerm:
 
     # Calculates deriviatives 0,...,n of the function.
     def y(self, c, x, nd=None):
-        return eval_poly(x, c, nd)
+        return dot(self.spline(x, nd), c)
 
     # Used to construct vectors which multiply parameters.
-    # If x is a N-dim vector, the return value is an (nd+1)xNxP matrix
+    # If x is a N-dim vector, the return value is an (nd+1)xNxP matrix,
+    # or NxP for nd = 0, like SplineTerm.spline.
     def spline(self, x, nd=0):
-        if nd == None:
+        if nd == None or nd == 0:
             return x[..., newaxis]**arange(self.params)
 
         Mp = x[...,newaxis,newaxis]**(arange(self.params)[:,newaxis] - arange(nd+1)[newaxis,:])
@@ -30,6 +33,20 @@ class PolyTerm:
             Mp[..., :, i+1:] *= (arange(self.params)-i)[:,newaxis]
         return transpose(Mp, [len(Mp.shape)-1,] + range(len(Mp.shape)-1))
 
+    # Same as spline(x, nd), in the banded form used by SplineTerm.
+    # All params columns are nonzero.
+    def spline_band(self, x, nd=1):
+        spl = self.spline(x, nd)
+        col = zeros(spl.shape[1:], int) + arange(spl.shape[-1])
+        return col, spl
+
+    # Points spanning rng, e.g. for writing energy tables,
+    # or None when the range is unknown.
+    def grid(self, n=100):
+        if self.rng is None:
+            return None
+        return linspace(self.rng[0], self.rng[1], n)
+
     def write(self, pre, c, mode='w'):
         #name = self.name.replace(' ', '-').replace('\t', '_'\
         #                    ).replace('\n', '')
@@ -26,6 +26,7 @@
 from numpy import *
 import numpy.linalg as la
 import numpy.random as rand
+from scipy.linalg import solve_triangular
 from ucgrad import write_matrix, write_list, stats
 
 # Looking back, the only confusing thing about this implementation
@@ -331,15 +332,10 @@ def orthonormalize(A, tol=1.0e-10):
 	return array(B)
 
 # Solve Ax=b, where A is lower diagonal.
+# b may hold several right-hand sides as columns.
 def forward_subst(A, b):
-	x = b.copy()
-	for i in range(len(x)):
-		x[i] = (x[i]-sum(A[i,:i,newaxis]*x[:i,...],0))/A[i,i]
-	return x
+	return solve_triangular(A, b, lower=True, check_finite=False)
 
 # Solve Ax=b, where A is upper diagonal.
 def back_subst(A, b):
-	x = b.copy()
-	for i in reversed(range(len(x))):
-		x[i] = (x[i]-sum(A[i,i+1:,newaxis]*x[i+1:,...],0))/A[i,i]
-	return x
+	return solve_triangular(A, b, lower=False, check_finite=False)
@@ -27,6 +27,8 @@ from concat_term import FFconcat
 from numpy import *
 import numpy.linalg as la
 from torsions import cross_product
+from sparse_design import band_block, band_sum, local_index, \
+                          scatter_atoms, index_array, displacements
 
 # [cos(n phi)] = V . [(cos phi)^n]
 #V = array([[ 1.,  0.,  0.,  0.,  0.,  0.,  0.],
@@ -56,68 +58,76 @@ def gen_constrain_n(n,m):
     un = [i for i in range(m) if i not in n]
     return transpose(W)[un] # gets a bunch of rows
 
+# Torsion cosines (order 0), or cosines and their derivatives
+# (order 1), of all torsions ij -- shared by the polynomial
+# torsion and improper terms.
+def torsion_geom(x, ij, order=1):
+    if order == 0:
+        return (torsionc(tor_vecs(x, ij)),)
+    return dtorsionc(tor_vecs(x, ij))
+
 # Adds the "tor" forcefield term into the list of atomic interactions.
 class PolyTorsion(PolyTerm):
+    rng = (-1.0, 1.0) # torsion cosines
+
     def __init__(self, name, tors, constrain_n=False):
         PolyTerm.__init__(self, name, 6)
         if constrain_n != False and constrain_n(name) is not None:
 	    self.constraints = gen_constrain_n(constrain_n(name),7)
         self.tors = tors
+        self.ij = index_array(tors, 4)
+        self.atoms, self.loc = local_index(self.ij)
 	
+    # Torsion cosines of ij, and their derivatives.
+    geom = staticmethod(torsion_geom)
+
     def energy(self, c, x):
-        A = torsionc(array([[x[...,i,:]-x[...,j,:],\
-                             x[...,k,:]-x[...,j,:],\
-                             x[...,l,:]-x[...,k,:]] \
-                                 for i,j,k,l in self.tors]))
-        return sum(self.f.y(c, A), -1)
+        A = torsionc(tor_vecs(x, self.ij))
+        return sum(self.y(c, A), -1)
     
     def force(self, c, x):
-        t, dt = dtorsionc(array([[x[...,i,:]-x[...,j,:],\
-                                  x[...,k,:]-x[...,j,:],\
-                                  x[...,l,:]-x[...,k,:]] \
-                                  for i,j,k,l in self.tors]))
-        u, du = self.f.y(c, t, 1)
+        t, dt = dtorsionc(tor_vecs(x, self.ij))
+        u, du = self.y(c, t, 1)
         en = sum(u, -1)
-        F = zeros(x.shape)
-        for z,(i,j,k,l) in enumerate(alist):
-            F[...,i,:] -= du[z]*dt[...,z,0,:]
-            F[...,j,:] += du[z]*(dt[...,z,1,:] + dt[...,z,0,:])
-            F[...,k,:] -= du[z]*(dt[...,z,1,:] - dt[...,z,2,:])
-            F[...,l,:] -= du[z]*dt[...,z,2,:]
+        dg = stack([dt[...,0,:], -(dt[...,1,:]+dt[...,0,:]),
+                    dt[...,1,:]-dt[...,2,:], dt[...,2,:]], -2)
+        F = scatter_atoms(x.shape, self.ij, -du[...,newaxis,newaxis]*dg)
         return en, F
     
     # The design array multiplies the spline coefficients to produce the
     # total bonded energy/force.
-    def design(self, x, order=0):
+    def design(self, x, order=0, geom=None):
         A = []
         if order == 0:
-            tor = torsionc(array([[x[...,i,:]-x[...,j,:],\
-                                   x[...,k,:]-x[...,j,:],\
-                                   x[...,l,:]-x[...,k,:]] \
-                                     for i,j,k,l in self.tors]))
+            if geom is None:
+                geom = self.geom(x, self.ij, 0)
+            tor = geom[0]
             return sum(self.spline(tor, order),-2)
         elif order == 1:
-            Ad = zeros(x.shape+(self.params,))
-            t, dt = dtorsionc(array([[x[...,i,:]-x[...,j,:],\
-                                      x[...,k,:]-x[...,j,:],\
-                                      x[...,l,:]-x[...,k,:]] \
-                                         for i,j,k,l in self.tors]))
-            spl, dspl = self.spline(t, order)
-            for z,(i,j,k,l) in enumerate(self.tors):
-                Ad[...,i,:,:] += dt[...,z,0,:,newaxis] \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,j,:,:] -= (dt[...,z,1,:,newaxis]+dt[...,z,0,:,newaxis]) \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,k,:,:] += (dt[...,z,1,:,newaxis]-dt[...,z,2,:,newaxis]) \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,l,:,:] += dt[...,z,2,:,newaxis] \
-                                        * dspl[...,z,newaxis,:]
-            A = sum(spl, -2)
-            return A, Ad
+            A, Ad = self.design_sparse(x, geom)
+            return A, Ad.todense()
         else:
             raise RuntimeError, "Error! >1 energy derivative not "\
                                   "supported."
 
+    # Force design, stored only for the atoms in self.tors.
+    def design_sparse(self, x, geom=None, dtype=float64):
+        sh = x.shape + (self.params,)
+        if geom is None:
+            geom = self.geom(x, self.ij)
+        t, dt = geom
+        col, spl = self.spline_band(t, 1)
+        dg = array([dt[...,0,:], -(dt[...,1,:]+dt[...,0,:]),
+                    dt[...,1,:]-dt[...,2,:], dt[...,2,:]])
+        Ad = band_block(sh, self.atoms, self.loc, moveaxis(dg, 0, -2),
+                        col, spl[1], dtype)
+        return band_sum(sh, col, spl[0]), Ad
+
+# Bond vectors, [x[i]-x[j], x[k]-x[j], x[l]-x[k]], of all
+# torsions ij : Array Int (M, 4).
+def tor_vecs(x, ij):
+    return displacements(x, ij, [(1,0), (1,2), (2,3)])
+
 # cosine of torsion
 def torsionc(x):
     trsp = range(len(x.shape))
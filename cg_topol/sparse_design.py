@@ -0,0 +1,223 @@
+# Block-sparse force design matrices.
+
+# This file is part of ForceSolve, Copyright (C) 2008 David M. Rogers.
+#
+#   ForceSolve is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ForceSolve is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ForceSolve (i.e. frc_solve/COPYING).
+#   If not, contact the author(s) immediately \at/ wantye \/ gmail.com or
+#   http://forceSolve.sourceforge.net/. And see http://www.gnu.org/licenses/
+#   for a copy of the GNU GPL.
+
+from numpy import *
+from scipy.sparse import coo_matrix, csr_matrix
+
+# Each term only moves the atoms in its own interaction list,
+# and only through its own parameters.  So the (..., N, 3, P)
+# force design is stored as a list of sparse blocks:
+#
+#   BlockDesign : {
+#     shape  : (..., N, 3, P), -- shape of the full design
+#     blocks : [(atoms : Array Int (n,), -- sorted, unique atom numbers
+#                c0    : Int,            -- first parameter column
+#                A     : csr_matrix (n*S*3, p))],
+#   }
+#
+# representing the array D with D[..., atoms, :, c0:c0+p] = A,
+# and zeros everywhere else.  Rows of A are ordered (atom, frame, xyz),
+# where S frames are the flattened leading (...) dimensions.
+# Blocks never share parameter columns.
+#
+# Spline terms build A directly from the few nonzero spline
+# coefficients of each interaction (see band_block), so neither the
+# dense design nor the dense D^T D contraction is ever formed.
+class BlockDesign:
+    def __init__(self, shape, blocks=[]):
+        self.shape = tuple(shape)
+        self.blocks = list(blocks)
+        self.S = int(prod(self.shape[:-3]))
+
+    # Wrap a dense design, keeping only atoms with non-zero rows.
+    def from_dense(Ad):
+        nz = Ad.reshape((-1,) + Ad.shape[-3:]) != 0.0
+        atoms = nonzero(nz.any(-1).any(-1).any(0))[0]
+        A = moveaxis(Ad[...,atoms,:,:], -3, 0).reshape((-1, Ad.shape[-1]))
+        return BlockDesign(Ad.shape, [(atoms, 0, csr_matrix(A))])
+    from_dense = staticmethod(from_dense)
+
+    # Shift all blocks to start at parameter 'c0' of a P-column design.
+    def shift(self, c0, P):
+        return BlockDesign(self.shape[:-1] + (P,),
+                [(a, c+c0, A) for a,c,A in self.blocks])
+
+    def astype(self, dtype):
+        return BlockDesign(self.shape,
+                [(a, c, A.astype(dtype)) for a,c,A in self.blocks])
+
+    def todense(self):
+        Ad = zeros(self.shape)
+        for a, c, A in self.blocks:
+            B = A.toarray().reshape((len(a),) + self.shape[:-3] \
+                                    + (3, A.shape[1]))
+            Ad[...,a,:,c:c+A.shape[1]] += moveaxis(B, 0, -3)
+        return Ad
+
+    # D *= w, where w is a scalar or broadcasts as (..., N, 1, 1).
+    def __imul__(self, w):
+        for a, c, A in self.blocks:
+            if isscalar(w):
+                A.data *= w
+                continue
+            wa = broadcast_to(w[...,a,:,:], \
+                              self.shape[:-3] + (len(a),3,1))[...,0]
+            wa = moveaxis(wa, -2, 0).reshape(-1)
+            A.data *= repeat(wa, diff(A.indptr))
+        return self
+
+    # Matrix-vector product with the parameters -- (..., N, 3).
+    def dot(self, c):
+        F = zeros(self.shape[:-1])
+        for a, c0, A in self.blocks:
+            f = A.dot(c[c0:c0+A.shape[1]])
+            F[...,a,:] += moveaxis(f.reshape((len(a),) \
+                                + self.shape[:-3] + (3,)), 0, -2)
+        return F
+
+    # Rows of a block belonging to its (local) atoms ia.
+    def rows(self, ia):
+        return (ia[:,newaxis]*(self.S*3) + arange(self.S*3)).reshape(-1)
+
+    # Add D^T D, summed over all atoms of each type, into
+    # D2 : (types, P, P).  tidx gives the type of each atom.
+    # Blocks are upcast to float64 before each product, so a float32
+    # design only loses precision in storage, not in the sums.
+    def type_gram(self, tidx, D2):
+        tidx = asarray(tidx)
+        for m, (a, c, A) in enumerate(self.blocks):
+            p = A.shape[1]
+            for n, (b, d, B) in enumerate(self.blocks[m:]):
+                q = B.shape[1]
+                ia, ib = overlap(a, b)
+                if len(ia) == 0:
+                    continue
+                ta = tidx[a[ia]]
+                for t in unique(ta):
+                    k = ta == t
+                    G = (A[self.rows(ia[k])].astype(float64, copy=False).T \
+                       * B[self.rows(ib[k])].astype(float64, copy=False)) \
+                            .toarray()
+                    D2[t, c:c+p, d:d+q] += G
+                    if n > 0:
+                        D2[t, d:d+q, c:c+p] += transpose(G)
+
+    # Add D^T F, summed over all atoms of each type, into
+    # DF : (types, P).  F has shape (..., N, 3).
+    def type_rhs(self, tidx, F, DF):
+        tidx = asarray(tidx)
+        for a, c, A in self.blocks:
+            ta = tidx[a]
+            for t in unique(ta):
+                k = nonzero(ta == t)[0]
+                f = moveaxis(F[...,a[k],:], -2, 0).reshape(-1)
+                Ak = A[self.rows(k)].astype(float64, copy=False)
+                DF[t, c:c+A.shape[1]] += Ak.T.dot(f)
+
+    # Add the CountSketch of D, taken separately over the atoms of each
+    # type, into SD : (types, m, P).  Row (..., i, xyz) of D is added
+    # to row h[..., i, xyz] of SD[tidx[i]] with sign sg[..., i, xyz].
+    def type_sketch(self, tidx, h, sg, SD):
+        tidx = asarray(tidx)
+        m = SD.shape[1]
+        for a, c, A in self.blocks:
+            ta = tidx[a]
+            for t in unique(ta):
+                k = nonzero(ta == t)[0]
+                hk = moveaxis(h[...,a[k],:], -2, 0).reshape(-1)
+                sk = moveaxis(sg[...,a[k],:], -2, 0).reshape(-1)
+                Sk = csr_matrix((sk, (hk, arange(len(hk)))), \
+                                shape=(m, len(hk)))
+                SD[t, :, c:c+A.shape[1]] += (Sk * A[self.rows(k)]).toarray()
+
+# Build the block for one term from its interactions.
+#   shape : (..., N, 3, P), -- shape of the full design
+#   atoms, loc : from local_index(interaction list [(i,j,...)])
+#   dg   : Array Float (..., M, R, 3), -- derivative of each
+#            interaction's coordinate wrt. the xyz of each of its R atoms
+#   col  : Array Int (..., M, W), -- columns of the W nonzero spline
+#   dspl : Array Float (..., M, W) -- derivatives, from spline_band
+#   dtype : of the stored values, which are also multiplied in it
+def band_block(shape, atoms, loc, dg, col, dspl, dtype=float64):
+    S = int(prod(shape[:-3]))
+    M, R = loc.shape
+    W = col.shape[-1]
+    dg   = dg.reshape((S, M, R, 3)).astype(dtype)
+    col  = col.reshape((S, M, 1, 1, W))
+    dspl = dspl.reshape((S, M, 1, 1, W)).astype(dtype)
+
+    row = (loc[newaxis,:,:,newaxis]*S \
+            + arange(S)[:,newaxis,newaxis,newaxis])*3 + arange(3)
+    A = coo_matrix(( (dg[...,newaxis]*dspl).reshape(-1),
+                     ( broadcast_to(row[...,newaxis], (S,M,R,3,W)).reshape(-1),
+                       broadcast_to(col, (S,M,R,3,W)).reshape(-1) ) ),
+                   shape=(len(atoms)*S*3, shape[-1])).tocsr()
+    return BlockDesign(shape, [(atoms, 0, A)])
+
+# Energy design, summing the banded spline values of all interactions.
+#   col, spl : Array (..., M, W) -- from spline_band
+# returns Array Float (..., P)
+def band_sum(shape, col, spl):
+    S = int(prod(shape[:-3]))
+    P = shape[-1]
+    idx = arange(S)[:,newaxis]*P + col.reshape((S,-1))
+    return bincount(idx.reshape(-1), spl.reshape(-1), S*P \
+                   ).reshape(shape[:-3] + (P,))
+
+# An interaction list, [(i,j,...)] of R atoms each, compiled
+# once into an Int array (M, R) for the gathers and scatters below.
+def index_array(ilist, R):
+    return array(list(ilist), int).reshape((-1, R))
+
+# Displacements x[..., ij[:,b], :] - x[..., ij[:,a], :] for each
+# pair of atom roles, (a, b), gathered for all M interactions at once.
+# returns Array Float (M, len(pairs), ..., 3), laid out like
+#   array([[x[...,b,:]-x[...,a,:] for a,b in pairs] for ... in ilist])
+def displacements(x, ij, pairs):
+    d = array([x[...,ij[:,b],:] - x[...,ij[:,a],:] for a,b in pairs])
+    return moveaxis(d, -2, 0)
+
+# Add the per-atom rows of every interaction into its atoms,
+#   F[..., ij[m,r], :] += g[..., m, r, :],
+# with one unbuffered scatter (add.at) per atom role, r, so that
+# atoms shared between interactions are summed correctly.
+#   shape : (..., N, 3[, P]) -- shape of F
+#   ij    : Array Int (M, R) -- interaction list, from index_array
+#   g     : Array Float (..., M, R, 3[, P])
+#   axis  : position of N in shape
+def scatter_atoms(shape, ij, g, axis=-2):
+    F = zeros(shape)
+    Fa = moveaxis(F, axis, 0) # view with atoms first
+    ga = moveaxis(g, [axis-1, axis], [0, 1]) # (M, R, ...)
+    for r in range(ij.shape[1]):
+        add.at(Fa, ij[:,r], ga[:,r])
+    return F
+
+# Positions of the common elements of two sorted, unique index arrays.
+def overlap(a, b):
+    ia = nonzero(in1d(a, b, assume_unique=True))[0]
+    return ia, searchsorted(b, a[ia])
+
+# Atom numbers touched by an interaction list, [(i,j,...)],
+# along with the list re-numbered to index those atoms.
+def local_index(ilist):
+    ij = array(list(ilist), int)
+    atoms, loc = unique(ij, return_inverse=True)
+    return atoms, loc.reshape(ij.shape)
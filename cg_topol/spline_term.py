@@ -1,4 +1,4 @@
-from numpy import reshape
+from numpy import reshape, arange
 import numpy.random as rand
 from bspline import spline_func
 
@@ -37,6 +37,19 @@ class SplineTerm:
             return reshape( spl, \
                     (spl.shape[0],) + x.shape + (spl.shape[-1],) )
 
+    # Banded form of spline(x, order) -- returns the columns,
+    # x.shape+(w,), and values, (order+1,)+x.shape+(w,), of the
+    # w nonzero spline coefficients at each point.
+    def spline_band(self, x, order=1):
+        col, spl = self.f.spline_band(reshape(x,x.size), order)
+        return reshape(col, x.shape + (col.shape[-1],)), \
+               reshape(spl, (spl.shape[0],) + x.shape + (spl.shape[-1],))
+
+    # Points spanning the range of f, e.g. for writing energy tables.
+    def grid(self, n=100):
+        lo, hi = self.f.rng
+        return lo + (hi - lo)*arange(n)/float(n)
+
     def write(self, pre, c):
         self.f.c = c
         self.f.write_spl(pre + self.name+".espl")
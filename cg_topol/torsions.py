@@ -27,6 +27,7 @@ from edge import modprod
 from spline_term import SplineTerm
 from bspline import Bspline
 from concat_term import FFconcat
+from sparse_design import scatter_atoms, index_array, displacements
 from numpy import *
 
 # Adds the "tor" forcefield term into the list of atomic interactions.
@@ -34,29 +35,20 @@ class SplineTorsion(SplineTerm):
     def __init__(self, name, tors):
         SplineTerm.__init__(self, name, Bspline(4), 180, None, 2*pi, 0)
         self.tors = tors
+        self.ij = index_array(tors, 4)
 	
     def energy(self, c, x):
         self.f.c = c
-        A = torsion(array([[x[...,i,:]-x[...,j,:],\
-                            x[...,j,:]-x[...,k,:],\
-                            x[...,l,:]-x[...,k,:]] \
-                                for i,j,k,l in self.tors]))
+        A = torsion(tor_vecs(x, self.ij))
         return sum(self.f.y(A), -1)
     
     def force(self, c, x):
         self.f.c = c
-        t, dt = dtorsion(array([[x[...,i,:]-x[...,j,:],\
-                                 x[...,j,:]-x[...,k,:],\
-                                 x[...,l,:]-x[...,k,:]] \
-                                 for i,j,k,l in self.tors]))
+        t, dt = dtorsion(tor_vecs(x, self.ij))
         u, du = self.f.y(t, 1)
         en = sum(u, -1)
-        F = zeros(x.shape)
-        for z,(i,j,k,l) in enumerate(alist):
-            F[...,i,:] -= du[z]*dt[...,z,0,:]
-            F[...,l,:] -= du[z]*dt[...,z,1,:]
-            F[...,j,:] += du[z]*dt[...,z,2,:]
-            F[...,k,:] -= du[z]*dt[...,z,3,:]
+        F = scatter_atoms(x.shape, self.ij, \
+                          -du[...,newaxis,newaxis]*tor_roles(dt))
         return en, F
     
     # The design array multiplies the spline coefficients to produce the
@@ -65,33 +57,24 @@ class SplineTorsion(SplineTerm):
     def design_tor(self, x, order=0):
         A = []
         if order == 0:
-            tor = torsion(array([[x[...,i,:]-x[...,j,:],\
-                                  x[...,j,:]-x[...,k,:],\
-                                  x[...,l,:]-x[...,k,:]] \
-                                    for i,j,k,l in self.tors]))
+            tor = torsion(tor_vecs(x, self.ij))
             return sum(self.spline(tor, order),-2)
         elif order == 1:
-            Ad = zeros(x.shape+(self.f.n,))
-            t, dt = dtorsion(array([[x[...,i,:]-x[...,j,:],\
-                                     x[...,j,:]-x[...,k,:],\
-                                     x[...,l,:]-x[...,k,:]] \
-                                        for i,j,k,l in alist]))
+            t, dt = dtorsion(tor_vecs(x, self.ij))
             spl, dspl = self.spline(t, order)
-            for z,(i,j,k,l) in enumerate(self.tors):
-                Ad[...,i,:,:] += dt[...,z,0,:,newaxis] \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,l,:,:] += dt[...,z,1,:,newaxis] \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,j,:,:] -= dt[...,z,2,:,newaxis] \
-                                        * dspl[...,z,newaxis,:]
-                Ad[...,k,:,:] += dt[...,z,3,:,newaxis] \
-                                        * dspl[...,z,newaxis,:]
+            Ad = scatter_atoms(x.shape+(self.f.n,), self.ij, \
+                    tor_roles(dt)[...,newaxis]*dspl[...,newaxis,newaxis,:], -3)
             A = sum(spl, -2)
             return A, Ad
         else:
             raise RuntimeError, "Error! >1 energy derivative not "\
                                   "supported."
 
+# Bond vectors, [x[i]-x[j], x[j]-x[k], x[l]-x[k]], of all
+# torsions ij : Array Int (M, 4).
+def tor_vecs(x, ij):
+    return displacements(x, ij, [(1,0), (2,1), (2,3)])
+
 def torsion(x):
 	trsp = range(len(x.shape))
 	# Operate on last 2 dim.s (atom and xyz) + (..., number)
@@ -131,13 +114,17 @@ def dtorsion(x):
 	#t = sqrt(v*w)
 	#x2 /= t # cos(phi)
 	#x3 /= t # sin(phi)
-	phi = -arctan2(x3,x2)
+	phi = arctan2(x3,x2)
 	A[3] = A[2]-A[1]
 	A[2] += A[0]
 	
 	trsp = range(2, len(x.shape)) + [0,1] # Move (atom,xyz) to last 2 dim.s
 	return phi, transpose(A, trsp)
 	
+# Derivatives from dtorsion, re-ordered by atom (i,j,k,l).
+def tor_roles(dt):
+    return stack([dt[...,0,:], -dt[...,2,:], dt[...,3,:], dt[...,1,:]], -2)
+
 def cross_product(x,y):
 	return array( [ x[1]*y[2] - x[2]*y[1], \
                         x[2]*y[0] - x[0]*y[2], \
@@ -98,6 +98,77 @@ def read_list(name):
 		ifile.close()
 	return array(list)
 
+# Generator versions of read_matrix and read_list.
+# These yield the file contents in blocks of (up to) 'rows' rows
+# or 'n' values, so the whole file is never held in memory.
+def iread_matrix(name, rows, sep=" ,\t\n"):
+	import re
+	digits = "01234567890.-+"
+	
+	isfile = type(name) == file
+	if isfile:
+		ifile = name
+	else:
+		ifile = open(name)
+	list = []
+	
+	sep = re.compile("["+re.escape(sep)+"]*")
+	
+	cols = -1
+	i = 0
+	for line in ifile.xreadlines():
+		j = 0
+		for tok in sep.split(line):
+			if not tok: # Ignore blank generated from line's \n.
+				continue
+			if tok[0] not in digits:
+				break
+			list.append(float(tok))
+			j += 1
+		if(j > 0):
+		    if(cols == -1):
+			cols = j
+		    elif(j != cols):
+		      print "Warning! line %d contains %d columns, "\
+			  "terminating read and ignoring last line."%(i+1, j)
+		      list = list[:-j]
+		      break
+		    i += 1
+		    if len(list) == rows*cols:
+			yield reshape(array(list), (rows,cols))
+			list = []
+	if(cols == -1):
+		raise ValueError, "No data!"
+	
+	if not isfile:
+		ifile.close()
+	if len(list) > 0:
+		yield reshape(array(list), (-1,cols))
+
+def iread_list(name, n):
+	digits = "01234567890.-+"
+	
+	isfile = type(name) == file
+	if isfile:
+		ifile = name
+	else:
+		ifile = open(name)
+	list = []
+	
+	for line in ifile.xreadlines():
+		for tok in line.split():
+			if(tok[0] not in digits):	# stop line parsing
+				break			# at first non-numeric
+			list.append(float(tok))		# value
+		while len(list) >= n:
+			yield array(list[:n])
+			list = list[n:]
+	
+	if not isfile:
+		ifile.close()
+	if len(list) > 0:
+		yield array(list)
+
 def write_graph(name, list, *dims):
 	if len(list.shape) == 1:
 		write_plot(name, list, *dims)
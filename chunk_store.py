@@ -0,0 +1,109 @@
+# On-disk list of data chunks, for fits that don't fit in memory.
+
+# This file is part of ForceSolve, Copyright (C) 2008 David M. Rogers.
+#
+#   ForceSolve is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ForceSolve is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ForceSolve (i.e. frc_solve/COPYING).
+#   If not, contact the author(s) immediately \at/ wantye \/ gmail.com or
+#   http://forceSolve.sourceforge.net/. And see http://www.gnu.org/licenses/
+#   for a copy of the GNU GPL.
+
+import os, shutil, tempfile
+import cPickle as pickle
+from numpy import *
+from scipy.sparse import csr_matrix
+from cg_topol import BlockDesign
+
+# A list of chunks (arrays, BlockDesigns or other picklable objects)
+# supporting append, len and indexing, like the in-memory lists
+# frc_match uses for nonlinear fits.  Each chunk is written to its
+# own file(s) under a fresh temporary directory as it is appended.
+# Arrays are read back memory-mapped, so only the pages in use
+# occupy RAM.  The last 'cache' chunks read are kept open.
+class chunk_store:
+    def __init__(self, path=None, cache=4):
+        self.dir = tempfile.mkdtemp(prefix="chunks", dir=path)
+        self.kind = []
+        self.cache = max(cache, 1)
+        self.recent = [] # [(i, chunk)], most recent last
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def name(self, i, part):
+        return os.path.join(self.dir, "%d.%s.npy"%(i, part))
+
+    def append(self, x):
+        i = len(self)
+        if isinstance(x, ndarray):
+            save(self.name(i, "a"), x)
+            self.kind.append(None)
+        elif isinstance(x, BlockDesign):
+            info = []
+            for j,(a, c0, A) in enumerate(x.blocks):
+                save(self.name(i, "%d.atoms"%j), a)
+                save(self.name(i, "%d.data"%j), A.data)
+                save(self.name(i, "%d.indices"%j), A.indices)
+                save(self.name(i, "%d.indptr"%j), A.indptr)
+                info.append((c0, A.shape))
+            self.kind.append((x.shape, info))
+        else:
+            f = open(os.path.join(self.dir, "%d.pkl"%i), 'wb')
+            pickle.dump(x, f, pickle.HIGHEST_PROTOCOL)
+            f.close()
+            self.kind.append("pkl")
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError, "chunk_store index out of range"
+        for j, x in self.recent:
+            if j == i:
+                return x
+        x = self.read(i)
+        self.recent = (self.recent + [(i, x)])[-self.cache:]
+        return x
+
+    def read(self, i):
+        k = self.kind[i]
+        if k is None:
+            return load(self.name(i, "a"), mmap_mode='r')
+        if k == "pkl":
+            f = open(os.path.join(self.dir, "%d.pkl"%i), 'rb')
+            x = pickle.load(f)
+            f.close()
+            return x
+        shape, info = k
+        blocks = []
+        for j,(c0, sh) in enumerate(info):
+            get = lambda part: load(self.name(i, "%d.%s"%(j,part)), \
+                                    mmap_mode='r')
+            A = csr_matrix((get("data"), get("indices"), get("indptr")), \
+                           shape=sh, copy=False)
+            blocks.append((get("atoms"), c0, A))
+        return BlockDesign(shape, blocks)
+
+    # Remove the on-disk chunks.
+    def close(self):
+        self.recent = []
+        self.kind = []
+        shutil.rmtree(self.dir, True)
+
+    def __del__(self):
+        if hasattr(self, "dir") and os.path.isdir(self.dir):
+            self.close()
@@ -25,16 +25,20 @@
 from numpy import *
 import numpy.linalg as la
 import numpy.random as rand
-from os import path
+from os import path, makedirs
+from hashlib import md5
+from weakref import WeakKeyDictionary
 from cg_topol.ucgrad import write_matrix, write_list
-from cg_topol import write_topol, show_index
+from cg_topol import write_topol, show_index, BlockDesign
+from gauss_sample import wsum_sampler
+from chunk_store import chunk_store
+from sparse_chol import sparse_chol
 from scipy.optimize import fmin_cg #, newton_krylov
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.linalg.lapack import dpotri
+from scipy.sparse import csr_matrix
 
-try:
-    from quad_prog import quad_prog
-except ImportError:
-    print("Error Importing CVXOPT (required for parameter constraints).")
-    quad_prog = None
+from quad_prog import quad_prog
 
 # cg_topol uses integrated first, second and third derivatives for prior which,
 # when multiplied by the corresponding values in alpha, serve to push the
@@ -43,7 +47,7 @@ except ImportError:
 class frc_match:
 	def __init__(self, topol, pdb, dt, kT, \
 			E0=1.0e-8, calpha=1.0e+3, logalpha=None,
-			do_nonlin = False):
+			do_nonlin = False, chunk_dir = None):
 		# No inputs defined yet...
 		params = topol.params
 		self.topol = topol
@@ -64,17 +68,35 @@ class frc_match:
 		self.DF = zeros((types,params))
 		self.F2 = zeros((types))
 		self.S = 0
+		self.folds = 0 # see set_folds()
+		self.blocks = None # see keep_blocks()
+		self.blk_len = 10 # frames per block, for both
+		self.blk_pos = 0  # frames dealt out to blocks so far
+		self.sketch = None # see set_sketch()
+		self.mem = None # bytes for appending one chunk, see chunk_size()
+		self.single = False # float32 designs, summed in float64
+		self.sparse = False # factor iC as sparse, see sparse_chol.py
+		self.sparse_p = None # its ordering, see sparse_factor()
+		self.frame_mem = None
+		self.pool = None # worker processes for append, see open_pool()
                 self.rhs0 = zeros(params)
                 self.iC0  = zeros((params, params))
 
 		self.nonlin = {}
 		# The following are only populated if nonlin != {}
-		self.F = []     # all forces to match, [(S,N,3)]
-		self.seeds = {"_lin":[]} # sufficient statistics, from nonlin(x)
+		# If chunk_dir is given, they are kept on disk there.
+		self.chunk_dir = chunk_dir
+		self.F = self.new_chunks() # all forces to match, [(S,N,3)]
+		self.seeds = {"_lin":self.new_chunks()}
+				# sufficient statistics, from nonlin(x)
 				# {String : [(S,?)]}
 		
 		self.E0 = E0
 		self.calpha = 100.0 # calpha
+		self.wsum = None # theta sampler, see sample()
+		self.wsum_key = None # md5 of its pieces, see wsum_setup()
+		self.rng = rand # random numbers for sampling, see _chain_worker
+		self.eig = None # (md5 of iC, w, A), see dimensionality()
 		#for i in range(len(self.topol.prior)):
 		#    if self.prior_rank[i] != len(self.prior[i]):
 	#		val, A = la.eigh(self.prior[i])
@@ -89,7 +111,7 @@ class frc_match:
 		# Normalize.
 		self.orthonormalize_constraints(array(self.topol.constraints))
 		#self.constraints = array(self.topol.constraints)
-                self.ineqs = array(self.topol.ineqs)
+                self.ineqs = array(self.topol.ineqs).reshape((-1,params))
 		
                 self.dtheta = zeros(params)
 		#self.theta0 = self.theta_from_topol() # Parameters.
@@ -120,7 +142,14 @@ class frc_match:
 	    if self.nonlin.has_key(name):
 		print "Strong Warning: replacing nonlin '%s'??!!?"%name
 	    self.nonlin[name] = [c, seed, F, J, args]
-	    self.seeds[name] = []
+	    self.seeds[name] = self.new_chunks()
+	
+	# An empty list of data chunks -- on disk (see chunk_store.py)
+	# if self.chunk_dir is set.
+	def new_chunks(self):
+	    if self.chunk_dir is None:
+		return []
+	    return chunk_store(self.chunk_dir)
 
 	# Build an index to atoms by designated atom type.
 	def build_type_index(self):
@@ -144,15 +173,23 @@ class frc_match:
 			self.type_index.append(tn)
 		self.mass = self.pdb.mass
 		self.nt = array(nt)
+		# Atom numbers of each type, for per-type reductions.
+		self.type_atoms = [nonzero(array(self.type_index) == t)[0] \
+					for t in range(self.types)]
                 #print self.nt, mass, self.type_index
 
 	# Estimate the actual dimensionality of iC.
         # if fix == True, constrain all 'free' directions to zero.
+	# The eigendecomposition is cached against the contents of iC,
+	# so repeated calls at the same z and alpha are free.
 	def dimensionality(self, sigma_tol=1.0e-5, fix=True):
 		tol = sigma_tol*sigma_tol
 		itol = 1.0/tol
 		iC = self.calc_iC()
-		w, A = la.eigh(iC)
+		key = md5(iC).hexdigest()
+		if self.eig is None or self.eig[0] != key:
+			self.eig = (key,) + la.eigh(iC)
+		w, A = self.eig[1].copy(), self.eig[2]
 		free_dim = len([l for l in w if l <= tol])
 		fixed_dim = len([l for l in w if l >= itol])
 		print "Free directions = %d, Fixed directions = %d"%(\
@@ -169,17 +206,38 @@ class frc_match:
 			#print "\tVector:"
 			#print A[:,i]
                     if fix:
-                        self.constraints, self.span = orthonormalize(
-                                concatenate((self.constraints, C)) )
+			n = len(self.constraints)
+                        self.constraints, self.span = add_constraints(
+                                self.constraints, self.span, array(C))
+			# Constraining eigenvectors of iC only shifts
+			# their eigenvalues by calpha.  add_constraints
+			# may skip or mix rows, so each eigenvector's
+			# weight in the rows it added is checked first.
+			c = sum(dot(self.constraints[n:], A)**2, 0)
+			if abs(c - around(c)).max() < 1e-8:
+			    wc = self.eig[1] + self.calpha*around(c)
+			    self.eig = (md5(self.calc_iC()).hexdigest(), wc, A)
+			else:
+			    self.eig = None
 		return w, A
 
 	# Append a set of data points to the present frc_match object.
-	def append(self, x,f):
-		chunk = 100
-		
+	# If nproc > 1, frames are split across a process pool and
+	# the partial sums from each worker are added in frame order.
+	# The pool from open_pool() is used if there is one, otherwise
+	# one is started (and stopped) for this call.
+	# With incremental=True, data may also be added after sampling.
+	# The samples collected so far are dropped, and the next call to
+	# sample() starts from the present theta, z and alpha.
+	# Frame i may be given a weight w[i] (e.g. 1/p, for frames kept
+	# with probability p), scaling its contribution to every sum.
+	# S then counts sum(w) instead of len(x).
+	def append(self, x,f, nproc=1, incremental=False, w=None):
 		if self.samples > 0:
-			raise ValueError, "Error! Cannot add more data "\
-				"points to mature frc_match object."
+			if not incremental:
+				raise ValueError, "Error! Cannot add more data "\
+					"points to mature frc_match object."
+			self.reset_samples()
 		if x.shape != f.shape:
 			print x.shape, f.shape
 			raise ValueError, "Error! x and f trajectory shapes "\
@@ -189,55 +247,67 @@ class frc_match:
 				"trajectory does not match topology!"
                 if x.shape[-1] != 3:
 			raise ValueError, "Error! last dim should be crd xyz!"
+		if w is not None:
+			if len(self.nonlin) > 0:
+				raise ValueError, "Error! Frame weights "\
+					"cannot be used with nonlinear terms."
+			w = asarray(w, float)
+			if w.shape != x.shape[:1]:
+				raise ValueError, "Error! Need one weight "\
+					"per frame!"
 		
 		# Multiply by ugly constants here.
-		Xfac = self.dt*sqrt(self.kT/self.mass) # Non-dimensionalize.
 		f *= (self.dt/sqrt(self.mass*self.kT))[newaxis,:,newaxis]
 
 		print "Appending %d samples..."%(len(x))
-		self.S += len(x)
-		# Operate on "chunk" structures at once.
-		for i in range(0,len(x)-chunk+1,chunk):
-		    fhat = 0.0
-		    for k,v in self.nonlin.iteritems():
-			self.seeds[k].append(v[1](x[i:i+chunk], *v[4]))
-			fhat += v[2](v[0], self.seeds[k][-1], *v[4])
-		    fhat *= (self.dt/sqrt(self.mass*self.kT))[newaxis,:,newaxis]
+		if nproc > 1 and len(self.nonlin) > 0:
+			print "Nonlinear terms keep all chunks in memory, "\
+				"appending serially."
+			nproc = 1
+		if nproc > 1 and (self.folds > 0 or self.blocks is not None):
+			print "Cross-validation folds and bootstrap blocks "\
+				"are built in order, appending serially."
+			nproc = 1
+		if self.sketch is not None:
+			if len(self.nonlin) > 0:
+				raise ValueError, "Error! Sketched statistics "\
+					"cannot be used with nonlinear terms."
+			chunk = self.chunk_size(x)
+			self.S += frames(x, w)
+			for i in range(0,len(x),chunk):
+			    self.sketch_chunk(x[i:i+chunk], f[i:i+chunk], \
+					      part(w, slice(i, i+chunk)))
+			self.sketch_stats()
+			return
+		chunk = self.chunk_size(x, nproc)
+		if nproc > 1:
+			pool = self.pool
+			if pool is None:
+				self.open_pool(nproc)
+			try:
+			    err = self.zero_stats()
+			    for D2, DF, F2, S in par_stats(self.pool, x, f, \
+							   chunk, nproc, w):
+				add_stats((self.D2, self.DF, self.F2), err, \
+					  (D2, DF, F2))
+				self.S  += S
+			finally:
+			    if pool is None:
+				self.close_pool()
+			return
 
-		    D = -1.0*self.topol.design(x[i:i+chunk],1)[1] \
-			* Xfac[newaxis,:,newaxis,newaxis] # Factor cancels 1/dx
-		    if len(self.nonlin) > 0:
-			self.F.append(f[i:i+chunk])
-			self.seeds["_lin"].append(D)
-		    if any(abs(self.theta0) > 0.0):
-			fhat += dot(D, self.theta0) # subtract fixed contrib.
-		    #self.D += self.type_sum(sum(sum(D,-2),0))
-		    self.type_sum_D2(D)
-		    self.type_sum_DF(D, f[i:i+chunk]-fhat)
-		    self.F2 += self.type_sum(sum(sum(\
-					(f[i:i+chunk]-fhat)**2,-1),0))
-		
-		i = len(x)%chunk
-		if i != 0:
-		    i = len(x)-i
-		    fhat = 0.0
-		    for k,v in self.nonlin.iteritems():
-			self.seeds[k].append(v[1](x[i:], *v[4]))
-			fhat += v[2](v[0], self.seeds[k][-1], *v[4])
-		    fhat *= (self.dt/sqrt(self.mass*self.kT))[newaxis,:,newaxis]
+		if self.folds > 0 or self.blocks is not None:
+			self.append_blocks(x, f, chunk, w)
+			return
 
-		    D = -1.0*self.topol.design(x[i:],1)[1] \
-			* Xfac[newaxis,:,newaxis,newaxis] # Factor cancels 1/dx
-		    if len(self.nonlin) > 0:
-			self.F.append(f[i:])
-			self.seeds["_lin"].append(D)
-		    if any(abs(self.theta0) > 0.0):
-			fhat += dot(D, self.theta0) # subtract fixed contrib.
-		    #self.D += self.type_sum(sum(sum(D,-2),0))
-		    self.type_sum_D2(D)
-		    self.type_sum_DF(D, f[i:]-fhat)
-		    self.F2 += self.type_sum(sum(sum(\
-					(f[i:]-fhat)**2,-1),0))
+		self.S += frames(x, w)
+		# Operate on "chunk" structures at once.
+		err = self.zero_stats()
+		for i in range(0,len(x),chunk):
+		    acc = self.zero_stats()
+		    self.append_chunk(x[i:i+chunk], f[i:i+chunk], acc, \
+				      part(w, slice(i, i+chunk)))
+		    add_stats((self.D2, self.DF, self.F2), err, acc)
 		
 		# 1 structure at a time.
 		#for xi, fi in zip(x,f):# Design matrices are for energy deriv.s
@@ -247,6 +317,339 @@ class frc_match:
 		#		D[:,:,:,newaxis]*D[:,:,newaxis,:],1))
 		#	self.DF += self.type_sum(sum(D*fi[:,:,newaxis],1))
 		#	self.F2 += self.type_sum(sum(fi*fi,1))
+
+	# Start nproc worker processes for append, to be re-used by
+	# every call until close_pool().  The workers are forked with a
+	# copy of this object, so settings changed afterwards (theta0,
+	# single, mem, ...) are not seen by them.
+	def open_pool(self, nproc):
+		global _par_state
+		from multiprocessing import Pool
+		self.close_pool()
+		_par_state = self
+		try:
+			self.pool = Pool(nproc)
+		finally:
+			_par_state = None
+	
+	def close_pool(self):
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+	
+	# Number of frames to append at once.  Without a memory budget,
+	# self.mem, this is 100.  Otherwise it is the number of frames
+	# whose designs fit in mem, shared between nproc processes.
+	def chunk_size(self, x, nproc=1):
+		if self.mem is None:
+			return 100
+		if self.frame_mem is None:
+			self.frame_mem = self.frame_bytes(x[:1])
+		return max(1, int(self.mem/nproc/self.frame_mem))
+	
+	# Estimated memory used by the design of one frame, x : (1,N,3),
+	# and its temporaries, in bytes.  A sparse design's size follows
+	# its number of non-zeros, see frame_nnz().
+	def frame_bytes(self, x):
+		N = self.pdb.atoms
+		P = self.topol.params
+		fb = dtype(float).itemsize
+		db = dtype(float32 if self.single else float).itemsize
+		# x, f and their scaled copies, fhat, D.dot(theta0),
+		# f-fhat and its square: 8 arrays of N*3 floats.
+		b = 8*N*3*fb
+		if hasattr(self.topol, "design_sparse"):
+			ib = dtype(intp).itemsize
+			# Per non-zero: its COO (value, row, col) triplet, the
+			# product giving the value, then CSR (value, int32 col).
+			per = (db + 2*ib) + db + (db + dtype(int32).itemsize)
+			return b + P*fb + per*self.frame_nnz(x)
+		# Each term's design, their concatenation and per-type slices.
+		return b + P*fb + 3*N*3*P*db
+	
+	# Non-zeros in the sparse design of one frame, found by building
+	# it for x once per topology.
+	def frame_nnz(self, x):
+		if self.topol not in _frame_nnz:
+			D = self.design(x)
+			_frame_nnz[self.topol] = sum([A.nnz for a,c,A in D.blocks])
+		return _frame_nnz[self.topol]
+	
+	# Zeroed (D2, DF, F2) accumulators.
+	def zero_stats(self):
+		return zeros(self.D2.shape), zeros(self.DF.shape), \
+			zeros(self.F2.shape)
+	
+	# Add one chunk of (already scaled) forces into acc = (D2, DF, F2),
+	# with frame weights w (or None).
+	def append_chunk(self, x, f, acc, w=None):
+		D2, DF, F2 = acc
+		Xfac = self.dt*sqrt(self.kT/self.mass) # Non-dimensionalize.
+
+		fhat = 0.0
+		for k,v in self.nonlin.iteritems():
+		    self.seeds[k].append(v[1](x, *v[4]))
+		    fhat += v[2](v[0], self.seeds[k][-1], *v[4])
+		fhat *= (self.dt/sqrt(self.mass*self.kT))[newaxis,:,newaxis]
+
+		D = self.design(x)
+		D *= -Xfac[newaxis,:,newaxis,newaxis] # Factor cancels 1/dx
+		if w is not None:
+		    D, f = weight_rows(D, f, w)
+		if len(self.nonlin) > 0:
+		    self.F.append(f)
+		    self.seeds["_lin"].append(D)
+		if any(abs(self.theta0) > 0.0):
+		    fhat += D.dot(self.theta0) # subtract fixed contrib.
+		#self.D += self.type_sum(sum(sum(D,-2),0))
+		self.type_sum_D2(D, D2)
+		self.type_sum_DF(D, f-fhat, DF)
+		F2 += self.type_sum(sum(sum((f-fhat)**2,-1),0))
+	
+	# Accumulate a CountSketch of the force rows, instead of their
+	# exact sums.  Each (frame, atom, xyz) row of [D, F] is added,
+	# with a random sign, to one of m rows kept for its atom type,
+	# and D2, DF and F2 are formed from those m rows.
+	# This costs O(rows*P) instead of O(rows*P^2) per chunk,
+	# while the sketched D2 has relative errors ~ 1/sqrt(m).
+	# Data appended before calling this is kept exactly.
+	# Checkpoints keep the sketch and its random state, so appending
+	# after read_chk() continues the same sketch.
+	def set_sketch(self, m, seed=None):
+		if self.folds > 0 or self.blocks is not None:
+			raise ValueError, "Error! Sketched statistics cannot "\
+				"be used with cross-validation or bootstrap."
+		self.sketch = [zeros((self.types, m, self.topol.params)), \
+				zeros((self.types, m))]
+		self.sketch_base = self.D2.copy(), self.DF.copy(), \
+				self.F2.copy()
+		self.sketch_rng = rand.RandomState(seed)
+	
+	# Add one chunk of (already scaled) forces into the sketch.
+	def sketch_chunk(self, x, f, w=None):
+		SD, SF = self.sketch
+		m = SD.shape[1]
+		Xfac = self.dt*sqrt(self.kT/self.mass) # Non-dimensionalize.
+
+		D = self.design(x)
+		D *= -Xfac[newaxis,:,newaxis,newaxis] # Factor cancels 1/dx
+		if w is not None:
+		    D, f = weight_rows(D, f, w)
+		if any(abs(self.theta0) > 0.0):
+		    f = f - D.dot(self.theta0) # subtract fixed contrib.
+		h = self.sketch_rng.randint(m, size=f.shape)
+		sg = self.sketch_rng.randint(2, size=f.shape)*2.0 - 1.0
+		if isinstance(D, BlockDesign):
+		    D.type_sketch(self.type_index, h, sg, SD)
+		for t,a in enumerate(self.type_atoms):
+		    ht = h[:,a].reshape(-1)
+		    st = sg[:,a].reshape(-1)
+		    if not isinstance(D, BlockDesign):
+			Sk = csr_matrix((st, (ht, arange(len(ht)))), \
+					shape=(m, len(ht)))
+			SD[t] += Sk * D[:,a].reshape((-1,SD.shape[2]))
+		    SF[t] += bincount(ht, st*f[:,a].reshape(-1), m)
+
+	# Set D2, DF and F2 from the sketch.
+	def sketch_stats(self):
+		SD, SF = self.sketch
+		D2, DF, F2 = self.sketch_base
+		for t in range(self.types):
+		    self.D2[t] = D2[t] + dot(transpose(SD[t]), SD[t])
+		    self.DF[t] = DF[t] + dot(SF[t], SD[t])
+		    self.F2[t] = F2[t] + dot(SF[t], SF[t])
+
+	# Keep separate statistics for k cross-validation folds.
+	# Appended frames are split into contiguous blocks of blk frames,
+	# which are dealt out to the folds in turn.
+	# Data appended before calling this is never held out.
+	def set_folds(self, k, blk=None):
+		if blk is not None:
+			self.blk_len = blk
+		self.folds = k
+		self.fold_D2 = zeros((k,)+self.D2.shape)
+		self.fold_DF = zeros((k,)+self.DF.shape)
+		self.fold_F2 = zeros((k,)+self.F2.shape)
+		self.fold_S = zeros(k)
+	
+	# Keep the statistics, (D2, DF, F2, S), of every block of blk
+	# appended frames in self.blocks (on disk, if self.chunk_dir is set)
+	# for the block bootstrap.  The block being filled is self.blk_cur.
+	def keep_blocks(self, blk=None):
+		if blk is not None:
+			self.blk_len = blk
+		self.blocks = self.new_chunks()
+		self.blk_cur = None # [block number, D2, DF, F2, S]
+	
+	# Append block by block, adding each block's statistics to its
+	# fold and self.blocks, as well as the totals.
+	def append_blocks(self, x, f, chunk, w=None):
+		err = self.zero_stats()
+		for i in range(0,len(x),chunk):
+		    n = len(x[i:i+chunk])
+		    blk = (self.blk_pos + arange(n))/self.blk_len
+		    for b in unique(blk):
+			idx = i + nonzero(blk == b)[0]
+			wb = part(w, idx)
+			acc = self.zero_stats()
+			self.append_chunk(x[idx], f[idx], acc, wb)
+			add_stats((self.D2, self.DF, self.F2), err, acc)
+			if self.folds > 0:
+			    k = b % self.folds
+			    self.fold_D2[k] += acc[0]
+			    self.fold_DF[k] += acc[1]
+			    self.fold_F2[k] += acc[2]
+			    self.fold_S[k] += frames(idx, wb)
+			if self.blocks is not None:
+			    self.add_block(b, acc, frames(idx, wb))
+		    self.S += frames(x[i:i+chunk], part(w, slice(i, i+chunk)))
+		    self.blk_pos += n
+	
+	def add_block(self, b, acc, n):
+		if self.blk_cur is not None and self.blk_cur[0] != b:
+			self.blocks.append(tuple(self.blk_cur[1:]))
+			self.blk_cur = None
+		if self.blk_cur is None:
+			self.blk_cur = [b, zeros(self.D2.shape), \
+				zeros(self.DF.shape), zeros(self.F2.shape), 0]
+		self.blk_cur[1] += acc[0]
+		self.blk_cur[2] += acc[1]
+		self.blk_cur[3] += acc[2]
+		self.blk_cur[4] += n
+	
+	# All blocks kept, including the one being filled.
+	def all_blocks(self):
+		blocks = list(self.blocks)
+		if self.blk_cur is not None:
+			blocks.append(tuple(self.blk_cur[1:]))
+		return blocks
+	
+	# Block bootstrap of the maximum likelihood parameters.
+	# Each of the n replicates draws len(blocks) blocks with
+	# replacement and solves for theta (at the present z and alpha,
+	# subject to any ineqs) from the re-weighted sums.  Data appended
+	# before keep_blocks() is in every replicate.
+	# Returns theta0+dtheta, (n, params).
+	def bootstrap(self, n=200):
+		if self.blocks is None or (len(self.blocks) == 0 \
+					   and self.blk_cur is None):
+			raise ValueError, "Error! No blocks kept, "\
+					  "see keep_blocks()."
+		blocks = self.all_blocks()
+		base_D2 = self.D2 - sum([b[0] for b in blocks], 0)
+		base_DF = self.DF - sum([b[1] for b in blocks], 0)
+		thetas = []
+		for r in range(n):
+		    w = rand.multinomial(len(blocks), \
+				ones(len(blocks))/len(blocks))
+		    D2 = base_D2.copy()
+		    DF = base_DF.copy()
+		    for j in nonzero(w)[0]:
+			D2 += w[j]*blocks[j][0]
+			DF += w[j]*blocks[j][1]
+		    if len(self.ineqs) > 0:
+			dtheta = self.solve_ineqs(self.calc_iC(D2), \
+					self.calc_rhs(DF), self.dtheta)
+		    else:
+			dtheta = self.solve_theta(D2, DF)
+		    thetas.append(self.theta0 + dtheta)
+		return array(thetas)
+	
+	# Pointwise lo and hi percentiles of the energy function of each
+	# term over the bootstrap thetas, evaluated on the term's grid().
+	# Returns [(name, x, E_lo, E_hi)], skipping terms without a grid.
+	def boot_bands(self, thetas, lo=2.5, hi=97.5):
+		bands = []
+		for t, i in leaf_terms(self.topol):
+		    if not hasattr(t, "grid") or t.grid() is None:
+			continue
+		    x = t.grid()
+		    E = dot(t.spline(x), transpose(thetas[:,i:i+t.params]))
+		    bands.append((t.name, x, percentile(E, lo, 1)*self.kT, \
+				  percentile(E, hi, 1)*self.kT))
+		return bands
+	
+	# Write the boot_bands() of each term as a table of
+	# x, E_lo and E_hi, in name/boot/[term].dat.
+	def write_boot(self, name, thetas, lo=2.5, hi=97.5):
+		d = path.join(name, "boot")
+		if not path.exists(d):
+			makedirs(d)
+		for tname, x, Elo, Ehi in self.boot_bands(thetas, lo, hi):
+		    out = open(path.join(d, tname + ".dat"), 'w')
+		    out.write("#x\tE_%g\tE_%g\n"%(lo, hi))
+		    for row in zip(x, Elo, Ehi):
+			out.write("%12e %12e %12e\n"%row)
+		    out.close()
+	
+	# Held-out RMS force error per (fold, atom type).
+	# For each fold, theta is fit (at the present z and alpha) to all
+	# other data, by subtracting the fold's statistics from the totals.
+	def cv_error(self):
+		if self.folds < 1:
+			raise ValueError, "Error! No cross-validation folds, "\
+					  "see set_folds()."
+		err = zeros((self.folds, self.types)) + nan # empty folds
+		for k in nonzero(self.fold_S)[0]:
+		    dtheta = self.solve_theta(self.D2 - self.fold_D2[k], \
+					      self.DF - self.fold_DF[k])
+		    r2 = self.fold_F2[k] + dot(dot(self.fold_D2[k], dtheta) \
+				- 2*self.fold_DF[k], dtheta)
+		    err[k] = sqrt(maximum(r2, 0.0) \
+				/ (3.0*self.nt*self.fold_S[k]))
+		return err
+	
+	# Solve iC dtheta = rhs subject to ineqs (and the constraints),
+	# starting from x0.
+	def solve_ineqs(self, iC, rhs, x0):
+		if len(self.constraints) == 0 or \
+				abs(self.constraints).max() < 1e-10:
+		    return quad_prog(iC, -rhs, G = -self.ineqs, \
+				     h = dot(self.ineqs, self.theta0), x0 = x0)
+		# assumes A . theta0 = 0
+		return quad_prog(iC, -rhs, G = -self.ineqs, \
+				 h = dot(self.ineqs, self.theta0), \
+				 A = self.constraints, \
+				 b = zeros(len(self.constraints)), x0 = x0)
+	
+	# Maximum likelihood dtheta for the statistics (D2, DF)
+	# at the present z and alpha, ignoring ineqs.
+	def solve_theta(self, D2, DF):
+		return self.solve_span(self.calc_iC(D2), self.calc_rhs(DF))
+	
+	# Solve iC dtheta = rhs within the span of the constraints.
+	def solve_span(self, iC, rhs):
+		if len(self.constraints) > 0:
+			iC = dot(dot(self.span, iC), self.span.transpose())
+			return dot(self.span.transpose(),
+				   self.solve_iC(iC, dot(self.span, rhs)))
+		return self.solve_iC(iC, rhs)
+	
+	def solve_iC(self, iC, b):
+		if self.sparse:
+			return self.sparse_factor(iC, True).solve(b)
+		return la.solve(iC, b)
+	
+	# sparse_chol of iC, re-using the ordering of the first one,
+	# since the pattern of iC is set by the topology.
+	# Projecting out constraints fills in iC, so solves (proj=True)
+	# are limited to fits without them.
+	def sparse_factor(self, iC, proj=False):
+		if proj and len(self.constraints) > 0:
+			raise ValueError, "Error! Sparse solves are only "\
+					  "for fits without constraints."
+		L = sparse_chol(iC, self.sparse_p)
+		self.sparse_p = L.p
+		return L
+	
+	# Force design matrix for x, block-sparse if topol supports it.
+	# With self.single, it is built (and stored) as float32.
+	def design(self, x):
+		dtype = float32 if self.single else float64
+		if hasattr(self.topol, "design_sparse"):
+			return self.topol.design_sparse(x, dtype=dtype)[1]
+		return self.topol.design(x,1)[1].astype(dtype, copy=False)
 	
 	# Improve precision by shifting theta
 	# (requires F and D were kept around).
@@ -278,7 +681,7 @@ class frc_match:
 		    fhat *= (self.dt/sqrt(self.mass*self.kT))[newaxis,:,newaxis]
 
 		    D = self.seeds["_lin"][i]
-		    fhat += dot(D, self.theta0) # subtract fixed contrib.
+		    fhat += D.dot(self.theta0) # subtract fixed contrib.
 		    self.type_sum_DF(D, self.F[i]-fhat)
 		    self.F2 += self.type_sum(sum(sum((self.F[i]-fhat)**2,-1),0))
 	
@@ -288,7 +691,7 @@ class frc_match:
 	def resid_nonlin(self, name):
 		assert self.nonlin.has_key(name), \
 			"Nonlin. type %s not present."%name
-		df = []
+		df = self.new_chunks()
 		Fscale = (self.dt/sqrt(self.mass*self.kT))[newaxis,:,newaxis]
 
 		# Operate on "chunk" structures at once.
@@ -301,17 +704,18 @@ class frc_match:
 		    if len(self.nonlin) > 1:
 		        fhat *= Fscale
 
-		    fhat += dot(self.seeds["_lin"][i], self.theta0+self.dtheta)
+		    fhat += self.seeds["_lin"][i].dot(self.theta0+self.dtheta)
 		    df.append(fhat - self.F[i])
 
 		v = self.nonlin[name]
+		# Per-atom weights, z of each atom's type.
+		wz = self.z[self.type_index][newaxis,:,newaxis]
 		def RR(x):
 		    err = 0.0
 		    for i in range(len(self.F)):
 			R = df[i] + v[2](x, self.seeds[name][i], *v[4]) \
 		                       * Fscale
-			for a,t in enumerate(self.type_index):
-			    err += self.z[t]*tensordot(R[:,a], R[:,a], 2)
+			err += sum(wz*R*R)
 		    return 0.5*err
 
 		def RJ_JJ(x):
@@ -322,13 +726,10 @@ class frc_match:
 			R = df[i] + v[2](x, self.seeds[name][i], *v[4]) \
 					* Fscale
 			J = v[3](x, self.seeds[name][i], *v[4]) \
-					* Fscale[...,newaxis]
-			m = len(R)*3
-			for a,t in enumerate(self.type_index):
-			    RJ += self.z[t]*tensordot(R[:,a], J[:,a], 2)
-			    JJ += self.z[t]*dot(
-				    transpose(J[:,a].reshape((m,n))),
-					      J[:,a].reshape((m,n)) )
+					* (Fscale*sqrt(wz))[...,newaxis]
+			RJ += tensordot(R*sqrt(wz), J, 3)
+			J = J.reshape((-1,n))
+			JJ += dot(transpose(J), J)
 		    return RJ, JJ
 
 		return RR, RJ_JJ
@@ -337,28 +738,41 @@ class frc_match:
 	# by summation.
 	def type_sum(self, x):
 		xt = zeros((self.types,)+x.shape[1:])
-		for i,t in enumerate(self.type_index):
-			xt[t] += x[i]
+		for t,a in enumerate(self.type_atoms):
+			xt[t] = sum(x[a], 0)
 		return xt
 	# Special type_sum for accumulating D2 matrices.
 	# the numerics are sensitive to how this is computed...
-	def type_sum_D2(self, DS):
+	def type_sum_D2(self, DS, D2=None):
+		if D2 is None:
+			D2 = self.D2
+		if isinstance(DS, BlockDesign):
+			DS.type_gram(self.type_index, D2)
+			return
 		#for D in DS:
 		#  for i,t in enumerate(self.type_index):
 		#    for j in range(3):
 		#	self.D2[t] += D[i,j,:,newaxis]*D[i,j,newaxis,:]
-		for i,t in enumerate(self.type_index):
-		    self.D2[t] += tensordot(DS[:,i], DS[:,i], \
-					    axes=[(0,1),(0,1)])
+		# One product per type, over all its atoms at once.
+		P = DS.shape[-1]
+		for t,a in enumerate(self.type_atoms):
+		    Dt = DS[:,a].reshape((-1,P)).astype(float64, copy=False)
+		    D2[t] += dot(transpose(Dt), Dt)
 	# Special type_sum for accumulating DF matrices.
-	def type_sum_DF(self, DS, FS):
+	def type_sum_DF(self, DS, FS, DF=None):
+		if DF is None:
+			DF = self.DF
+		if isinstance(DS, BlockDesign):
+			DS.type_rhs(self.type_index, FS, DF)
+			return
 		#for D, F in zip(DS, FS):
 		#  for i,t in enumerate(self.type_index):
 		#    for j in range(3):
 		#	self.DF[t] += D[i,j]*F[i,j,newaxis]
-		for i,t in enumerate(self.type_index):
-		    self.DF[t] += tensordot(DS[:,i], FS[:,i], \
-					    axes=[(0,1),(0,1)])
+		P = DS.shape[-1]
+		for t,a in enumerate(self.type_atoms):
+		    DF[t] += dot(FS[:,a].reshape(-1), \
+			DS[:,a].reshape((-1,P)).astype(float64, copy=False))
 
 	# Make constraints orthonormal.
         # and complete the complementary (perpendicular) subspace.
@@ -387,30 +801,18 @@ class frc_match:
 		    iC = self.calc_iC()
                     rhs = self.calc_rhs()
 
-                    if len(self.ineqs) > 0 and quad_prog != None:
+                    if len(self.ineqs) > 0:
 			print "        Using constrained solve."
-                        # solve with inequality constraints
-                        if abs(self.constraints).max() < 1e-10:
-			  dtheta = quad_prog(iC, -rhs, \
-                                        G = -self.ineqs, \
-                                        h = dot(self.ineqs, self.theta0))
-                        else:
-			  dtheta = quad_prog(iC, -rhs, \
-                                        G = -self.ineqs, \
-                                        h = dot(self.ineqs, self.theta0), \
-					A = self.constraints, \
-					b = zeros(len(self.constraints)))
-			  # assumes A . theta0 = 0
-                    else: # We have to ignore ineqs! (can't linearly resolve)
-                        if len(self.constraints) > 0:
-                            iC = dot(dot(self.span, iC), self.span.transpose())
-                            dtheta = dot(self.span.transpose(),
-                                    la.solve(iC, dot(self.span, rhs)))
-                        else:
-                            dtheta = la.solve(iC, rhs)
+                        # solve with inequality constraints,
+			# starting from the last dtheta
+			dtheta = self.solve_ineqs(iC, rhs, self.dtheta)
+                    else: # No inequalities, a linear solve.
+                        dtheta = self.solve_span(iC, rhs)
 
 		    # Re-calculate if > 10% difference.
-		    if sum(abs(dtheta)) > 0.1*sum(abs(self.theta0)):
+		    # (Only possible when the chunks were kept, see set_theta0.)
+		    if len(self.nonlin) > 0 and \
+				sum(abs(dtheta)) > 0.1*sum(abs(self.theta0)):
 			print "Resetting theta0."
 			self.set_theta0(self.theta0 + dtheta)
 			self.dtheta = dtheta*0.0
@@ -478,11 +880,15 @@ class frc_match:
             ba = 0.5*(self.calc_penalty()+self.E0)
             return 1.5*self.nt*self.S, bz, 0.5*array(self.topol.pri_rank), ba
 		
-        def calc_rhs(self): # weight residual by atom type
-	    return dot(self.z, self.DF) + self.rhs0
+        def calc_rhs(self, DF=None): # weight residual by atom type
+	    if DF is None:
+		DF = self.DF
+	    return dot(self.z, DF) + self.rhs0
 
-	def calc_iC(self):
-		iC = tensordot(self.z, self.D2, axes=[0,0]) + self.iC0
+	def calc_iC(self, D2=None):
+		if D2 is None:
+			D2 = self.D2
+		iC = tensordot(self.z, D2, axes=[0,0]) + self.iC0
 		# Add in constraints.
 		iC += self.calpha*dot(transpose(self.constraints), \
 					self.constraints)
@@ -493,33 +899,83 @@ class frc_match:
                     iC[r0:r1, r0:r1] += a * P
 		return iC
 	
-	# Generate conditional samples.
-	def update_sample(self, n=0, logalpha=None):
-	    for step in xrange(n):
-		#print "    Updating."
+	# Draw theta from its Gaussian conditional distribution
+	# in the coordinates of self.span.  Returns (b, noise), where
+	# b[:,0] is the sample (minus the mean), b[:,1] is the mean and
+	# noise() returns another b[:,0] with the same distribution.
+	def draw_theta(self):
+		if self.wsum is not None:
+		    if self.wsum_key != self.calc_wsum_key():
+			self.wsum_setup(self.wsum.kappa)
+		    b = zeros((len(self.span),2))
+		    w = self.wsum_weights()
+		    b[:,1], b[:,0] = self.wsum.draw(w, \
+					dot(self.span, self.calc_rhs()), self.rng)
+		    return b, lambda: self.wsum.noise(w, self.rng)
+		
 		iC = self.calc_iC()
                 b = zeros((len(self.span),2))
-                b[:,0] = rand.standard_normal(len(b)) # Sample
+                b[:,0] = self.rng.standard_normal(len(b)) # Sample
                 b[:,1] = dot(self.span, self.calc_rhs()) # Mean
                 if len(self.constraints) > 0:
                     iC = dot(dot(self.span, iC), self.span.transpose())
 		try:
+		    if self.sparse:
+			L = self.sparse_factor(iC, True)
+			b[:,1] = L.solve(b[:,1])
+			b[:,0] = L.noise(b[:,0])
+			return b, lambda: L.noise(self.rng.standard_normal(len(b)))
                     L = la.cholesky(iC)
                     b[:,1:] = forward_subst(L, b[:,1:])
                     b = back_subst(transpose(L), b)
 		except la.linalg.LinAlgError:
                     w, A = self.dimensionality()
                     raise RuntimeError, "Force design matrix is degenerate!"
-                    hC = dot(A, transpose(A)/sqrt(w)[:,newaxis])
-                    b = dot(hC, b)
-                    b[:,1] = dot(hC, b[:,1])
+		return b, lambda: back_subst(transpose(L), \
+					self.rng.standard_normal(len(b)))
+	
+	# Setup the weighted-sum sampler (see gauss_sample.py).
+	# The pieces of iC are the D2 of each type, the prior of
+	# each term, and the constant part.  With constraints, the
+	# sampler projects them into span coordinates.
+	# append(), add_constraints() and read_chk() all change
+	# these, so draw_theta() sets the sampler up again whenever
+	# calc_wsum_key() no longer matches.
+	def wsum_setup(self, kappa=2.0):
+		pieces = [(0, D2) for D2 in self.D2]
+		for i,Pr in self.topol.prior:
+		    pieces.append((self.ind[i], Pr))
+		pieces.append((0, self.iC0 + self.calpha \
+			* dot(transpose(self.constraints), self.constraints)))
+		span = None
+		if len(self.constraints) > 0:
+		    span = self.span
+		self.wsum = wsum_sampler(len(self.span), pieces, kappa,
+					 span=span)
+		self.wsum_key = self.calc_wsum_key()
+	
+	# md5 of everything the pieces of wsum_setup() depend on.
+	def calc_wsum_key(self):
+		h = md5()
+		for A in [self.D2, self.iC0, self.constraints, self.span]:
+			h.update(ascontiguousarray(A))
+		h.update(repr(self.calpha))
+		return h.hexdigest()
+	
+	def wsum_weights(self):
+		return concatenate((self.z, self.alpha, [1.0]))
+	
+	# Generate conditional samples.
+	def update_sample(self, n=0, logalpha=None):
+	    for step in xrange(n):
+		#print "    Updating."
+		b, noise = self.draw_theta()
                 mean = dot(self.span.transpose(), b[:,1])
                 dtheta = dot(self.span.transpose(), b[:,0]+b[:,1])
                 tries = 0
                 while sum(dot(self.ineqs, dtheta + self.theta0) < 0.0) > 0\
                                                         and tries < 1000:
-                    b[:,0:1] = back_subst(transpose(L),
-                                  rand.standard_normal(len(b))[:,newaxis])
+                    b[:,0] = noise()
                     dtheta = dot(self.span.transpose(), b[:,0]+b[:,1])
                     tries += 1
                 if tries == 1000:
@@ -529,33 +985,81 @@ class frc_match:
                     self.dtheta = dtheta
 		
 		az, ibz, aa, iba = self.calc_za_ab()
-		self.z = array([rand.gamma(ai,1.0) for ai in az])/ibz
-		self.alpha = array([rand.gamma(ai,1.0) for ai in aa])/iba
+		self.z = array([self.rng.gamma(ai,1.0) for ai in az])/ibz
+		self.alpha = array([self.rng.gamma(ai,1.0) for ai in aa])/iba
 		if logalpha != None:
 		    write_matrix(logalpha, reshape(self.alpha, (1,-1)), 'a')
 		
 	def calc_theta_stats(self):
 		iC = self.calc_iC()
 		b = self.calc_rhs()
+		if self.sparse:
+			return self.sparse_theta_stats(iC, b)
+		try:
+			L = cho_factor(iC, lower=True)
+		except la.linalg.LinAlgError:
+			w, A = self.dimensionality()
+			raise RuntimeError, "Force design matrix is degenerate!"
+		dtheta = cho_solve(L, b)
+		# C = iC^{-1} from its Cholesky factor.  Since C and D2 are
+		# symmetric, trace(dot(C, D2)) = sum(C*D2).
+		C = chol_inv(L[0])
+		fv = []
+		D2s = sum(self.D2, 0)
+                for k,i in enumerate(self.ind[:-1]):
+			ip = self.ind[k+1]
+			fv.append(sum(C[i:ip,i:ip]*D2s[i:ip,i:ip]))
+		return dtheta, list(tensordot(self.D2, C, 2)), fv
+	
+	# calc_theta_stats for self.sparse, finding the traces with
+	# C = iC^{-1} one term's columns at a time, so C is never stored.
+	def sparse_theta_stats(self, iC, b):
 		try:
-			#dtheta = la.solve(iC, b)
-			C = la.inv(iC)
+			L = self.sparse_factor(iC)
 		except la.linalg.LinAlgError:
 			w, A = self.dimensionality()
 			raise RuntimeError, "Force design matrix is degenerate!"
-			C = dot(A, transpose(A)/w[:,newaxis])
-		dtheta = dot(C, b)
-		#return dtheta, [trace(la.solve(iC, D2)) for D2 in self.D2]
+		tr = zeros(self.types)
 		fv = []
                 for k,i in enumerate(self.ind[:-1]):
 			ip = self.ind[k+1]
-			D2t = sum(self.D2[:,i:ip,i:ip],0)
-			fv.append(trace(dot(C[i:ip,i:ip],D2t)))
-		return dtheta, [trace(dot(C, D2)) for D2 in self.D2], fv
+			C = L.inv_cols(i, ip)
+			tr += tensordot(self.D2[:,:,i:ip], C, 2)
+			fv.append(sum(C[i:ip]*sum(self.D2[:,i:ip,i:ip], 0)))
+		return L.solve(b), list(tr), fv
+	
+	# method = 'chol' re-factors iC for every draw of theta,
+	#          'pcg' re-uses one factorization (see gauss_sample.py).
+	def set_sampler(self, method):
+		if method == 'pcg':
+			self.wsum_setup()
+		elif method == 'chol':
+			self.wsum = None
+		else:
+			raise ValueError, "Unknown sampling method '%s'"%method
+	
+	# Run 'toss' updates, then return the statistics for one sample.
+	def next_sample(self, toss, logalpha=None):
+		self.update_sample(toss, logalpha)
+		dtheta, dmu2, df2 = self.calc_theta_stats()
+                az, ibz, aa, iba = self.calc_za_ab()
+		return dtheta, dmu2, df2, 1.0/self.z, self.alpha, \
+				(ibz-0.5*self.E0)/az
+	
+	def store_sample(self, s):
+		dtheta, dmu2, df2, v, alpha, resid2 = s
+		self.sum_dtheta.append(dtheta)
+		self.sum_dmu2.append(dmu2)
+		self.sum_df2.append(df2)
+		self.sum_v.append(v)
+		self.sum_alpha.append(alpha)
+		self.sum_resid2.append(resid2)
+		self.samples += 1
 	
-	def sample(self, samples, skip=100, toss=10):
+	def sample(self, samples, skip=100, toss=10, method='chol'):
 		if self.S < 1:
 			raise ProgramError, "Error! no data has been collected!"
+		self.set_sampler(method)
 		if skip > 0:
 			print "Doing sampling burn-in..."
 		for i in xrange(skip):
@@ -566,18 +1070,91 @@ class frc_match:
 			out.truncate()
 			out.close()
 		for i in xrange(samples):
-			self.update_sample(toss, self.logalpha)
-			dtheta, dmu2, df2 = self.calc_theta_stats()
-			self.sum_dtheta.append(dtheta)
-			self.sum_dmu2.append(dmu2)
-			self.sum_df2.append(df2)
-			self.sum_v.append(1.0/self.z)
-			self.sum_alpha.append(self.alpha)
-                        az, ibz, aa, iba = self.calc_za_ab()
-                        self.sum_resid2.append((ibz-0.5*self.E0)/az)
-			self.samples += 1
+			self.store_sample(self.next_sample(toss, self.logalpha))
 		self.posterior_estimate()
 	
+	# Run independent Gibbs chains on nproc processes (default: one
+	# per chain).  All chains start from the present state, and
+	# collect samples in rounds of 'check' per chain.  After each
+	# round, R-hat and the effective sample size of z, alpha and theta
+	# are computed over all chains.  Sampling stops once
+	# max(R-hat) < rhat_tol and min(ESS) >= min_ess, or when
+	# 'samples' have been collected in total.
+	def sample_chains(self, samples, skip=100, toss=10, chains=4, \
+			  nproc=None, method='chol', check=50, \
+			  rhat_tol=1.01, min_ess=400):
+		global _chain_state
+		if self.S < 1:
+			raise ProgramError, "Error! no data has been collected!"
+		if nproc is None:
+			nproc = chains
+		self.set_sampler(method)
+		if self.logalpha != None:
+			out = open(self.logalpha, 'w')
+			out.truncate()
+			out.close()
+		
+		_chain_state = self, toss
+		pool = None
+		if nproc > 1:
+			from multiprocessing import Pool
+			pool = Pool(min(nproc, chains))
+		
+		state = [(self.dtheta, self.z, self.alpha)]*chains
+		kept = [[] for c in range(chains)]
+		mon = [[] for c in range(chains)] # monitored quantities
+		R = N = None
+		print "Running %d chains, %d burn-in steps..."%(chains, skip)
+		try:
+		    while sum(map(len, kept)) < samples:
+			n = min(check, (samples - sum(map(len, kept)) \
+						+ chains-1)/chains)
+			jobs = [(st, rand.randint(2**31), skip, n) \
+						for st in state]
+			if pool is None:
+				res = map(_chain_worker, jobs)
+			else:
+				res = pool.map(_chain_worker, jobs, 1)
+			skip = 0
+			for c, (st, out, m) in enumerate(res):
+				state[c] = st
+				kept[c] += out
+				mon[c] += m
+			if self.logalpha != None:
+				for out in kept:
+				    write_matrix(self.logalpha, \
+				      array([o[4] for o in out[-n:]]), 'a')
+			
+			R = rhat(array(mon))
+			N = ess(array(mon))
+			print "  %d samples/chain, max R-hat = %f, " \
+			      "min ESS = %.1f"%(len(kept[0]), R.max(), N.min())
+			if R.max() < rhat_tol and N.min() >= min_ess:
+				print "  Chains converged."
+				break
+		finally:
+		    if pool is not None:
+			pool.close()
+			pool.join()
+		    _chain_state = None
+		
+		self.rhat, self.ess = R, N
+		for out in kept:
+			for o in out:
+				self.store_sample(o)
+		self.dtheta, self.z, self.alpha = state[0]
+		self.posterior_estimate()
+	
+	# Forget all collected samples, keeping the present state.
+	def reset_samples(self):
+		self.sum_v = []
+		self.sum_alpha = []
+		self.sum_dtheta = []
+		self.sum_dmu2 = []
+		self.sum_df2 = []
+		self.sum_resid2 = []
+		self.samples = 0
+	
 	# Best estimates from posterior distribution.
 	def posterior_estimate(self):
 		if self.samples < 1:
@@ -623,17 +1200,262 @@ class frc_match:
             lam.close()
             
             # Output force residuals per term (cheating by inspecting cg_topol)
-            def get_names(t):
-                if hasattr(t, "terms"):
-                    return reduce(lambda a,b: a+get_names(b), t.terms, [])
-                return [t.name]
-            tname = get_names(self.topol)
+            tname = term_names(self.topol)
             df = open(path.join(name,"df.out"), 'w')
             df.write("#type\t<stdev>\n")
             for df2, (i,P) in zip(self.df2, self.topol.prior):
                 df.write( "%-16s %e\n"%(tname[i], sqrt(df2)) )
             df.close()
 	
+        # Hash of everything the accumulated statistics depend on.
+        def fingerprint(self):
+            h = md5()
+            h.update(repr((self.topol.params, self.topol.hyp_params,
+                           self.ind, term_names(self.topol))))
+            h.update(repr([n[2] for n in self.pdb.names]))
+            h.update(repr(map(float, self.mass)))
+            h.update(repr((self.dt, self.kT)))
+            return h.hexdigest()
+
+        # Save the sufficient statistics to a binary (.npz) checkpoint.
+        def write_chk(self, name):
+            if len(self.nonlin) > 0:
+                raise ValueError, "Error! Can't checkpoint nonlinear fits."
+            out = open(name, 'wb')
+            savez(out, fingerprint=self.fingerprint(),
+                  type_names=array(self.type_names),
+                  D2=self.D2, DF=self.DF, F2=self.F2, S=self.S,
+                  rhs0=self.rhs0, iC0=self.iC0,
+                  constraints=self.constraints, span=self.span,
+                  theta0=self.theta0, dtheta=self.dtheta,
+                  z=self.z, alpha=self.alpha, blk_len=self.blk_len,
+                  blk_pos=self.blk_pos, **dict(self.block_stats(),
+                                               **self.sketch_state()))
+            out.close()
+
+        # Restore the state saved by write_chk in place of append().
+        def read_chk(self, name):
+            if self.S > 0 or len(self.nonlin) > 0:
+                raise ValueError, "Error! Can only read checkpoint into "\
+                                  "an empty, linear frc_match object."
+            chk = load(name)
+            if str(chk['fingerprint']) != self.fingerprint():
+                raise ValueError, "Error! Checkpoint %s was made from "\
+                                  "a different topology."%name
+            # Type order is not guaranteed to match.
+            tn = list(chk['type_names'])
+            perm = [tn.index(t) for t in self.type_names]
+            self.D2 = chk['D2'][perm]
+            self.DF = chk['DF'][perm]
+            self.F2 = chk['F2'][perm]
+            self.z = chk['z'][perm]
+            self.S = chk['S'].item() # float if frames were weighted
+            self.rhs0 = chk['rhs0']
+            self.iC0 = chk['iC0']
+            self.constraints = chk['constraints']
+            self.span = chk['span']
+            self.theta0 = chk['theta0']
+            self.dtheta = chk['dtheta']
+            self.alpha = chk['alpha']
+            if 'blk_len' in chk.files:
+                self.blk_len = int(chk['blk_len'])
+                self.blk_pos = int(chk['blk_pos'])
+            if 'fold_S' in chk.files:
+                self.set_folds(len(chk['fold_S']))
+                self.fold_D2 = chk['fold_D2'][:,perm]
+                self.fold_DF = chk['fold_DF'][:,perm]
+                self.fold_F2 = chk['fold_F2'][:,perm]
+                self.fold_S = chk['fold_S']
+            if 'block_S' in chk.files:
+                self.keep_blocks()
+                blocks = zip(chk['block_D2'][:,perm], chk['block_DF'][:,perm],
+                             chk['block_F2'][:,perm], chk['block_S'])
+                if self.blk_pos % self.blk_len != 0: # still filling
+                    self.blk_cur = [self.blk_pos/self.blk_len] \
+                                        + list(blocks.pop())
+                for b in blocks:
+                    self.blocks.append(b)
+            if 'sketch_SD' in chk.files:
+                self.sketch = [chk['sketch_SD'][perm], chk['sketch_SF'][perm]]
+                self.sketch_base = tuple(chk['sketch_'+k][perm] \
+                                         for k in ['D2', 'DF', 'F2'])
+                self.sketch_rng = rand.RandomState()
+                self.sketch_rng.set_state(('MT19937',
+                        chk['sketch_key'], int(chk['sketch_pos']),
+                        int(chk['sketch_gauss'][0]),
+                        float(chk['sketch_gauss'][1])))
+            elif self.sketch is not None: # sketch from here on
+                self.sketch_base = self.D2.copy(), self.DF.copy(), \
+                                   self.F2.copy()
+            chk.close()
+
+        # The CountSketch, its base statistics and random state,
+        # for the checkpoint.
+        def sketch_state(self):
+            if self.sketch is None:
+                return {}
+            name, key, pos, has_gauss, gauss = self.sketch_rng.get_state()
+            return dict(sketch_SD=self.sketch[0], sketch_SF=self.sketch[1],
+                        sketch_D2=self.sketch_base[0],
+                        sketch_DF=self.sketch_base[1],
+                        sketch_F2=self.sketch_base[2],
+                        sketch_key=key, sketch_pos=pos,
+                        sketch_gauss=array([has_gauss, gauss]))
+
+        # Cross-validation and bootstrap statistics, for the checkpoint.
+        def block_stats(self):
+            st = {}
+            if self.folds > 0:
+                st.update(fold_D2=self.fold_D2, fold_DF=self.fold_DF,
+                          fold_F2=self.fold_F2, fold_S=self.fold_S)
+            if self.blocks is not None and len(self.all_blocks()) > 0:
+                blocks = self.all_blocks()
+                st.update(block_D2=array([b[0] for b in blocks]),
+                          block_DF=array([b[1] for b in blocks]),
+                          block_F2=array([b[2] for b in blocks]),
+                          block_S=array([b[3] for b in blocks]))
+            return st
+
+def term_names(t):
+    if hasattr(t, "terms"):
+        return reduce(lambda a,b: a+term_names(b), t.terms, [])
+    return [t.name]
+
+# (term, first parameter) of all leaf terms of t, in parameter order.
+def leaf_terms(t, i=0):
+    if not hasattr(t, "terms"):
+        return [(t, i)]
+    out = []
+    for u in t.terms:
+        out += leaf_terms(u, i)
+        i += u.params
+    return out
+
+# The frc_match object seen by forked workers (avoids pickling it),
+# see open_pool().
+_par_state = None
+
+def _par_worker(job):
+    x, f, w, chunk = job
+    fm = _par_state
+    tot = fm.zero_stats()
+    err = fm.zero_stats()
+    for j in range(0, len(x), chunk):
+        acc = fm.zero_stats()
+        fm.append_chunk(x[j:j+chunk], f[j:j+chunk], acc,
+                        part(w, slice(j, j+chunk)))
+        add_stats(tot, err, acc)
+    return tot + (frames(x, w),)
+
+# Compensated (Kahan) summation, s += x, for tuples of arrays.
+# err carries the rounding error of each sum between calls.
+# Per-chunk sums are added this way, so the totals keep close to
+# full float64 precision however many chunks are appended.
+def add_stats(s, err, x):
+    for si, ei, xi in zip(s, err, x):
+        y = xi - ei
+        t = si + y
+        ei[...] = (t - si) - y
+        si[...] = t
+
+# Split frames into nproc contiguous blocks and return the partial
+# sums, (D2, DF, F2, S), for each block in frame order.
+def par_stats(pool, x, f, chunk, nproc, w=None):
+    n = (len(x)+nproc-1)/nproc
+    jobs = [(x[i:i+n], f[i:i+n], part(w, slice(i, i+n)), chunk) \
+                for i in range(0, len(x), n)]
+    return pool.map(_par_worker, jobs, 1)
+
+# Frame weights w[idx], where w = None means all ones.
+def part(w, idx):
+    if w is None:
+        return None
+    return w[idx]
+
+# Number of frames in x, or their total weight.
+def frames(x, w):
+    if w is None:
+        return len(x)
+    return sum(w)
+
+# Weight the rows of the least-squares problem, D theta = f, so
+# frame i adds w[i] times its D^T D, D^T f and f^T f to the sums.
+def weight_rows(D, f, w):
+    r = sqrt(w)[:,newaxis,newaxis]
+    D *= broadcast_to(r[...,newaxis], f.shape[:2] + (1,1))
+    return D, f*r
+
+_chain_state = None
+
+# Cache for frc_match.frame_nnz, {topology : nnz}.
+_frame_nnz = WeakKeyDictionary()
+
+# Continue one Gibbs chain from state = (dtheta, z, alpha)
+# and return its final state, n samples and monitored quantities.
+def _chain_worker(job):
+    state, seed, skip, n = job
+    fm, toss = _chain_state
+    fm.dtheta, fm.z, fm.alpha = state
+    # The chain's own generator, so the parent's (with nproc = 1,
+    # fm is the parent) is left alone.
+    rng = fm.rng
+    fm.rng = rand.RandomState(seed)
+    try:
+        for i in xrange(skip):
+            fm.update_sample(toss)
+        out = []
+        m = []
+        for i in xrange(n):
+            out.append(fm.next_sample(toss))
+            m.append(concatenate((fm.z, fm.alpha, fm.dtheta)))
+    finally:
+        fm.rng = rng
+    return (fm.dtheta, fm.z, fm.alpha), out, m
+
+# Split-chain potential scale reduction for x : (chains, n, k).
+# Quantities that never change have R-hat = 1, while those constant
+# within each half-chain but differing between them have R-hat = inf.
+# Fewer than min_n samples per chain give R-hat = inf.
+def rhat(x, min_n=4):
+    n = x.shape[1]/2
+    if 2*n < min_n:
+        return inf*ones(x.shape[2])
+    x = concatenate((x[:,:n], x[:,n:2*n]))
+    W = mean(var(x, 1, ddof=1), 0)
+    B = var(mean(x, 1), 0, ddof=1)
+    V = (n-1.0)/n*W + B
+    R = ones(len(W))
+    k = W > 0.0
+    R[k] = sqrt(V[k]/W[k])
+    R[(W <= 0.0) & (B > 0.0)] = inf
+    return R
+
+# Effective sample size of x : (chains, n, k), from the
+# autocorrelations combined over chains, summed in pairs while
+# positive (Geyer's initial positive sequence).
+# Fewer than min_n samples per chain give ESS = 0.
+def ess(x, min_n=4):
+    m, n, k = x.shape
+    if n < min_n:
+        return zeros(k)
+    W = mean(var(x, 1, ddof=1), 0)
+    V = (n-1.0)/n*W
+    if m > 1:
+        V += var(mean(x, 1), 0, ddof=1)
+    const = V <= 0.0
+    V[const] = 1.0
+    rho = lambda t: 1.0 - mean(mean((x[:,t:]-x[:,:n-t])**2, 1), 0)/(2*V)
+    tau = -ones(k) # 1 + 2 sum rho_t = -1 + 2 sum (rho_2t + rho_2t+1)
+    act = ones(k, bool)
+    for t in range(0, n-1, 2):
+        pr = rho(t) + rho(t+1)
+        act &= pr > 0.0
+        if not act.any():
+            break
+        tau[act] += 2*pr[act]
+    tau[const] = 1.0
+    return m*n/maximum(tau, 1.0/log10(m*n+10))
+
 # Operates on row space of A
 def orthonormalize(A, complete=True):
     U, s, V = la.svd(A)
@@ -643,19 +1465,45 @@ def orthonormalize(A, complete=True):
         return V[:len(A)], V[len(A):]
     return V[:len(A)]
 
+# Add the rows of C to the orthonormal constraints, and remove them
+# from span, their orthonormal complement.  Rather than taking the
+# SVD of all constraints again, the Householder reflections that
+# triangularize C (within the span) are applied to the span.
+# This costs O(k P^2) for k new rows, instead of O(P^3).
+# Rows of C already within the constraints are left out.
+def add_constraints(constraints, span, C):
+    M = transpose(dot(C, transpose(span))) # C in span coordinates
+    S = span.copy()
+    r = 0 # rows of S moved to the constraints
+    for j in range(len(C)):
+        x = M[r:,j]
+        nx = sqrt(dot(x, x))
+        if nx < 1e-8:
+            print("Error: constraints are degenerate!")
+            continue
+        v = x.copy()
+        v[0] += nx if x[0] >= 0.0 else -nx
+        vv = dot(v, v)
+        M[r:] -= outer(v, dot(v, M[r:]))*(2.0/vv)
+        S[r:] -= outer(v, dot(v, S[r:]))*(2.0/vv)
+        r += 1
+    return concatenate((constraints, S[:r])), S[r:]
+
+# Inverse of A = L L^T, given its lower Cholesky factor, L.
+def chol_inv(L):
+	C, info = dpotri(L, lower=1)
+	if info != 0:
+		raise la.linalg.LinAlgError, "Singular Cholesky factor."
+	return tril(C) + transpose(tril(C,-1))
+
 # Solve Ax=b, where A is lower diagonal.
+# b may hold several right-hand sides as columns.
 def forward_subst(A, b):
-	x = b.copy()
-	for i in range(len(x)):
-		x[i] = (x[i]-sum(A[i,:i,newaxis]*x[:i,...],0))/A[i,i]
-	return x
+	return solve_triangular(A, b, lower=True, check_finite=False)
 
 # Solve Ax=b, where A is upper diagonal.
 def back_subst(A, b):
-	x = b.copy()
-	for i in reversed(range(len(x))):
-		x[i] = (x[i]-sum(A[i,i+1:,newaxis]*x[i+1:,...],0))/A[i,i]
-	return x
+	return solve_triangular(A, b, lower=False, check_finite=False)
 
 def lm_lstsq(x0, res, rj_jj, tol=1e-5, stop = 1e-8, max_iter=50):
     err = res(x0)
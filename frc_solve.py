@@ -30,7 +30,7 @@
 # 12/10/2007
 # This work was supported by a DOE CSGF.
 
-import sys
+import sys, os
 from cg_topol.ucgrad.array_io import *
 from cg_topol.ucgrad.parser import *
 from frc_match import *
@@ -41,6 +41,9 @@ UsageInfo =  "Usage: frc_solve.py [options] [files]\n" \
 "\t-p  [topology]    Molecule topology file\n"\
 "\t-x  [coordinates] Input coordinate sample/trajectory file\n"\
 "\t-o  [output]      Prefix for all output files\n"\
+"\t-chk [checkpoint] Read fit statistics from here (if it exists) and add\n"\
+"\t                  any -x/-f data to them.  The statistics and final\n"\
+"\t                  parameters are saved back here.\n"\
 "Options:\n" \
 "\t-f  [forces]      Input forces sample file\n"\
 "\t-sx [1.0]         Scale coordinates by this amount on input.\n"\
@@ -49,10 +52,40 @@ UsageInfo =  "Usage: frc_solve.py [options] [files]\n" \
 "\t-dt [1.0]         Time-step between input frames (dx = v*dt).\n"\
 "\t-kT [9.5e-4]      Boltzmann constant times temperature.\n"\
 "\t-ns 1000          Number of samples to collect.\n"\
-"\t-mle None         Prefix for writing initial maximum liklihood estimate.\n"
+"\t-mle None         Prefix for writing initial maximum liklihood estimate.\n"\
+"\t-np 1             Number of processes to use when reading data.\n"\
+"\t-sm chol          Sampling method for the spline coefficients,\n"\
+"\t                  chol (re-factor each step) or pcg (re-use factors).\n"\
+"\t-nc 1             Number of independent sampling chains, run on -np\n"\
+"\t                  processes.  Stops early once the chains converge.\n"\
+"\t-cv 0             Number of cross-validation folds to keep, and report\n"\
+"\t                  held-out force errors for.\n"\
+"\t-nb 0             Number of block bootstrap replicates of the MLE\n"\
+"\t                  (requires -mle, unless it is implied).  Writes\n"\
+"\t                  pointwise 95% bands on each term's energy to\n"\
+"\t                  [output]/boot/[term].dat.\n"\
+"\t-bs 10            Frames per block for -cv and -nb.\n"\
+"\t-sk 0             Rows kept per atom type in a random sketch of the\n"\
+"\t                  force design (0 = exact).  Cheaper for long\n"\
+"\t                  trajectories; errors in the fit shrink as 1/sqrt(rows).\n"\
+"\t-mem None         Memory for the design of each chunk of frames read,\n"\
+"\t                  e.g. 512M or 4G (default 100 frames at a time).\n"\
+"\t-prec double      Precision of the design matrices, double or single.\n"\
+"\t                  Sums over frames are always kept in double.\n"\
+"\t-la dense         Factor the precision matrix as dense or sparse.\n"\
+"\t                  sparse orders parameters to reduce the bandwidth,\n"\
+"\t                  which helps large topologies.  Only for fits\n"\
+"\t                  without constraints, which would fill it in.\n"\
+"\t-sel 1.0          Fraction of frames to fit, chosen by a cheap pre-pass\n"\
+"\t                  favoring frames with high leverage in the energy\n"\
+"\t                  design (i.e. rarely visited coordinates).  Frames\n"\
+"\t                  kept with probability p are weighted by 1/p.\n"
 
-RequiredFlags = ['p', 'o', 'x']
-AcceptedFlags = ['f', 'sx', 'sv', 'sf', 'dt', 'ns', 'mle', 'kT']\
+RequiredFlags = ['p', 'o']
+AcceptedFlags = ['x', 'f', 'chk', 'sx', 'sv', 'sf', 'dt', 'ns', 'mle', 'kT', \
+		 'np', 'sm', 'nc', 'cv', \
+		 'nb', 'bs', 'sel', 'sk', 'mem', \
+		 'prec', 'la']\
 				+RequiredFlags
 
 def main(argv):
@@ -75,6 +108,14 @@ def main(argv):
 	# read parameter file
 	topol, pdb = cg_topol(flags['p'][0])
 	
+        # Just do the right thing (TM).
+        if not flags.has_key('mle') \
+            and (topol.hyp_params == 0 or samples == 0):
+                flags['mle'] = flags['o']
+	if flags.has_key('nb') and not flags.has_key('mle'):
+		print "Error! -nb bootstraps the MLE, and requires -mle."
+		return 1
+	
 	dt = 1.0
 	if flags.has_key('dt'):
 		dt = float(flags['dt'][0])
@@ -89,7 +130,35 @@ def main(argv):
 	else:
 		print "Assuming kT = %f"%kT
 	
+	nproc = 1
+	if flags.has_key('np'):
+		nproc = int(flags['np'][0])
+	
 	forces = frc_match(topol, pdb, dt, kT)
+	if flags.has_key('bs'):
+		forces.blk_len = int(flags['bs'][0])
+	if flags.has_key('cv'):
+		forces.set_folds(int(flags['cv'][0]))
+	if flags.has_key('nb'):
+		forces.keep_blocks()
+	if flags.has_key('prec'):
+		if flags['prec'][0] not in ['single', 'double']:
+			print "Unknown precision: %s"%flags['prec'][0]
+			return 1
+		forces.single = flags['prec'][0] == 'single'
+	if flags.has_key('la'):
+		if flags['la'][0] not in ['dense', 'sparse']:
+			print "Unknown linear algebra: %s"%flags['la'][0]
+			return 1
+		forces.sparse = flags['la'][0] == 'sparse'
+		if forces.sparse and len(forces.constraints) > 0:
+			print "Error! -la sparse is only for fits "\
+			      "without constraints."
+			return 1
+	if flags.has_key('mem'):
+		forces.mem = parse_mem(flags['mem'][0])
+	if flags.has_key('sk') and int(flags['sk'][0]) > 0:
+		forces.set_sketch(int(flags['sk'][0]))
 	
 	# Classify and combine input into types
 	print "Interaction type index:"
@@ -102,45 +171,185 @@ def main(argv):
 				"formatted?"
 		return -1
 	
-	for xf, ff in zip(flags['x'],flags['f']):
-		print "Appending %s %s"%(xf,ff)
-		x = read_matrix(xf)
-		x = reshape(x, (len(x)/pdb.atoms, pdb.atoms, 3))
-		f = read_array(ff, x.shape)
-		if flags.has_key('sx'):
-			scale = float(flags['sx'][0])
-			print "Scaling positions by %f"%(scale)
-			x *= scale
-		if flags.has_key('sf'):
-			scale = float(flags['sf'][0])
-			print "Scaling forces by %f"%(scale)
-			f *= scale
-		forces.append(x, f) # Force matching.
+	if flags.has_key('chk') and os.path.exists(flags['chk'][0]):
+		print "Reading checkpoint %s"%(flags['chk'][0])
+		forces.read_chk(flags['chk'][0])
+	elif not flags.has_key('x'):
+		print "Error! -x or an existing -chk is required."
+		print UsageInfo
+		return 1
+	if flags.has_key('x'): # new data is added to any checkpoint
+		read_data(forces, flags, nproc)
+		if flags.has_key('chk'):
+			print "Writing checkpoint %s"%(flags['chk'][0])
+			forces.write_chk(flags['chk'][0])
 	
 	forces.dimensionality()
 
-        # Just do the right thing (TM).
-        if not flags.has_key('mle') \
-            and (forces.topol.hyp_params == 0 or samples == 0):
-                flags['mle'] = flags['o']
-
         if flags.has_key('mle'):
 		print "Finding maximum posterior estimate..."
 		forces.maximize()
 		print "Writing mle to prefix \"%s\"..."%(\
 					flags['mle'][0])
 		forces.write_out(flags['mle'][0])
+		if flags.has_key('nb'):
+			print "Block bootstrap, %s replicates..."%(\
+					flags['nb'][0])
+			forces.write_boot(flags['o'][0], \
+				forces.bootstrap(int(flags['nb'][0])))
 
         if forces.topol.hyp_params == 0 or samples == 0:
+            show_cv(forces)
+            save_state(forces, flags)
             return 0
 	
 	print "Sampling spline coefficients..."
-	forces.sample(samples, 500, 5)
+	method = 'chol'
+	if flags.has_key('sm'):
+		method = flags['sm'][0]
+	chains = 1
+	if flags.has_key('nc'):
+		chains = int(flags['nc'][0])
+	if chains > 1:
+		forces.sample_chains(samples, 500, 5, chains, nproc, method)
+	else:
+		forces.sample(samples, 500, 5, method)
 	
 	print "Writing output to prefix \"%s\"..."%(flags['o'][0])
 	forces.write_out(flags['o'][0])
+	show_cv(forces)
+	save_state(forces, flags)
 	return 0
 
+def show_cv(forces):
+	if forces.folds < 1:
+		return
+	print "Held-out force residuals (RMS err per atom type) ="
+	print "    fold " + " ".join("%12s"%t for t in forces.type_names)
+	for k, e in enumerate(forces.cv_error()):
+		print "    %4d "%k + " ".join("%e"%x for x in e)
+
+# Save the final theta, z and alpha into the checkpoint (if any),
+# so the next run with more data starts from them.
+def save_state(forces, flags):
+	if flags.has_key('chk'):
+		print "Updating checkpoint %s"%(flags['chk'][0])
+		forces.write_chk(flags['chk'][0])
+
+# Append all -x/-f file pairs to forces.
+def read_data(forces, flags, nproc=1):
+	wts = None
+	if flags.has_key('sel') and float(flags['sel'][0]) < 1.0:
+		wts = select_frames(forces, flags, float(flags['sel'][0]))
+	if nproc > 1: # one pool for all blocks read
+		forces.open_pool(nproc)
+	try:
+		read_files(forces, flags, wts, nproc)
+	finally:
+		forces.close_pool()
+
+# wts, if given, holds the weight of every frame in each file,
+# and frames with zero weight are skipped.
+def read_files(forces, flags, wts, nproc):
+	for n, (xf, ff) in enumerate(zip(flags['x'],flags['f'])):
+		print "Appending %s %s"%(xf,ff)
+		if flags.has_key('sx'):
+			print "Scaling positions by %f"%(float(flags['sx'][0]))
+		if flags.has_key('sf'):
+			print "Scaling forces by %f"%(float(flags['sf'][0]))
+		i = 0
+		w = None
+		for x, f in read_frames(xf, ff, forces.pdb.atoms):
+			if wts is not None:
+				w = wts[n][i:i+len(x)]
+				i += len(x)
+				k = w > 0.0
+				x, f, w = x[k], f[k], w[k]
+				if len(x) == 0:
+					continue
+			if flags.has_key('sx'):
+				x *= float(flags['sx'][0])
+			if flags.has_key('sf'):
+				f *= float(flags['sf'][0])
+			forces.append(x, f, nproc, w=w) # Force matching.
+
+# Choose about frac of all -x frames to fit.  Frame i is kept with
+# probability min(1, m*(h_i/sum(h) + 1/S)/2), where m = frac*S, and
+#   h_i = a_i^T (A^T A)^+ a_i
+# is its leverage in the energy design, A = topol.design(x, 0).
+# Only the cheap, order 0 design is used -- in one pass to build
+# A^T A and another to find h.  Half the frames are spread uniformly,
+# the other half favor rarely visited coordinates.
+# Kept frames are weighted by 1/p, so the sums over them are unbiased
+# estimates of the sums over all frames.
+# Returns a list of frame weights (0 if not kept), one per -x file.
+def select_frames(forces, flags, frac, seed=1):
+	sx = 1.0
+	if flags.has_key('sx'):
+		sx = float(flags['sx'][0])
+	def design(xf):
+		for x in read_coords(xf, forces.pdb.atoms):
+			yield forces.topol.design(x*sx, 0)
+	
+	print "Scoring frames for selection..."
+	S = 0
+	G = zeros((forces.topol.params, forces.topol.params))
+	for xf in flags['x']:
+		for A in design(xf):
+			G += dot(transpose(A), A)
+			S += len(A)
+	w, V = la.eigh(G)
+	k = w > 1e-10*w.max()
+	P = V[:,k]/sqrt(w[k]) # h_i = |a_i P|^2
+	rank = sum(k)
+	
+	m = frac*S
+	rng = random.RandomState(seed)
+	keep = []
+	for xf in flags['x']:
+		kf = []
+		for A in design(xf):
+			h = sum(dot(A, P)**2, 1)
+			p = minimum(1.0, 0.5*m*(h/rank + 1.0/S))
+			kf.append(where(rng.random_sample(len(p)) < p, 1.0/p, 0.0))
+		keep.append(concatenate(kf))
+	print "Keeping %d of %d frames."%(sum([sum(k > 0.0) for k in keep]), S)
+	return keep
+
+# Bytes in a size like 4G, 512M, 100k or 1000.
+def parse_mem(s):
+	scale = {'k':2**10, 'm':2**20, 'g':2**30, 't':2**40}
+	s = s.strip().lower().rstrip('b')
+	if s[-1] in scale:
+		return float(s[:-1])*scale[s[-1]]
+	return float(s)
+
+# Read a coordinate file, blk frames at a time.
+def read_coords(xf, atoms, blk=1000):
+	for x in iread_matrix(xf, blk*atoms):
+		yield reshape(x, (len(x)/atoms, atoms, 3))
+
+# Read coordinate and force files together, blk frames at a time.
+def read_frames(xf, ff, atoms, blk=1000):
+	fs = iread_list(ff, blk*atoms*3)
+	for x in iread_matrix(xf, blk*atoms):
+		x = reshape(x, (len(x)/atoms, atoms, 3))
+		try:
+			f = fs.next()
+		except StopIteration:
+			f = array([])
+		if len(f) < x.size:
+			raise RuntimeError, "Data file \"%s\" has fewer values "\
+				"than coordinate file \"%s\"."%(ff, xf)
+		yield x, reshape(f[:x.size], x.shape)
+	extra = len(f) > x.size
+	for f in fs:
+		extra = True
+		break
+	if extra:
+		print "Warning! Data file \"%s\" has more values than "\
+			"coordinate file \"%s\", ignoring the rest."%(ff, xf)
+
 if __name__ == "__main__":
         main(sys.argv)
 
@@ -0,0 +1,136 @@
+# Gaussian sampling for a precision matrix that is a weighted sum
+# of fixed, positive semi-definite pieces.
+
+# This file is part of ForceSolve, Copyright (C) 2008 David M. Rogers.
+#
+#   ForceSolve is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ForceSolve is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ForceSolve (i.e. frc_solve/COPYING).
+#   If not, contact the author(s) immediately \at/ wantye \/ gmail.com or
+#   http://forceSolve.sourceforge.net/. And see http://www.gnu.org/licenses/
+#   for a copy of the GNU GPL.
+
+from numpy import *
+import numpy.linalg as la
+import numpy.random as rand
+from scipy.linalg import cho_factor, cho_solve
+
+# Inside the Gibbs sampler, only the weights (z per atom type,
+# alpha per term) of the pieces making up iC change between draws
+# of theta.  So instead of factoring iC for every draw, this
+#
+#   1. keeps a square-root, K_j = R_j^T R_j, of every piece,
+#   2. draws x = iC^{-1} (b + sum_j sqrt(w_j) R_j^T eps_j),
+#      which has mean iC^{-1} b and covariance iC^{-1}, and
+#   3. solves for x by conjugate gradients, preconditioned by
+#      the Cholesky factor of iC at a reference set of weights, w0.
+#
+# Since every K_j is positive semi-definite, the eigenvalues of the
+# preconditioned system lie between min(w/w0) and max(w/w0).
+# The reference factor is renewed whenever that ratio exceeds kappa,
+# which keeps the number of CG iterations small (~15 for kappa = 2).
+#
+# The roots of all pieces are stacked into one (rank, P) matrix, so
+# iC(w) is a single product, R^T diag(w) R, needed only when
+# refactoring, and the CG products go through R.
+#
+#   pieces : [(i0 : Int, K : Array Float (n,n))]
+#     -- K_j occupies iC[i0:i0+n, i0:i0+n]
+#   span : Array Float (P, M), optional
+#     -- samples x in span coordinates instead, i.e. pieces are
+#        span K_j span^T.  Each K_j is still factored at its own
+#        (small) size, and only its root is projected.
+class wsum_sampler:
+    def __init__(self, P, pieces, kappa=2.0, tol=1.0e-10, tol_rank=1.0e-12,
+                 span=None):
+        self.P = P
+        self.kappa = kappa
+        self.tol = tol
+        R = [zeros((0,P))]
+        self.row = [zeros(0, int)] # piece of each row of R
+        for j, (i0, K) in enumerate(pieces):
+            n = len(K)
+            if not K.any():
+                continue
+            w, V = la.eigh(K)
+            keep = w > tol_rank*max(w.max(), 0.0)
+            Rj = sqrt(w[keep])[:,newaxis]*transpose(V[:,keep])
+            if span is not None:
+                Rj = dot(Rj, transpose(span[:,i0:i0+n]))
+            else:
+                Rj = concatenate((zeros((len(Rj),i0)), Rj,
+                                  zeros((len(Rj),P-i0-n))), 1)
+            R.append(Rj)
+            self.row.append(j + zeros(len(Rj), int))
+        self.R = concatenate(R)
+        self.row = concatenate(self.row)
+        self.w0 = None
+        self.refactors = 0
+        self.iters = 0
+
+    def calc_iC(self, w):
+        Rw = sqrt(w)[self.row][:,newaxis]*self.R
+        return dot(transpose(Rw), Rw)
+
+    # iC(w) x, through the roots.
+    def mul(self, w, x):
+        wr = w[self.row]
+        if x.ndim > 1:
+            wr = wr[:,newaxis]
+        return dot(transpose(self.R), wr*dot(self.R, x))
+
+    # Returns the solution to iC(w) x = b (b may have several columns).
+    def solve(self, w, b):
+        w = array(w, float)
+        if self.w0 is None or (w/self.w0).max() \
+                        > self.kappa*(w/self.w0).min():
+            self.L = cho_factor(self.calc_iC(w), lower=True)
+            self.w0 = w
+            self.refactors += 1
+            return cho_solve(self.L, b)
+        return self.pcg(w, b)
+
+    # Preconditioned conjugate gradients, run on all columns at once.
+    def pcg(self, w, b):
+        x = cho_solve(self.L, b)
+        r = b - self.mul(w, x)
+        bn = sqrt(sum(b*b, 0)) + 1e-300
+        z = cho_solve(self.L, r)
+        p = z.copy()
+        rz = sum(r*z, 0)
+        for it in range(10*self.P):
+            if (sqrt(sum(r*r, 0))/bn).max() < self.tol:
+                break
+            Ap = self.mul(w, p)
+            a = rz/(sum(p*Ap, 0) + 1e-300)
+            x += a*p
+            r -= a*Ap
+            z = cho_solve(self.L, r)
+            rz, rz0 = sum(r*z, 0), rz
+            p = z + (rz/(rz0 + 1e-300))*p
+        self.iters += it
+        return x
+
+    # A draw of sum_j sqrt(w_j) R_j^T eps_j, i.e. from N(0, iC(w)).
+    # rng is numpy.random or a RandomState.
+    def perturb(self, w, rng=rand):
+        eps = rng.standard_normal(len(self.R))
+        return dot(sqrt(array(w, float))[self.row]*eps, self.R)
+
+    # Returns the mean, iC(w)^{-1} b, and a draw from N(0, iC(w)^{-1}).
+    def draw(self, w, b, rng=rand):
+        x = self.solve(w, transpose([b, self.perturb(w, rng)]))
+        return x[:,0], x[:,1]
+
+    # Another draw from N(0, iC(w)^{-1}), at the same weights.
+    def noise(self, w, rng=rand):
+        return self.solve(w, self.perturb(w, rng))
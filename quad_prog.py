@@ -1,65 +1,109 @@
-# See maggotroot.blogspot.com/2013/11/constrained-linear-least-squares-in.html
-# for examples using sparse matrices.
-# Unfortunately, the conversions to/from cxvopt.matrix didn't work for me.
+# Small quadratic programs, for maximizing the posterior
+# when inequality constraints (topol.ineqs) are present.
+# This replaces a wrapper around cvxopt's solvers.qp, whose
+# conversions to/from cvxopt.matrix dominated the run time.
 
 import numpy as np
-from cvxopt import solvers, matrix #, spmatrix, mul
-#import itertools
-#from scipy import sparse
 import numpy.linalg as la
-
-solvers.options['show_progress'] = False
-
-def mat(x):
-    if x is None:
-	return None
-    if len(x.shape) == 2: # gotta love fortran
-	return matrix(np.transpose(x).tolist(), x.shape, 'd')
-    else: # the column vector
-	return matrix(x.tolist(), (len(x), 1), 'd')
-
-def arr(m):
-    if m is None:
-	return None
-    s = m.size
-    if s[0] == 1: # vectors
-	m = m.T
-	s = m.size
-    if s[1] == 1:
-	x = np.zeros(s[0])
-	for i in range(s[0]):
-	    x[i] = m[i,0]
-	return x
-    x = np.zeros(s)
-    for i in range(s[0]):
-	for j in range(s[1]):
-	    x[i,j] = m[i,j]
-    return x
+from scipy.linalg import cho_factor, cho_solve
 
 # Solve min x^T P x / 2 + q^T x
 #   subject to G x <= h
 #   and A x = b
-# documentation at:
-# http://cvxopt.org/userguide/coneprog.html#quadratic-programming
+# P must be positive definite (on the null space of A).
+# x0 is used as a starting point when it is feasible.
 def quad_prog(P, q, G=None,h=None, A=None,b=None, x0=None):
     assert len(P) == len(q) and len(P) == P.shape[1]
     P = 0.5*(P + np.transpose(P))
-    if G is None: # lsqlin will throw a fit
-	if A == None: # Totally unconstrained solve.
-	    return la.solve(P, -q)
+    if A is not None: # Solve within the null space of A.
 	n = len(A) # number of constraints
 	U, s, V = la.svd(A)
 	if np.any(np.abs(s) < 1e-8):
 	    print "Error: constraints are degenerate!"
 	    return np.zeros(len(q))
 	ib = np.dot(b, np.dot(U/s, V[:n]))
-	y = la.solve(np.dot(V[n:], np.dot(P, np.transpose(V[n:]))),
-		     -np.dot(V[n:], q + np.dot(P, ib)))
-	return np.dot(y, V[n:]) + ib
+	N = V[n:]
+	Pn = np.dot(N, np.dot(P, np.transpose(N)))
+	qn = np.dot(N, q + np.dot(P, ib))
+	if G is not None:
+	    G, h = np.dot(G, np.transpose(N)), h - np.dot(G, ib)
+	if x0 is not None:
+	    x0 = np.dot(N, x0 - ib)
+	return np.dot(quad_prog(Pn, qn, G, h, x0=x0), N) + ib
+
+    if G is None: # Totally unconstrained solve.
+	return la.solve(P, -q)
+    return active_set(P, q, G, h, x0)
 
-    sol = solvers.qp(mat(P),mat(q), mat(G),mat(h), mat(A),mat(b), mat(x0))
-    if sol['status'] != "optimal":
-	print "Unable to minimize."
-	return np.zeros(len(q))
-    return arr(sol['x'])
+# Primal active-set method (Nocedal and Wright, Alg. 16.3).
+# Each step solves the equality-constrained problem for the
+# working set, W, using one Cholesky factorization of P:
+#   p = -P^{-1} (P x + q + G_W^T u),
+#   (G_W P^{-1} G_W^T) u = -G_W P^{-1} (P x + q),
+# then moves along p until a constraint blocks, or drops the
+# constraint with the most negative multiplier, u, once p = 0.
+# If neither x0 nor 0 is feasible, one is found by feasible_point.
+def active_set(P, q, G, h, x0=None, tol=1e-10, maxiter=None):
+    m, n = G.shape
+    if maxiter is None:
+	maxiter = 10*(m + n)
+    if x0 is None:
+	x0 = np.zeros(n)
+    if np.any(np.dot(G, x0) > h + tol):
+	if np.all(h >= -tol):
+	    x0 = np.zeros(n)
+	else:
+	    x0 = feasible_point(G, h, x0, tol)
+    L = cho_factor(P)
+    iPG = cho_solve(L, np.transpose(G)) # (n, m)
+    x = np.array(x0, float)
+    W = []
+    for it in xrange(maxiter):
+	d = cho_solve(L, np.dot(P, x) + q) # P^{-1} grad
+	u = np.zeros(0)
+	if len(W) > 0:
+	    u = la.solve(np.dot(G[W], iPG[:,W]), -np.dot(G[W], d))
+	p = -d - np.dot(iPG[:,W], u)
+	if np.sqrt(np.dot(p, p)) <= tol*(1.0 + np.sqrt(np.dot(x, x))):
+	    if len(W) == 0 or u.min() >= -tol:
+		return x
+	    del W[np.argmin(u)]
+	    continue
+	Gp = np.dot(G, p)
+	alpha, block = 1.0, None
+	for i in np.nonzero(Gp > tol)[0]:
+	    if i in W:
+		continue
+	    a = max(h[i] - np.dot(G[i], x), 0.0)/Gp[i]
+	    if a < alpha:
+		alpha, block = a, i
+	x += alpha*p
+	if block is not None:
+	    W.append(block)
+    print "Unable to minimize (active set did not converge)."
+    return x
 
+# Phase 1: the point nearest x0 with G x <= h.
+# Solves, with a big-M penalty on the largest violation, s,
+#   min |x - x0|^2/2 + s^2/2 + M s
+#   subject to G x - s <= h and s >= 0,
+# starting from the feasible (x0, max(G x0 - h)).  The penalty is
+# exact (s = 0) once M exceeds the sum of the multipliers, so M is
+# raised until s = 0, or up to Mmax, when G x <= h is declared
+# infeasible.
+def feasible_point(G, h, x0, tol=1e-10, Mmax=1e12):
+    m, n = G.shape
+    Gs = np.zeros((m+1, n+1))
+    Gs[:m,:n] = G
+    Gs[:m,n] = -1.0
+    Gs[m,n] = -1.0
+    hs = np.concatenate((h, [0.0]))
+    x = np.concatenate((x0, [max(np.max(np.dot(G, x0) - h), 0.0)]))
+    M = 1.0
+    while M <= Mmax:
+	q = np.concatenate((-x0, [M]))
+	x = active_set(np.identity(n+1), q, Gs, hs, x, tol)
+	if x[n] <= tol:
+	    return x[:n]
+	M *= 100.0
+    raise ValueError, "Unable to minimize (no feasible starting point)."
@@ -0,0 +1,86 @@
+# Cholesky factorization of sparse, symmetric positive definite
+# matrices, after a bandwidth-reducing ordering.
+
+# This file is part of ForceSolve, Copyright (C) 2008 David M. Rogers.
+#
+#   ForceSolve is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ForceSolve is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ForceSolve (i.e. frc_solve/COPYING).
+#   If not, contact the author(s) immediately \at/ wantye \/ gmail.com or
+#   http://forceSolve.sourceforge.net/. And see http://www.gnu.org/licenses/
+#   for a copy of the GNU GPL.
+
+from numpy import *
+from scipy.sparse import csr_matrix, issparse
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from scipy.linalg import cholesky_banded, cho_solve_banded, solve_banded
+
+# The spline priors are banded, and parameters of terms that never
+# act on the same atoms are not coupled by D2, so iC is often sparse.
+# This factors
+#
+#   A[p][:,p] = L L^T,
+#
+# where the reverse Cuthill-McKee ordering, p, gathers the non-zeros
+# of A near its diagonal.  Both A[p][:,p] and L are then stored as
+# bands of width u, so factoring costs O(n u^2) instead of O(n^3)
+# and every solve O(n u) instead of O(n^2).
+#
+# Only exact zeros of A are left out, so results match the dense
+# factorization.  When A has no useful structure (u ~ n), the cost
+# is that of the dense factorization.
+#
+# An ordering, p, found for an earlier matrix with the same pattern
+# may be passed in to skip the reordering.  Any p gives the right
+# answer, only u depends on it.
+class sparse_chol:
+    def __init__(self, A, p=None):
+        if not issparse(A):
+            A = csr_matrix(A)
+        A = A.tocsr()
+        self.n = A.shape[0]
+        if p is None:
+            p = reverse_cuthill_mckee(A, symmetric_mode=True)
+        self.p = p
+        A = A[self.p][:,self.p].tocoo()
+        lo = A.row >= A.col
+        i, j = A.row[lo], A.col[lo]
+        self.u = int((i-j).max()) if len(i) > 0 else 0
+
+        ab = zeros((self.u+1, self.n)) # ab[i-j, j] = A[i,j]
+        ab[i-j, j] = A.data[lo]
+        self.L = cholesky_banded(ab, lower=True)
+        # L^T in upper banded form, ut[u+i-j, j] = L[j,i]
+        self.Lt = zeros(self.L.shape)
+        for k in range(self.u+1):
+            self.Lt[self.u-k, k:] = self.L[k, :self.n-k]
+
+    # Returns the solution to A x = b (b may have several columns).
+    def solve(self, b):
+        x = empty(b.shape)
+        x[self.p] = cho_solve_banded((self.L, True), b[self.p], \
+                                     check_finite=False)
+        return x
+
+    # Returns x = A^{-1/2} e, so that x ~ N(0, A^{-1}) when
+    # e ~ N(0, 1).
+    def noise(self, e):
+        x = empty(e.shape)
+        x[self.p] = solve_banded((0, self.u), self.Lt, e, \
+                                 check_finite=False)
+        return x
+
+    # Columns j0:j1 of A^{-1}.
+    def inv_cols(self, j0, j1):
+        b = zeros((self.n, j1-j0))
+        b[arange(j0, j1), arange(j1-j0)] = 1.0
+        return self.solve(b)
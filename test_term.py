@@ -25,7 +25,7 @@ D = term.design(x, 1)[1]
 #print D
 
 # shape = x.shape + (params,)
-D2 = num_deriv(lambda x: term.design(x)[0], x)
+D2 = num_deriv(lambda x: term.design(x), x)
 
 print abs(D2 - D) > 1e-5
 print abs(D - D2).max()
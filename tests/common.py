@@ -0,0 +1,106 @@
+# Small systems shared by the tests.
+# Run all tests from the top directory with
+#   python2 -m unittest discover -s tests
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from numpy import *
+import numpy.linalg as la
+import numpy.random as rand
+from cg_topol import *
+from cg_topol.pdb import PDB
+from frc_match import frc_match, add_constraints, add_stats, rhat, ess, \
+                      leaf_terms
+
+# nw waters, (O, H, H) each, with spline or polynomial terms.
+def water(nw=3, spline=True):
+    edge = []
+    angs = []
+    for w in range(nw):
+        o = 3*w
+        edge += [(o,o+1), (o,o+2)]
+        angs += [(o+1,o,o+2)]
+    if spline:
+        terms = [SplineBond("bond_hw_ow", edge),
+                 SplineAngle("angle_hw_ow_hw", angs)]
+    else:
+        terms = [PolyBond("bond_hw_ow", edge),
+                 PolyAngle("angle_hw_ow_hw", angs)]
+    names = [("SOL", w+1, t) for w in range(nw) for t in ("ow","hw","hw")]
+    pdb = PDB(names, array([16.,1.,1.]*nw), zeros((3*nw,3)), set(edge))
+    return FFconcat(terms), pdb
+
+# S frames of water coordinates near (r, theta) = (1.8, 1.82) and
+# forces from harmonic bond and angle potentials, plus noise.
+def water_data(nw=3, S=60, seed=0):
+    rs = rand.RandomState(seed)
+    x = zeros((S, 3*nw, 3))
+    f = 0.01*rs.standard_normal(x.shape)
+    for w in range(nw):
+        o = 3*w
+        r = 1.8 + 0.1*rs.standard_normal((S,2))
+        th = 1.82 + 0.1*rs.standard_normal(S)
+        x[:,o] = [5.0*w, 0.0, 0.0]
+        x[:,o+1] = x[:,o] + r[:,0,newaxis]*array([1.0, 0.0, 0.0])
+        x[:,o+2] = x[:,o] + r[:,1,newaxis] \
+                        *transpose([cos(th), sin(th), 0.0*th])
+    x += 0.05*rs.standard_normal(x.shape)
+    for w in range(nw):
+        o = 3*w
+        for h in (1,2):
+            d = x[:,o+h] - x[:,o]
+            r = sqrt(sum(d*d, -1))[:,newaxis]
+            g = -0.5*(r-1.8)*d/r
+            f[:,o+h] += g
+            f[:,o] -= g
+    return x, f
+
+def water_match(nw=3, spline=True, **kws):
+    topol, pdb = water(nw, spline)
+    return frc_match(topol, pdb, 1.0, 1.0, **kws)
+
+# A branched 6-atom molecule,
+#    0   4
+#    |   |
+#    1 - 2 - 3 - 5
+# with every kind of bonded term, and pair terms between its ends.
+mol_edges = [(0,1), (1,2), (2,3), (2,4), (3,5)]
+mol_angs  = [(0,1,2), (1,2,3), (1,2,4), (3,2,4), (2,3,5)]
+mol_tors  = [(0,1,2,3), (0,1,2,4), (1,2,3,5), (4,2,3,5)]
+mol_impr  = [(2,1,3,4)]
+
+def mixed():
+    terms = [FFconcat([SplineBond("sb", mol_edges[:3]),
+                       PolyBond("pb", mol_edges[2:])]),
+             FFconcat([SplineAngle("sa", mol_angs[:3]),
+                       PolyAngle("pa", mol_angs[2:]),
+                       PolyUB("ub", mol_angs[:2])]),
+             PolyTorsion("pt", mol_tors),
+             PolyImprop("pi", mol_impr),
+             LJPair("lj", [(0,5), (0,3), (4,5)])]
+    names = [("MOL", 1, t) for t in ("a","b","b","b","a","a")]
+    pdb = PDB(names, array([1.,12.,12.,12.,1.,1.]), zeros((6,3)),
+              set(mol_edges))
+    return FFconcat(terms), pdb
+
+# Frames of the molecule above, near a reference structure.
+def mixed_coords(S=20, seed=0, s=0.1):
+    x0 = array([[0.0, 1.0, 0.0], [0.0, 0.0, 0.0], [1.5, 0.0, 0.0],
+                [2.0, 1.4, 0.3], [2.0,-0.9,-0.8], [3.4, 1.5, 0.9]])
+    return x0 + s*rand.RandomState(seed).standard_normal((S,)+x0.shape)
+
+# A nonlinear force, f = c0 tanh(c1 x), on every atom.
+def tanh_seed(x):
+    return x.copy()
+
+def tanh_F(c, s):
+    return c[0]*tanh(c[1]*s)
+
+def tanh_J(c, s):
+    t = tanh(c[1]*s)
+    return concatenate((t[...,newaxis],
+                        (c[0]*s*(1.0-t*t))[...,newaxis]), -1)
+
+def add_tanh(fm, c=(0.1, 0.5)):
+    fm.add_nonlin("tanh", array(c), tanh_seed, tanh_F, tanh_J)
@@ -0,0 +1,46 @@
+import unittest
+from common import *
+from num_deriv import num_deriv
+from cg_topol.sparse_design import band_sum
+
+class BandDesign(unittest.TestCase):
+    def setUp(self):
+        self.terms = [SplineBond("b", mol_edges), SplineAngle("a", mol_angs)]
+
+    # The banded rows hold exactly the nonzero spline values.
+    def test_spline_band(self):
+        y = linspace(0.2, 3.8, 40).reshape((4,10))
+        t = self.terms[0]
+        col, spl = t.spline_band(y, 1)
+        dense = t.spline(y, 1)
+        band = zeros(dense.shape)
+        for k in range(2):
+            put_along_axis(band[k], col, spl[k], -1)
+        self.assertTrue(allclose(band, dense, rtol=1e-13, atol=1e-13))
+        sh = (4, 6, 3, t.params)
+        self.assertTrue(allclose(band_sum(sh, col, spl[0]),
+                                 sum(dense[0], -2)))
+
+    # The force design is the derivative of the energy design.
+    def test_derivative(self):
+        x = mixed_coords(S=1)[0]
+        for t in self.terms:
+            A, B = t.design_sparse(x)
+            self.assertTrue(allclose(A, t.design(x, 0)))
+            D = B.todense()
+            Dn = num_deriv(lambda y: t.design(y, 0), x)
+            # central differences are off by ~h^2 near the knots
+            self.assertTrue(abs(D - Dn).max() < 1e-4*abs(D).max())
+
+    def test_frames(self):
+        x = mixed_coords(S=3)
+        for t in self.terms:
+            A, B = t.design_sparse(x)
+            D = B.todense()
+            for i in range(len(x)):
+                Ai, Bi = t.design_sparse(x[i])
+                self.assertTrue(allclose(A[i], Ai))
+                self.assertTrue(allclose(D[i], Bi.todense()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from common import *
+
+class BlockDesignTest(unittest.TestCase):
+    def setUp(self):
+        self.topol, self.pdb = mixed()
+        self.x = mixed_coords(S=4)
+        self.A, self.B = self.topol.design_sparse(self.x)
+        self.D = self.B.todense()
+        self.tidx = array([0, 1, 1, 1, 0, 2])
+
+    # Blocks only hold the atoms their terms touch.
+    def test_dense(self):
+        for a, c, A in self.B.blocks:
+            self.assertEqual(A.shape[0], len(a)*len(self.x)*3)
+        touched = self.D.any(-1).any(-1).any(0)
+        self.assertTrue(all(nonzero(touched)[0]
+                == unique(concatenate([a for a,c,A in self.B.blocks]))))
+        B = BlockDesign.from_dense(self.D)
+        self.assertTrue(all(B.todense() == self.D))
+
+    def test_dot_imul(self):
+        c = rand.RandomState(1).standard_normal(self.B.shape[-1])
+        self.assertTrue(allclose(self.B.dot(c), dot(self.D, c)))
+        w = rand.RandomState(2).random_sample(self.x.shape[:-1] + (1,1))
+        self.B *= w
+        self.B *= 3.0
+        self.assertTrue(allclose(self.B.todense(), 3.0*w*self.D))
+
+    def test_shift(self):
+        P = self.B.shape[-1]
+        Ds = self.B.shift(2, P+5).todense()
+        self.assertTrue(all(Ds[...,2:P+2] == self.D))
+        self.assertFalse(Ds[...,:2].any() or Ds[...,P+2:].any())
+
+    # D^T D and D^T F, summed over the atoms of each type.
+    def test_type_sums(self):
+        P = self.B.shape[-1]
+        D2 = zeros((3,P,P))
+        DF = zeros((3,P))
+        F = rand.RandomState(3).standard_normal(self.x.shape)
+        self.B.type_gram(self.tidx, D2)
+        self.B.type_rhs(self.tidx, F, DF)
+        for t in range(3):
+            Dt = self.D[:,self.tidx == t].reshape((-1,P))
+            Ft = F[:,self.tidx == t].reshape(-1)
+            self.assertTrue(allclose(D2[t], dot(transpose(Dt), Dt),
+                                     rtol=1e-12, atol=1e-12))
+            self.assertTrue(allclose(DF[t], dot(Ft, Dt),
+                                     rtol=1e-12, atol=1e-12))
+
+if __name__ == "__main__":
+    unittest.main()
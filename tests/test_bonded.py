@@ -0,0 +1,61 @@
+import unittest
+from common import *
+from num_deriv import num_deriv
+from cg_topol.torsions import SplineTorsion, torsion, dtorsion, tor_vecs
+from cg_topol.sparse_design import index_array
+from cg_topol.spline_term import SplineTerm
+
+def bonded_terms():
+    return [SplineBond("sb", mol_edges), PolyBond("pb", mol_edges),
+            PolyUB("ub", mol_angs), SplineAngle("sa", mol_angs),
+            PolyAngle("pa", mol_angs), SplineTorsion("st", mol_tors),
+            PolyTorsion("pt", mol_tors), PolyImprop("pi", mol_impr),
+            LJPair("lj", [(0,5), (0,3), (4,5)])]
+
+# Energy design for a single frame, of any term.
+def design(t, x, order):
+    if hasattr(t, "design"):
+        return t.design(x, order)
+    return t.design_tor(x, order)
+
+# force() and the order-1 design against finite differences of energy().
+class Bonded(unittest.TestCase):
+    def setUp(self):
+        self.x = mixed_coords(S=2)
+
+    def coeffs(self, t, seed=0):
+        return 0.1*rand.RandomState(seed).standard_normal(t.params)
+
+    # Central differences are off by ~h^2 near the spline knots.
+    def assertClose(self, t, a, b):
+        rtol = 1e-3 if isinstance(t, SplineTerm) else 1e-6
+        self.assertTrue(abs(a - b).max() <= rtol*abs(b).max(),
+                        "%s: error %e"%(t.name,
+                                        abs(a - b).max()/abs(b).max()))
+
+    def test_dtorsion(self):
+        v = tor_vecs(self.x[0], index_array(mol_tors, 4))
+        phi, dphi = dtorsion(v.copy())
+        self.assertTrue(allclose(phi, torsion(v.copy())))
+
+    def test_force(self):
+        for x in self.x:
+            for t in bonded_terms():
+                c = self.coeffs(t)
+                en, F = t.force(c, x)
+                self.assertAlmostEqual(en, t.energy(c, x), 10, t.name)
+                dE = num_deriv(lambda y: t.energy(c, y), x)
+                self.assertClose(t, F, -dE)
+
+    def test_design(self):
+        for x in self.x:
+            for t in bonded_terms():
+                c = self.coeffs(t, 1)
+                A, D = design(t, x, 1)
+                self.assertAlmostEqual(dot(A, c), t.energy(c, x), 10)
+                self.assertTrue(allclose(design(t, x, 0), A))
+                dE = num_deriv(lambda y: t.energy(c, y), x)
+                self.assertClose(t, dot(D, c), dE)
+
+if __name__ == "__main__":
+    unittest.main()
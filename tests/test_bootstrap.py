@@ -0,0 +1,67 @@
+import unittest
+from common import *
+
+class Bootstrap(unittest.TestCase):
+    def setUp(self):
+        self.x, self.f = water_data(S=30)
+        fm = water_match()
+        fm.append(self.x[:6].copy(), self.f[:6].copy()) # in every replicate
+        fm.keep_blocks(8)
+        fm.append(self.x[6:].copy(), self.f[6:].copy())
+        fm.z[:] = [2.0, 0.5]
+        fm.alpha[:] = [1.0, 1.0]
+        self.fm = fm
+
+    def test_blocks(self):
+        blocks = self.fm.all_blocks()
+        self.assertEqual([b[3] for b in blocks], [8, 8, 8])
+        for i, b in enumerate(blocks):
+            a = water_match()
+            a.append(self.x[6+8*i:14+8*i].copy(),
+                     self.f[6+8*i:14+8*i].copy())
+            self.assertTrue(allclose(b[0], a.D2, rtol=1e-10, atol=1e-12))
+            self.assertTrue(allclose(b[1], a.DF, rtol=1e-10, atol=1e-12))
+
+    # Pointwise bands of the energy functions, from 100 replicates
+    # of a fit to frames x, f in 12 blocks.
+    def bands(self, x, f):
+        fm = water_match()
+        fm.keep_blocks(len(x)//12)
+        fm.append(x.copy(), f.copy())
+        fm.z[:] = [2.0, 0.5]
+        fm.alpha[:] = [1.0, 1.0]
+        rand.seed(5)
+        bands = fm.boot_bands(fm.bootstrap(100))
+        self.assertEqual([b[0] for b in bands],
+                         ["bond_hw_ow", "angle_hw_ow_hw"])
+
+        mle = fm.theta0 + fm.solve_theta(fm.D2, fm.DF)
+        for (name, x, lo, hi), (t, i) in zip(bands, leaf_terms(fm.topol)):
+            E = dot(t.spline(x), mle[i:i+t.params])*fm.kT
+            tol = 1e-8*abs(E).max()
+            self.assertTrue(all(lo <= E + tol) and all(E <= hi + tol))
+        return bands
+
+    # The bands contain the MLE curves, and shrink with more frames.
+    def test_bands(self):
+        x, f = water_data(S=240, seed=1)
+        b1 = self.bands(x[:24], f[:24])
+        b2 = self.bands(x, f)
+        for (n, x, lo1, hi1), (m, y, lo2, hi2) in zip(b1, b2):
+            self.assertTrue(mean(hi2 - lo2) < 0.8*mean(hi1 - lo1))
+        self.assertRaises(ValueError, water_match().bootstrap)
+
+    # Replicates are constrained MLEs, so they satisfy the ineqs
+    # (which the unconstrained fit to these forces does not).
+    def test_ineqs(self):
+        fm = water_match(spline=False)
+        fm.keep_blocks(8)
+        fm.append(self.x.copy(), -self.f)
+        mle = fm.theta0 + fm.solve_theta(fm.D2, fm.DF)
+        self.assertTrue((dot(fm.ineqs, mle) < 0.0).any())
+        rand.seed(5)
+        thetas = fm.bootstrap(10)
+        self.assertTrue((dot(thetas, transpose(fm.ineqs)) > -1e-8).all())
+
+if __name__ == "__main__":
+    unittest.main()
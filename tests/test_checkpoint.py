@@ -0,0 +1,63 @@
+import unittest, tempfile, shutil
+from common import *
+
+class Checkpoint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.chk = os.path.join(self.dir, "fit.chk")
+        self.x, self.f = water_data(S=40)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameStats(self, a, b):
+        self.assertEqual(a.S, b.S)
+        for u, v in [(a.D2, b.D2), (a.DF, b.DF), (a.F2, b.F2)]:
+            self.assertTrue(allclose(u, v, rtol=1e-12, atol=1e-14))
+
+    # Restoring and appending the rest equals appending everything.
+    def test_round_trip(self):
+        whole = water_match()
+        whole.append(self.x.copy(), self.f.copy())
+
+        part = water_match()
+        part.append(self.x[:15].copy(), self.f[:15].copy())
+        part.z[:] = [2.0, 3.0]
+        part.write_chk(self.chk)
+        rest = water_match()
+        rest.read_chk(self.chk)
+        self.assertSameStats(part, rest)
+        self.assertTrue(all(rest.z == part.z))
+        rest.append(self.x[15:].copy(), self.f[15:].copy())
+        self.assertSameStats(whole, rest)
+
+    def test_folds_and_blocks(self):
+        a = water_match()
+        a.set_folds(3, 4)
+        a.keep_blocks()
+        a.append(self.x[:18].copy(), self.f[:18].copy())
+        a.write_chk(self.chk)
+        b = water_match()
+        b.read_chk(self.chk)
+        self.assertTrue(allclose(a.fold_D2, b.fold_D2))
+        self.assertTrue(all(a.fold_S == b.fold_S))
+        for u, v in zip(a.all_blocks(), b.all_blocks()):
+            for s, t in zip(u, v):
+                self.assertTrue(allclose(s, t))
+        a.append(self.x[18:].copy(), self.f[18:].copy())
+        b.append(self.x[18:].copy(), self.f[18:].copy())
+        self.assertTrue(allclose(a.fold_D2, b.fold_D2))
+        self.assertEqual(len(a.all_blocks()), len(b.all_blocks()))
+
+    def test_other_topology(self):
+        a = water_match()
+        a.append(self.x.copy(), self.f.copy())
+        a.write_chk(self.chk)
+        self.assertRaises(ValueError, water_match(spline=False).read_chk,
+                          self.chk)
+        b = water_match()
+        b.append(self.x[:5].copy(), self.f[:5].copy())
+        self.assertRaises(ValueError, b.read_chk, self.chk)
+
+if __name__ == "__main__":
+    unittest.main()
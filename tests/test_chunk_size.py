@@ -0,0 +1,44 @@
+import unittest
+from common import *
+import frc_match as fmod
+
+class ChunkSize(unittest.TestCase):
+    def test_default(self):
+        x, f = water_data(S=5)
+        self.assertEqual(water_match().chunk_size(x), 100)
+
+    # The design is only built once per topology to count non-zeros.
+    def test_nnz_cache(self):
+        x, f = water_data(S=5)
+        a = water_match()
+        nnz = sum([A.nnz for b, c, A in a.design(x[:1]).blocks])
+        self.assertEqual(a.frame_nnz(x[:1]), nnz)
+        b = frc_match(a.topol, a.pdb, 1.0, 1.0)
+        def no_design(x):
+            raise AssertionError, "design rebuilt"
+        b.design = no_design
+        self.assertEqual(b.frame_nnz(x[:1]), nnz)
+        self.assertEqual(b.frame_bytes(x[:1]), a.frame_bytes(x[:1]))
+        self.assertTrue(a.topol in fmod._frame_nnz)
+
+    # Each non-zero of a frame's design costs a COO (value, row, col)
+    # triplet, the product giving its value, and a CSR (value, int32
+    # col) pair, with values in the precision of the design.
+    def test_budget(self):
+        x, f = water_data(S=5)
+        fm = water_match()
+        ib = 2*dtype(intp).itemsize + dtype(int32).itemsize
+        for single in [True, False]:
+            fm.single = single
+            vb = dtype(float32 if single else float64).itemsize
+            fb = fm.frame_bytes(x[:1])
+            self.assertTrue(fb > (3*vb + ib)*fm.frame_nnz(x[:1]))
+        fm.mem = 10.5*fb
+        self.assertEqual(fm.chunk_size(x), 10)
+        self.assertEqual(fm.chunk_size(x, 2), 5)
+        fm.mem = 1.0
+        fm.frame_mem = None
+        self.assertEqual(fm.chunk_size(x), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest, tempfile, shutil
+from common import *
+from chunk_store import chunk_store
+
+class ChunkStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        topol, pdb = mixed()
+        B = topol.design_sparse(mixed_coords(S=3))[1]
+        a = rand.RandomState(0).standard_normal((3, 6, 3))
+        cs = chunk_store(self.dir, cache=1)
+        cs.append(a)
+        cs.append(B)
+        cs.append({"x": [1, 2]})
+        self.assertEqual(len(cs), 3)
+        self.assertTrue(all(cs[0] == a))
+        self.assertTrue(all(cs[1].todense() == B.todense()))
+        self.assertEqual(cs[-1], {"x": [1, 2]})
+        self.assertTrue(all(cs[0] == a)) # read again, past the cache
+        self.assertRaises(IndexError, cs.__getitem__, 3)
+        self.assertEqual(len(list(cs)), 3)
+        d = cs.dir
+        cs.close()
+        self.assertFalse(os.path.exists(d))
+
+    # A nonlinear fit gives the same statistics with chunks on disk.
+    def test_frc_match(self):
+        x, f = water_data(S=20)
+        fms = []
+        for d in [None, self.dir]:
+            fm = water_match(chunk_dir=d)
+            add_tanh(fm)
+            fm.append(x.copy(), f.copy())
+            fms.append(fm)
+        a, b = fms
+        self.assertTrue(isinstance(b.F, chunk_store))
+        for u, v in [(a.D2, b.D2), (a.DF, b.DF), (a.F2, b.F2)]:
+            self.assertTrue(allclose(u, v, rtol=1e-12, atol=1e-14))
+        c = array([0.2, 0.3])
+        self.assertAlmostEqual(a.resid_nonlin("tanh")[0](c),
+                               b.resid_nonlin("tanh")[0](c), 12)
+
+if __name__ == "__main__":
+    unittest.main()
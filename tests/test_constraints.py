@@ -0,0 +1,66 @@
+import unittest
+from hashlib import md5
+from common import *
+
+class Constraints(unittest.TestCase):
+    def setUp(self):
+        rs = rand.RandomState(0)
+        self.P = 8
+        self.C0 = la.qr(rs.standard_normal((self.P, 2)))[0].transpose()
+        V = la.svd(self.C0)[2]
+        self.span = V[2:]
+        self.C = rs.standard_normal((3, self.P))
+
+    def check(self, cons, span, n):
+        self.assertEqual(cons.shape, (n, self.P))
+        self.assertEqual(span.shape, (self.P-n, self.P))
+        Q = concatenate((cons, span))
+        self.assertTrue(allclose(dot(Q, transpose(Q)), identity(self.P)))
+
+    # The new rows are in the constraints, orthogonal to the new span.
+    def test_add(self):
+        cons, span = add_constraints(self.C0, self.span, self.C)
+        self.check(cons, span, 5)
+        self.assertTrue(allclose(cons[:2], self.C0))
+        self.assertTrue(abs(dot(self.C, transpose(span))).max() < 1e-12)
+
+    # Rows already constrained, repeated or past the span are skipped.
+    def test_degenerate(self):
+        C = concatenate((self.C0[:1], self.C[:1], 2.0*self.C[:1]))
+        cons, span = add_constraints(self.C0, self.span, C)
+        self.check(cons, span, 3)
+        C = rand.RandomState(1).standard_normal((self.P+2, self.P))
+        cons, span = add_constraints(self.C0, self.span, C)
+        self.check(cons, span, self.P)
+
+    # A zero precision matrix is reported, after fixing its directions.
+    def test_dimensionality(self):
+        fm = water_match()
+        fm.D2[:] = 0.0
+        fm.alpha[:] = 0.0
+        fm.calpha = 1.0
+        n = len(fm.constraints)
+        w, A = fm.dimensionality(fix=False)
+        key = fm.eig[0]
+        fm.dimensionality(fix=False)
+        self.assertEqual(fm.eig[0], key) # cached
+        self.assertRaises(RuntimeError, fm.calc_theta_stats)
+        self.assertEqual(len(fm.constraints), fm.topol.params)
+        self.assertEqual(len(fm.span), 0)
+        self.assertTrue(n < fm.topol.params)
+
+    # Free directions already in the constraints are not added
+    # again, and the cached eigenvalues follow only the added ones.
+    def test_dimensionality_cache(self):
+        fm = water_match()
+        fm.D2[:] = 0.0
+        fm.alpha[:] = 0.0
+        fm.calpha = 1e-12 # so the constraints are free directions
+        fm.dimensionality()
+        self.assertEqual(len(fm.constraints), fm.topol.params)
+        self.assertEqual(fm.eig[0], md5(fm.calc_iC()).hexdigest())
+        self.assertTrue(allclose(sort(fm.eig[1]),
+                                 la.eigvalsh(fm.calc_iC()), rtol=1e-6, atol=0))
+
+if __name__ == "__main__":
+    unittest.main()
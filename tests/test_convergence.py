@@ -0,0 +1,71 @@
+import unittest, warnings
+from common import *
+
+# R-hat and ESS on chains with known answers.
+class Convergence(unittest.TestCase):
+    def setUp(self):
+        warnings.simplefilter("error", RuntimeWarning)
+
+    def tearDown(self):
+        warnings.resetwarnings()
+
+    def test_iid(self):
+        x = rand.RandomState(0).standard_normal((4, 2000, 2))
+        self.assertTrue(all(abs(rhat(x) - 1.0) < 0.01))
+        N = ess(x)
+        self.assertTrue(all(abs(N/8000.0 - 1.0) < 0.15))
+
+    # AR(1) chains, x_t = r x_{t-1} + e_t, have ESS = mn(1-r)/(1+r).
+    def test_ar1(self):
+        rs = rand.RandomState(1)
+        r = 0.8
+        e = rs.standard_normal((4, 20000, 1))
+        x = zeros(e.shape)
+        x[:,0] = e[:,0]/sqrt(1.0-r*r)
+        for t in range(1, e.shape[1]):
+            x[:,t] = r*x[:,t-1] + e[:,t]
+        N = ess(x)[0]
+        self.assertTrue(abs(N/(80000*(1-r)/(1+r)) - 1.0) < 0.2)
+
+    def test_separated(self):
+        x = rand.RandomState(2).standard_normal((4, 100, 1))
+        x[0] += 10.0
+        self.assertTrue(rhat(x)[0] > 2.0)
+
+    def test_constant(self):
+        x = ones((3, 10, 2))
+        x[:,:,1] = arange(3)[:,newaxis]
+        self.assertEqual(rhat(x)[0], 1.0)
+        self.assertEqual(rhat(x)[1], inf)
+        self.assertEqual(ess(x)[0], 30.0)
+
+    def test_short(self):
+        x = rand.RandomState(3).standard_normal((1, 3, 2))
+        self.assertTrue(all(rhat(x) == inf))
+        self.assertTrue(all(ess(x) == 0.0))
+        x = rand.RandomState(3).standard_normal((1, 8, 2))
+        self.assertTrue(all(isfinite(rhat(x))))
+        self.assertTrue(all(isfinite(ess(x))))
+
+    # Chains draw from their own generators, seeded by the parent,
+    # so with nproc = 1 the parent's global state only advances by
+    # the seeds, and the chains are reproducible.
+    def test_chain_rng(self):
+        warnings.resetwarnings()
+        x, f = water_data(S=20)
+        res = []
+        for i in range(2):
+            fm = water_match()
+            fm.append(x.copy(), f.copy())
+            rand.seed(7)
+            fm.sample_chains(8, skip=2, toss=1, chains=2, nproc=1, check=4)
+            res.append(array(fm.sum_dtheta))
+            self.assertTrue(fm.rng is rand)
+            state = rand.get_state()[1]
+        rand.seed(7)
+        [rand.randint(2**31) for c in range(2)] # one round, 2 chains
+        self.assertTrue((rand.get_state()[1] == state).all())
+        self.assertTrue((res[0] == res[1]).all())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from common import *
+
+class Folds(unittest.TestCase):
+    def setUp(self):
+        self.x, self.f = water_data(S=30)
+        self.fm = water_match()
+        self.fm.set_folds(3, 4)
+        # blocks of 4 frames run across the two calls
+        self.fm.append(self.x[:13].copy(), self.f[:13].copy())
+        self.fm.append(self.x[13:].copy(), self.f[13:].copy())
+        self.fold = (arange(30)/4) % 3
+
+    def stats(self, idx):
+        fm = water_match()
+        fm.append(self.x[idx].copy(), self.f[idx].copy())
+        return fm
+
+    # Each fold holds exactly the frames of its blocks.
+    def test_fold_stats(self):
+        fm = self.fm
+        for k in range(3):
+            a = self.stats(self.fold == k)
+            self.assertEqual(fm.fold_S[k], a.S)
+            for u, v in [(fm.fold_D2[k], a.D2), (fm.fold_DF[k], a.DF),
+                         (fm.fold_F2[k], a.F2)]:
+                self.assertTrue(allclose(u, v, rtol=1e-10, atol=1e-12))
+        self.assertTrue(allclose(sum(fm.fold_D2, 0), fm.D2))
+
+    # Fitting to the other folds and scoring on one.
+    def test_cv_error(self):
+        fm = self.fm
+        fm.z[:] = [2.0, 0.5]
+        fm.alpha[:] = [1.0, 1.0]
+        err = fm.cv_error()
+        for k in range(3):
+            train = self.stats(self.fold != k)
+            test = self.stats(self.fold == k)
+            train.z[:] = fm.z
+            train.alpha[:] = fm.alpha
+            th = train.solve_theta(train.D2, train.DF)
+            r2 = test.F2 + dot(dot(test.D2, th), th) - 2*dot(test.DF, th)
+            self.assertTrue(allclose(err[k],
+                                sqrt(r2/(3.0*fm.nt*test.S)), rtol=1e-6))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from common import *
+from cg_topol.bonds import bond_geom
+from cg_topol.angles import angle_geom
+from cg_topol.ptorsions import torsion_geom
+
+# Terms with the same geometry function share one computation of it.
+class Geometry(unittest.TestCase):
+    def setUp(self):
+        self.topol, self.pdb = mixed()
+        self.x = mixed_coords(S=3)
+
+    def test_shared(self):
+        t = self.topol
+        self.assertEqual(set(t.shared.keys()),
+                         set([bond_geom, angle_geom, torsion_geom]))
+        # sb, pb and ub over 5 + 2 unique edges (2 are shared)
+        self.assertEqual(len(t.shared[bond_geom]), 7)
+        self.assertEqual(len(t.shared[angle_geom]), 5)
+        self.assertEqual(len(t.shared[torsion_geom]), 5)
+        for leaf in t.leaves():
+            if hasattr(leaf, "geom"):
+                g, idx = t.gidx[id(leaf)]
+                self.assertTrue(g is leaf.geom)
+                self.assertTrue(all(t.shared[g][idx] == leaf.ij))
+
+    # The shared geometry gives every term its own design.
+    def test_designs(self):
+        A, B = self.topol.design_sparse(self.x)
+        A0 = self.topol.design(self.x, 0)
+        i = 0
+        D = B.todense()
+        for leaf in self.topol.leaves():
+            if hasattr(leaf, "design_sparse"):
+                a, b = leaf.design_sparse(self.x)
+            else:
+                a, b = leaf.design(self.x, 1)
+                b = BlockDesign.from_dense(b)
+            P = leaf.params
+            self.assertTrue(allclose(A[...,i:i+P], a))
+            self.assertTrue(allclose(A0[...,i:i+P], a))
+            self.assertTrue(allclose(D[...,i:i+P], b.todense()))
+            i += P
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from common import *
+
+class Incremental(unittest.TestCase):
+    def setUp(self):
+        self.x, self.f = water_data(S=40)
+
+    # Data added after sampling ends up in the same sums, and the
+    # state of the chain is kept while its samples are dropped.
+    def test_append_after_sample(self):
+        whole = water_match()
+        whole.append(self.x.copy(), self.f.copy())
+
+        fm = water_match()
+        fm.append(self.x[:25].copy(), self.f[:25].copy())
+        rand.seed(0)
+        fm.sample(2, skip=1, toss=1)
+        self.assertRaises(ValueError, fm.append,
+                          self.x[25:].copy(), self.f[25:].copy())
+        z = fm.z.copy()
+        fm.append(self.x[25:].copy(), self.f[25:].copy(), incremental=True)
+        self.assertEqual(fm.samples, 0)
+        self.assertEqual(len(fm.sum_dtheta), 0)
+        self.assertTrue(all(fm.z == z))
+        self.assertEqual(fm.S, whole.S)
+        for u, v in [(fm.D2, whole.D2), (fm.DF, whole.DF),
+                     (fm.F2, whole.F2)]:
+            self.assertTrue(allclose(u, v, rtol=1e-12, atol=1e-14))
+        fm.sample(2, skip=0, toss=1)
+        self.assertEqual(fm.samples, 2)
+
+if __name__ == "__main__":
+    unittest.main()
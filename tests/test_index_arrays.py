@@ -0,0 +1,40 @@
+import unittest
+from common import *
+from cg_topol.sparse_design import index_array, displacements, \
+                                   scatter_atoms, local_index
+
+# The gathers and scatters against loops over the interaction list.
+class IndexArrays(unittest.TestCase):
+    def setUp(self):
+        self.x = mixed_coords(S=3)
+        self.ij = index_array(mol_tors, 4)
+
+    def test_index_array(self):
+        self.assertEqual(self.ij.shape, (4, 4))
+        self.assertEqual(index_array([], 2).shape, (0, 2))
+        atoms, loc = local_index(mol_edges)
+        self.assertTrue(all(atoms[loc] == array(mol_edges)))
+
+    def test_displacements(self):
+        pairs = [(1,0), (2,1), (2,3)]
+        d = displacements(self.x, self.ij, pairs)
+        ref = array([[self.x[...,t[b],:] - self.x[...,t[a],:]
+                      for a, b in pairs] for t in mol_tors])
+        self.assertTrue(all(d == ref))
+
+    # Atoms shared between interactions are summed.
+    def test_scatter(self):
+        g = rand.RandomState(0).standard_normal((3, 4, 4, 3))
+        F = scatter_atoms(self.x.shape, self.ij, g)
+        ref = zeros(self.x.shape)
+        for m, t in enumerate(mol_tors):
+            for r, i in enumerate(t):
+                ref[:,i] += g[:,m,r]
+        self.assertTrue(allclose(F, ref))
+        # with a trailing parameter axis
+        gp = g[...,newaxis]*arange(1.0, 3.0)
+        Fp = scatter_atoms(self.x.shape + (2,), self.ij, gp, -3)
+        self.assertTrue(allclose(Fp, ref[...,newaxis]*arange(1.0, 3.0)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+from common import *
+
+class ParAppend(unittest.TestCase):
+    def stats(self, fm):
+        return fm.D2, fm.DF, fm.F2, fm.S
+
+    def assertSameStats(self, a, b):
+        for u, v in zip(self.stats(a), self.stats(b)):
+            self.assertTrue(allclose(u, v, rtol=1e-12, atol=1e-14))
+
+    def test_matches_serial(self):
+        x, f = water_data(S=50)
+        ser = water_match()
+        ser.append(x.copy(), f.copy())
+        par = water_match()
+        par.append(x.copy(), f.copy(), nproc=3)
+        self.assertSameStats(ser, par)
+        self.assertTrue(par.pool is None) # temporary pool is stopped
+
+    # One pool serves every append until close_pool().
+    def test_open_pool(self):
+        x, f = water_data(S=50)
+        ser = water_match()
+        par = water_match()
+        par.open_pool(2)
+        pool = par.pool
+        try:
+            for i in range(0, 50, 20):
+                ser.append(x[i:i+20].copy(), f[i:i+20].copy())
+                par.append(x[i:i+20].copy(), f[i:i+20].copy(), nproc=2)
+                self.assertTrue(par.pool is pool)
+        finally:
+            par.close_pool()
+        self.assertTrue(par.pool is None)
+        self.assertSameStats(ser, par)
+
+if __name__ == "__main__":
+    unittest.main()
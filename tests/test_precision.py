@@ -0,0 +1,34 @@
+import unittest
+from common import *
+
+class Precision(unittest.TestCase):
+    # Compensated sums recover what naive float64 sums lose.
+    def test_add_stats(self):
+        s = (array([1.0e8]),)
+        err = (zeros(1),)
+        naive = 1.0e8
+        for i in range(10000):
+            add_stats(s, err, (array([0.1]),))
+            naive += 0.1
+        exact = 1.0e8 + 1000.0
+        self.assertTrue(abs(s[0][0] - exact) < 1e-7)
+        self.assertTrue(abs(s[0][0] - exact) < abs(naive - exact))
+
+    # float32 designs are built as such, and summed in float64, which
+    # keeps the statistics well inside the ~1e-6 relative error of
+    # float32 products.
+    def test_single(self):
+        x, f = water_data(S=100)
+        a = water_match()
+        a.append(x.copy(), f.copy())
+        b = water_match()
+        b.single = True
+        for u, c, A in b.design(x).blocks:
+            self.assertEqual(A.dtype, float32)
+        b.append(x.copy(), f.copy())
+        for u, v in [(a.D2, b.D2), (a.DF, b.DF), (a.F2, b.F2)]:
+            self.assertTrue(abs(u - v).max() < 1e-7*abs(u).max())
+        self.assertEqual(b.D2.dtype, float64)
+
+if __name__ == "__main__":
+    unittest.main()
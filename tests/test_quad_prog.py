@@ -0,0 +1,66 @@
+import unittest
+from common import *
+from itertools import combinations
+from quad_prog import quad_prog, active_set, feasible_point
+
+# Brute force: the best KKT point over all subsets of active rows.
+def brute_force(P, q, G, h):
+    best = None
+    m, n = G.shape
+    for k in range(min(m, n)+1):
+        for W in combinations(range(m), k):
+            W = list(W)
+            K = zeros((n+k, n+k))
+            K[:n,:n] = P
+            K[:n,n:] = transpose(G[W])
+            K[n:,:n] = G[W]
+            try:
+                x = la.solve(K, concatenate((-q, h[W])))[:n]
+            except la.LinAlgError:
+                continue
+            if any(dot(G, x) > h + 1e-9):
+                continue
+            f = 0.5*dot(x, dot(P, x)) + dot(q, x)
+            if best is None or f < best[0]:
+                best = (f, x)
+    return best[1]
+
+class QuadProg(unittest.TestCase):
+    def problem(self, seed, n=4, m=6):
+        rs = rand.RandomState(seed)
+        B = rs.standard_normal((n, n))
+        P = dot(B, transpose(B)) + 0.1*identity(n)
+        return P, rs.standard_normal(n), rs.standard_normal((m, n)), \
+               rs.random_sample(m)
+
+    def test_brute_force(self):
+        for seed in range(10):
+            P, q, G, h = self.problem(seed)
+            x = active_set(P, q, G, h)
+            self.assertTrue(allclose(x, brute_force(P, q, G, h), atol=1e-8))
+
+    # Neither x0 nor 0 is feasible: h < 0 on some rows.
+    def test_phase1(self):
+        for seed in range(10):
+            P, q, G, h = self.problem(seed, m=3)
+            h -= 1.0
+            x0 = feasible_point(G, h, zeros(4))
+            self.assertTrue(all(dot(G, x0) <= h + 1e-8))
+            x = active_set(P, q, G, h, x0=ones(4)*100)
+            self.assertTrue(allclose(x, brute_force(P, q, G, h), atol=1e-8))
+
+    def test_infeasible(self):
+        P = identity(2)
+        G = array([[1.0, 0.0], [-1.0, 0.0]])
+        h = array([-1.0, -1.0]) # x <= -1 and x >= 1
+        self.assertRaises(ValueError, active_set, P, zeros(2), G, h)
+
+    def test_equality(self):
+        P, q, G, h = self.problem(3)
+        A = array([[1.0, 1.0, 0.0, 0.0]])
+        x = quad_prog(P, q, G, h, A, array([0.5]))
+        self.assertAlmostEqual(dot(A[0], x), 0.5)
+        self.assertTrue(all(dot(G, x) <= h + 1e-9))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest, tempfile, shutil
+from common import *
+from cg_topol.ucgrad import write_matrix, read_matrix
+from frc_solve import read_frames, read_coords, read_data
+
+class ReadFrames(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.x, self.f = water_data(S=25)
+        self.xf = os.path.join(self.dir, "t.x")
+        self.ff = os.path.join(self.dir, "t.f")
+        write_matrix(self.xf, self.x.reshape((-1,3)))
+        write_matrix(self.ff, self.f.reshape((-1,3)))
+        # the text files hold fewer digits than x and f
+        self.x = read_matrix(self.xf).reshape(self.x.shape)
+        self.f = read_matrix(self.ff).reshape(self.f.shape)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_blocks(self):
+        atoms = self.x.shape[1]
+        xs, fs = zip(*read_frames(self.xf, self.ff, atoms, blk=7))
+        self.assertEqual(map(len, xs), [7, 7, 7, 4])
+        self.assertTrue(all(concatenate(xs) == self.x))
+        self.assertTrue(all(concatenate(fs) == self.f))
+        xs = list(read_coords(self.xf, atoms, blk=10))
+        self.assertEqual(map(len, xs), [10, 10, 5])
+        self.assertTrue(all(concatenate(xs) == self.x))
+
+    def test_short_forces(self):
+        write_matrix(self.ff, self.f[:20].reshape((-1,3)))
+        frames = read_frames(self.xf, self.ff, self.x.shape[1], blk=7)
+        self.assertRaises(RuntimeError, list, frames)
+
+    # Streaming the files gives the statistics of appending all at once.
+    def test_read_data(self):
+        whole = water_match()
+        whole.append(self.x.copy(), self.f.copy())
+        stream = water_match()
+        read_data(stream, {'x':[self.xf], 'f':[self.ff]})
+        self.assertEqual(stream.S, whole.S)
+        for a, b in [(stream.D2, whole.D2), (stream.DF, whole.DF),
+                     (stream.F2, whole.F2)]:
+            self.assertTrue(allclose(a, b, rtol=1e-12, atol=1e-14))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from common import *
+from num_deriv import num_deriv
+
+# The vectorized residual closures against explicit per-atom sums.
+class ResidNonlin(unittest.TestCase):
+    def setUp(self):
+        fm = water_match()
+        add_tanh(fm)
+        x, f = water_data(S=15)
+        fm.append(x.copy(), f.copy())
+        fm.z[:] = [2.0, 0.5]
+        fm.dtheta = 0.01*rand.RandomState(0).standard_normal(len(fm.theta0))
+        self.fm = fm
+        self.c = array([0.2, 0.3])
+
+    def test_resid(self):
+        fm = self.fm
+        RR, RJ_JJ = fm.resid_nonlin("tanh")
+        sc = fm.dt/sqrt(fm.mass*fm.kT)
+        err = 0.0
+        JJ = zeros((2,2))
+        for i in range(len(fm.F)):
+            s = fm.seeds["tanh"][i]
+            D = fm.seeds["_lin"][i]
+            R = D.dot(fm.theta0 + fm.dtheta) - fm.F[i]
+            J = tanh_J(self.c, s)
+            for a in range(fm.pdb.atoms):
+                w = fm.z[fm.type_index[a]]
+                Ra = R[:,a] + sc[a]*tanh_F(self.c, s[:,a])
+                err += w*sum(Ra*Ra)
+                Ja = sc[a]*J[:,a].reshape((-1,2))
+                JJ += w*dot(transpose(Ja), Ja)
+        self.assertAlmostEqual(RR(self.c), 0.5*err, 10)
+        RJ, JJv = RJ_JJ(self.c)
+        self.assertTrue(allclose(JJv, JJ, rtol=1e-10))
+        self.assertTrue(allclose(RJ, num_deriv(RR, self.c), rtol=1e-6))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest, tempfile, shutil
+from common import *
+from cg_topol.ucgrad import write_matrix, read_matrix
+from frc_solve import select_frames, read_data
+
+def mixed_match():
+    topol, pdb = mixed()
+    return frc_match(topol, pdb, 1.0, 1.0)
+
+# Frame selection (-sel) on a topology with spline, polynomial,
+# improper and LJ terms.
+class Select(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.x = mixed_coords(S=40)
+        self.f = rand.RandomState(4).standard_normal(self.x.shape)
+        self.flags = {'x':[os.path.join(self.dir, "t.x")],
+                      'f':[os.path.join(self.dir, "t.f")]}
+        write_matrix(self.flags['x'][0], self.x.reshape((-1,3)))
+        write_matrix(self.flags['f'][0], self.f.reshape((-1,3)))
+        self.x = read_matrix(self.flags['x'][0]).reshape(self.x.shape)
+        self.f = read_matrix(self.flags['f'][0]).reshape(self.f.shape)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_design_shape(self):
+        topol, pdb = mixed()
+        A = topol.design(self.x, 0)
+        self.assertEqual(A.shape, (40, topol.params))
+        self.assertEqual(topol.design(self.x[0], 0).shape, (topol.params,))
+
+    # Kept frames are appended with weights 1/p.
+    def test_sel(self):
+        fm = mixed_match()
+        w = select_frames(fm, self.flags, 0.5)[0]
+        self.assertEqual(w.shape, (40,))
+        k = w > 0.0
+        self.assertTrue(0 < sum(k) < 40)
+        self.assertTrue(all(w[k] >= 1.0))
+
+        self.flags['sel'] = ['0.5']
+        read_data(fm, self.flags)
+        ref = mixed_match()
+        ref.append(self.x[k].copy(), self.f[k].copy(), w=w[k])
+        self.assertAlmostEqual(fm.S, sum(w))
+        for a, b in [(fm.D2, ref.D2), (fm.DF, ref.DF), (fm.F2, ref.F2)]:
+            self.assertTrue(allclose(a, b, rtol=1e-12, atol=1e-14))
+
+    # A weight of 2 is the same as appending a frame twice.
+    def test_weights(self):
+        w = ones(10)
+        w[:3] = 2.0
+        a = mixed_match()
+        a.append(self.x[:10].copy(), self.f[:10].copy(), w=w)
+        b = mixed_match()
+        b.append(concatenate((self.x[:10], self.x[:3])),
+                 concatenate((self.f[:10], self.f[:3])))
+        self.assertEqual(a.S, b.S)
+        for u, v in [(a.D2, b.D2), (a.DF, b.DF), (a.F2, b.F2)]:
+            self.assertTrue(allclose(u, v, rtol=1e-12, atol=1e-14))
+        # The parallel and fold paths weight the same way.
+        for fm, nproc in [(mixed_match(), 2), (mixed_match(), 1)]:
+            if nproc == 1:
+                fm.set_folds(2, 3)
+            fm.append(self.x[:10].copy(), self.f[:10].copy(), nproc, w=w)
+            self.assertTrue(allclose(fm.D2, a.D2, rtol=1e-12, atol=1e-14))
+            self.assertTrue(allclose(fm.DF, a.DF, rtol=1e-12, atol=1e-14))
+            self.assertAlmostEqual(fm.S, a.S)
+        self.assertAlmostEqual(sum(fm.fold_S), a.S)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest, tempfile, shutil
+from common import *
+
+class Sketch(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.chk = os.path.join(self.dir, "fit.chk")
+        self.x, self.f = water_data(S=40)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameStats(self, a, b):
+        self.assertEqual(a.S, b.S)
+        for u, v in [(a.D2, b.D2), (a.DF, b.DF), (a.F2, b.F2)]:
+            self.assertTrue(allclose(u, v, rtol=1e-12, atol=1e-14))
+
+    # With as many rows as there are force rows, the sketch is close.
+    def test_accuracy(self):
+        exact = water_match()
+        exact.append(self.x.copy(), self.f.copy())
+        fm = water_match()
+        fm.set_sketch(2000, seed=1)
+        fm.append(self.x.copy(), self.f.copy())
+        err = abs(fm.D2 - exact.D2).max()/abs(exact.D2).max()
+        self.assertTrue(err < 0.1)
+
+    # Sketching across a checkpoint gives the same sums as one run.
+    def test_checkpoint(self):
+        whole = water_match()
+        whole.set_sketch(50, seed=1)
+        whole.append(self.x[:15].copy(), self.f[:15].copy())
+        whole.append(self.x[15:].copy(), self.f[15:].copy())
+
+        part = water_match()
+        part.set_sketch(50, seed=1)
+        part.append(self.x[:15].copy(), self.f[:15].copy())
+        part.write_chk(self.chk)
+        rest = water_match()
+        rest.read_chk(self.chk)
+        self.assertSameStats(part, rest)
+        rest.append(self.x[15:].copy(), self.f[15:].copy())
+        self.assertSameStats(whole, rest)
+
+    # Exact data from a checkpoint is kept when sketching starts after.
+    def test_exact_base(self):
+        a = water_match()
+        a.append(self.x[:15].copy(), self.f[:15].copy())
+        a.write_chk(self.chk)
+        b = water_match()
+        b.set_sketch(50, seed=1)
+        b.read_chk(self.chk)
+        b.append(self.x[15:].copy(), self.f[15:].copy())
+        c = water_match()
+        c.append(self.x[:15].copy(), self.f[:15].copy())
+        c.set_sketch(50, seed=1)
+        c.append(self.x[15:].copy(), self.f[15:].copy())
+        self.assertSameStats(b, c)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from common import *
+from sparse_chol import sparse_chol
+
+# A banded matrix, its rows and columns shuffled.
+def banded(n=30, u=3, seed=0):
+    rs = rand.RandomState(seed)
+    B = zeros((n, n))
+    for k in range(u+1):
+        d = rs.standard_normal(n-k)
+        B += diag(d, k) + diag(d, -k)*(k > 0)
+    A = dot(B, transpose(B)) + n*identity(n)
+    p = rs.permutation(n)
+    return A[p][:,p]
+
+class SparseChol(unittest.TestCase):
+    def setUp(self):
+        self.A = banded()
+        self.L = sparse_chol(self.A)
+
+    def test_solve(self):
+        b = rand.RandomState(1).standard_normal((30, 2))
+        self.assertTrue(allclose(self.L.solve(b), la.solve(self.A, b)))
+        self.assertTrue(allclose(self.L.solve(b[:,0]),
+                                 la.solve(self.A, b[:,0])))
+
+    def test_inv_cols(self):
+        C = la.inv(self.A)
+        self.assertTrue(allclose(self.L.inv_cols(4, 11), C[:,4:11]))
+
+    # noise(e) = A^{-1/2} e, so noise(I) noise(I)^T = A^{-1}.
+    def test_noise(self):
+        N = self.L.noise(identity(30))
+        self.assertTrue(allclose(dot(N, transpose(N)), la.inv(self.A)))
+
+    # Any ordering gives the same solution.
+    def test_ordering(self):
+        b = rand.RandomState(1).standard_normal(30)
+        L = sparse_chol(self.A, rand.RandomState(2).permutation(30))
+        self.assertTrue(allclose(L.solve(b), self.L.solve(b)))
+        self.assertTrue(sparse_chol(self.A, self.L.p).u == self.L.u)
+
+    def test_not_pd(self):
+        self.assertRaises(la.LinAlgError, sparse_chol, -self.A)
+
+    # The sparse theta statistics match the dense ones.
+    def test_theta_stats(self):
+        fm = water_match()
+        x, f = water_data(S=20)
+        fm.append(x, f)
+        fm.alpha[:] = [1.0, 0.1]
+        dense = fm.calc_theta_stats()
+        fm.sparse = True
+        for u, v in zip(dense, fm.calc_theta_stats()):
+            self.assertTrue(allclose(u, v, rtol=1e-8))
+        self.assertTrue(fm.sparse_p is not None)
+        # Solves within the span of the constraints are not sparse.
+        self.assertRaises(ValueError, fm.solve_theta, fm.D2, fm.DF)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+from common import *
+
+class ThetaStats(unittest.TestCase):
+    def setUp(self):
+        self.fm = water_match()
+        x, f = water_data(S=30)
+        self.fm.append(x, f)
+        self.fm.z[:] = [2.0, 0.5]
+        self.fm.alpha[:] = [3.0, 0.1]
+
+    # The Cholesky-based statistics match those from an explicit inverse.
+    def test_explicit_inverse(self):
+        fm = self.fm
+        dtheta, dmu2, df2 = fm.calc_theta_stats()
+        C = la.inv(fm.calc_iC())
+        self.assertTrue(allclose(dtheta, dot(C, fm.calc_rhs()), rtol=1e-8))
+        self.assertTrue(allclose(dmu2, [trace(dot(D2, C)) for D2 in fm.D2],
+                                 rtol=1e-8))
+        D2s = sum(fm.D2, 0)
+        fv = [trace(dot(D2s[i:j,i:j], C[i:j,i:j]))
+                for i, j in zip(fm.ind[:-1], fm.ind[1:])]
+        self.assertTrue(allclose(df2, fv, rtol=1e-8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from common import *
+from frc_match import forward_subst, back_subst, chol_inv
+
+class Triangular(unittest.TestCase):
+    def setUp(self):
+        rs = rand.RandomState(0)
+        M = rs.standard_normal((8, 8))
+        self.A = dot(M, transpose(M)) + 8*identity(8)
+        self.L = la.cholesky(self.A)
+        self.b = rs.standard_normal((8, 3))
+
+    def test_subst(self):
+        y = forward_subst(self.L, self.b)
+        self.assertTrue(allclose(dot(self.L, y), self.b))
+        x = back_subst(transpose(self.L), y)
+        self.assertTrue(allclose(x, la.solve(self.A, self.b)))
+        x1 = back_subst(transpose(self.L), y[:,0])
+        self.assertTrue(allclose(x1, x[:,0]))
+
+    def test_chol_inv(self):
+        self.assertTrue(allclose(chol_inv(self.L), la.inv(self.A)))
+
+    # The sampler's mean is the solution within the span of the
+    # constraints, and its noise has covariance iC^{-1} (in the span).
+    def test_draw_theta(self):
+        fm = water_match()
+        x, f = water_data(S=30)
+        fm.append(x, f)
+        b, noise = fm.draw_theta()
+        mean = dot(transpose(fm.span), b[:,1])
+        self.assertTrue(allclose(mean, fm.solve_span(fm.calc_iC(),
+                                                     fm.calc_rhs())))
+        rand.seed(1)
+        e = array([noise() for i in range(4000)])
+        iC = dot(dot(fm.span, fm.calc_iC()), transpose(fm.span))
+        C = la.inv(iC)
+        err = abs(dot(transpose(e), e)/len(e) - C).max()
+        self.assertTrue(err < 0.1*abs(C).max())
+
+if __name__ == "__main__":
+    unittest.main()
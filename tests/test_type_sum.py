@@ -0,0 +1,45 @@
+import unittest
+from common import *
+
+# The per-type reductions must equal sums over the atoms one at a time.
+class TypeSum(unittest.TestCase):
+    def setUp(self):
+        self.fm = water_match(nw=2)
+        rs = rand.RandomState(0)
+        P = self.fm.topol.params
+        self.D = rs.standard_normal((5, 6, 3, P))
+        self.F = rs.standard_normal((5, 6, 3))
+
+    def test_type_sum(self):
+        x = rand.RandomState(1).standard_normal((6, 4))
+        xt = zeros((self.fm.types, 4))
+        for i, t in enumerate(self.fm.type_index):
+            xt[t] += x[i]
+        self.assertTrue(allclose(self.fm.type_sum(x), xt))
+
+    def test_D2_DF(self):
+        fm = self.fm
+        P = self.D.shape[-1]
+        D2 = zeros((fm.types, P, P))
+        DF = zeros((fm.types, P))
+        for D, F in zip(self.D, self.F):
+            for i, t in enumerate(fm.type_index):
+                for j in range(3):
+                    D2[t] += outer(D[i,j], D[i,j])
+                    DF[t] += D[i,j]*F[i,j]
+        fm.type_sum_D2(self.D)
+        fm.type_sum_DF(self.D, self.F)
+        self.assertTrue(allclose(fm.D2, D2, rtol=1e-12, atol=1e-12))
+        self.assertTrue(allclose(fm.DF, DF, rtol=1e-12, atol=1e-12))
+
+        # BlockDesigns take the same path through type_gram/type_rhs.
+        fm.D2[:] = 0.0
+        fm.DF[:] = 0.0
+        B = BlockDesign.from_dense(self.D)
+        fm.type_sum_D2(B)
+        fm.type_sum_DF(B, self.F)
+        self.assertTrue(allclose(fm.D2, D2, rtol=1e-12, atol=1e-12))
+        self.assertTrue(allclose(fm.DF, DF, rtol=1e-12, atol=1e-12))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from common import *
+
+# The pcg sampler must follow changes to D2 and the constraints.
+class WsumSampler(unittest.TestCase):
+    def setUp(self):
+        self.x, self.f = water_data(S=40)
+        self.fm = water_match()
+        self.fm.append(self.x[:20].copy(), self.f[:20].copy())
+        self.fm.z[:] = [2.0, 0.5]
+
+    def mean(self):
+        return self.fm.draw_theta()[0][:,1]
+
+    def check(self):
+        m = self.mean()
+        self.fm.set_sampler('chol')
+        self.assertTrue(allclose(m, self.mean(), rtol=1e-8, atol=1e-10))
+        self.fm.set_sampler('pcg')
+
+    def test_append(self):
+        self.fm.set_sampler('pcg')
+        self.check()
+        self.fm.append(self.x[20:].copy(), self.f[20:].copy())
+        self.check()
+
+    def test_constraints(self):
+        fm = self.fm
+        fm.set_sampler('pcg')
+        self.check()
+        C = rand.RandomState(0).standard_normal((1, fm.topol.params))
+        fm.constraints, fm.span = add_constraints(fm.constraints,
+                                                  fm.span, C)
+        self.check()
+        self.assertEqual(fm.wsum.P, len(fm.span))
+        # iC(w), assembled from the projected roots.
+        iC = dot(dot(fm.span, fm.calc_iC()), transpose(fm.span))
+        self.assertTrue(allclose(fm.wsum.calc_iC(fm.wsum_weights()), iC,
+                                 rtol=1e-8, atol=1e-8*abs(iC).max()))
+        self.assertEqual(fm.wsum.R.shape[1], len(fm.span))
+
+if __name__ == "__main__":
+    unittest.main()